@@ -36,17 +36,27 @@ Recording Keys:
     ESC          : quit
 """
 
-from time import time
+from time import perf_counter, time
+# taken before the imports below, the origin of the startup report
+LAUNCH = perf_counter()
+import weakref
 from carladep import *
-from carladep.functions import find_weather_presets, get_actor_display_name
+import pygame
+from pygame.locals import (KMOD_CTRL, KMOD_SHIFT, K_2, K_3, K_4, K_BACKQUOTE, K_BACKSPACE, K_DOWN, K_EQUALS, K_ESCAPE,
+                           K_F1, K_LEFT, K_MINUS, K_RIGHT, K_SLASH, K_SPACE, K_TAB, K_UP, K_a, K_c, K_d, K_h, K_j,
+                           K_k, K_p, K_q, K_r, K_s, K_w)
+from carladep.functions import filter_blueprints, find_weather_presets, get_actor_display_name
 from carladep.hud import HUD
-from carladep.sensor import CollisionSensor, LaneInvasionSensor, GnssSensor, CameraManager
+from carladep.export import ExportedAgent, build_network, timed_inference
+from carladep.hub import SensorHub
+from carladep.spawn import SpawnPointManager
+from carladep.recorder import RIG_OFFSETS, CameraRig, DatasetEncoder, ImageWriter
+from carladep.inference import CheckpointLoader, InferenceClient, InferenceScheduler, InferenceWorker
+from carladep.profiler import FrameProfiler
+from carladep.timing import StageTimer, StartupTimer
+from carladep.sensor import CollisionSensor, LaneInvasionSensor, GnssSensor, CameraManager, LidarOccupancySensor
+from navigation.misc import compute_curvature, get_speed
 from navigation.roaming_agent import RoamingAgent
-from agent.action_intervention import ActionInterventionAgent
-from agent.intention_intervention import IntentionInterventionAgent
-from policy.Branch import BranchNet
-from policy.ResNet import BasicResNet
-from policy.SelfPred import SelfPred
 
 
 # ==============================================================================
@@ -55,9 +65,24 @@ from policy.SelfPred import SelfPred
 
 
 class World(object):
-    def __init__(self, carla_world, hud, actor_filter, network):
+    def __init__(self, carla_world, hud, actor_filter, network, gains=None, occupancy=False, camera_options=None,
+                 rig=(), encode_processes=2, image_writer=None):
         # ===========================
         self.network = network
+        self.network_name = None
+        self.inference_worker = None
+        self.inference_timer = StageTimer(('preprocess', 'forward', 'postprocess'))
+        self.inference_scheduler = InferenceScheduler()
+        self.inference_frame = 0
+        self.profiler = FrameProfiler()
+        # fetched once, get_map() builds the map from its OpenDRIVE description on every call
+        self.map = carla_world.get_map()
+        self.planner_options = self._find_gain_file(self.map, gains)
+        self.occupancy = occupancy
+        self.fast_respawn = False
+        self.spawn_manager = SpawnPointManager(self.map.get_spawn_points())
+        self.spawn_strategy = 'random'
+        self.camera_options = camera_options or {}
         self.capture_frame = 0
         self.total_frame = 0
         self.render_frame = 0
@@ -65,31 +90,41 @@ class World(object):
         self.datafolder = ''
 
         self.cvs_writer = None
-        self.displaybuffer = None
         self.controller = 'Manual'  # network/manual/PID
         self.condition = 3
         self.capture_fps = 5  # 4 frames save once
         self.recover_time = 0
-        self.save_buff = []
+        self.rig = tuple(rig)
+        self.camera_rig = None
+        self.sensor_hub = SensorHub(required=('camera', 'gnss', 'state') + CameraRig.sources(self.rig))
+        self.encoder = DatasetEncoder(encode_processes)
+        self.image_writer = image_writer
+        self.capture_due = False
         # =============================
         self.world = carla_world
-        self.map = self.world.get_map()
         self.hud = hud
         self.player = None
         self.collision_sensor = None
         self.lane_invasion_sensor = None
         self.gnss_sensor = None
         self.camera_manager = None
+        self.occupancy_sensor = None
+        # last frame before the latest fast respawn took effect, older sensor events are stale
+        self._respawn_frame = None
+        # where the player was teleported to, until a world tick shows it there
+        self._teleport_target = None
         self._weather_presets = find_weather_presets()
         self._weather_index = 0
         self._actor_filter = actor_filter
         self.restart()
         self.world.on_tick(hud.on_world_tick)
+        weak_self = weakref.ref(self)
+        self.world.on_tick(lambda timestamp: World._on_world_tick(weak_self, timestamp))
         self.recording_enabled = False
         self.recording_start = 0
 
-    def restart(self):
-        self.save_buff.clear()
+    def _reset_state(self):
+        self.sensor_hub.reset()
 
         if self.hud.collision_flag or self.hud.simulation_time_init != None:
             self.controller = 'PID'
@@ -97,35 +132,135 @@ class World(object):
         self.controller = 'Manual'
         self.condition = 3
         self.hud.collision_flag = False
+
+    def _free_spawn_point(self):
+        # a spawn point no other vehicle is standing on, any spawn point if all are taken
+        self.spawn_manager.update_from_world(self.world, exclude=(self.player.id,) if self.player is not None else ())
+        points = self.spawn_manager.choose(1, self.spawn_strategy)
+        if points:
+            return points[0]
+        spawn_points = self.map.get_spawn_points()
+        return random.choice(spawn_points) if spawn_points else carla.Transform()
+
+    def reset_inference(self):
+        # results of the frames before the Network controller (re)starts on this one must not steer the car
+        self.inference_frame = self.render_frame
+        self.inference_scheduler.reset()
+        if self.inference_worker is not None:
+            self.inference_worker.clear(self.render_frame)
+
+    def reset_player(self):
+        """Teleport the player to a free spawn point and keep its sensors and planner; falls back to restart."""
+        if self.player is None or not self.spawn_manager.spawn_points:
+            return self.restart()
+        self._reset_state()
+        self.reset_inference()
+        spawn_point = self._free_spawn_point()
+        self.player.set_transform(spawn_point)
+        self.player.set_velocity(carla.Vector3D())
+        self.player.set_angular_velocity(carla.Vector3D())
+        self.player.apply_control(carla.VehicleControl())
+        # the kept sensors may still hold events of the crash, they must not trigger another respawn;
+        # their frames are only known to be stale once a tick shows the player at the spawn point
+        self.collision_sensor.clear()
+        self._teleport_target = spawn_point.location
+        if self.occupancy_sensor is not None:
+            self.occupancy_sensor.grid.clear()
+        # the player's location is only updated by the next tick
+        self.agent.reset(spawn_point.location)
+        self.hud.notification(get_actor_display_name(self.player))
+        self.hud.invalidate()
+
+    def restart(self):
+        self._reset_state()
+        self.reset_inference()
+        self._teleport_target = None
         # Keep same camera config if the camera manager exists.
         cam_index = self.camera_manager.index if self.camera_manager is not None else 0
         cam_pos_index = self.camera_manager.transform_index if self.camera_manager is not None else 0
         # Get a random blueprint.
-        blueprint = random.choice(self.world.get_blueprint_library().filter(self._actor_filter))
+        blueprint = random.choice(filter_blueprints(self.world, self._actor_filter))
         blueprint.set_attribute('role_name', 'hero')
         if blueprint.has_attribute('color'):
             color = blueprint.get_attribute('color').recommended_values[1]
             blueprint.set_attribute('color', color)
         # Spawn the player.
         if self.player is not None:
-            spawn_points = self.map.get_spawn_points()
+            spawn_point = self._free_spawn_point()
             self.destroy()
-            spawn_point = random.choice(spawn_points) if spawn_points else carla.Transform()
             self.player = self.world.try_spawn_actor(blueprint, spawn_point)
         while self.player is None:
-            spawn_points = self.map.get_spawn_points()
-            spawn_point = random.choice(spawn_points) if spawn_points else carla.Transform()
+            spawn_point = self._free_spawn_point()
             self.player = self.world.try_spawn_actor(blueprint, spawn_point)
-        self.agent = RoamingAgent(self.player)
+        self.agent = RoamingAgent(self.player, opt_dict=self.planner_options)
         # # Set up the sensors.
-        self.collision_sensor = CollisionSensor(self.player, self.hud)
-        self.lane_invasion_sensor = LaneInvasionSensor(self.player, self.hud)
-        self.gnss_sensor = GnssSensor(self.player)
-        self.camera_manager = CameraManager(self.player, self.hud)
+        self.collision_sensor = CollisionSensor(self.player, self.hud, hub=self.sensor_hub)
+        self.lane_invasion_sensor = LaneInvasionSensor(self.player, self.hud, hub=self.sensor_hub)
+        self.gnss_sensor = GnssSensor(self.player, hub=self.sensor_hub)
+        self.camera_manager = CameraManager(self.player, self.hud, hub=self.sensor_hub, image_writer=self.image_writer,
+                                            **self.camera_options)
         self.camera_manager.transform_index = cam_pos_index
         self.camera_manager.set_sensor(cam_index, notify=False)
+        if self.occupancy:
+            self.occupancy_sensor = LidarOccupancySensor(self.player)
+        if self.rig:
+            self.camera_rig = CameraRig(self.player, self.camera_manager.transform, self.sensor_hub, names=self.rig)
         actor_type = get_actor_display_name(self.player)
         self.hud.notification(actor_type)
+        self.hud.invalidate()
+
+    @staticmethod
+    def _find_gain_file(carla_map, gains):
+        # --gains accepts a gain file or a folder holding one <Town>.json per town
+        if gains is None:
+            return None
+        path = pathlib.Path(gains)
+        if path.is_dir():
+            path = path / f"{carla_map.name.split('/')[-1]}.json"
+        if not path.exists():
+            logging.warning('no PID gain file found at %s, using LocalPlanner defaults', path)
+            return None
+        logging.info('loading PID gains from %s', path)
+        return {'gain_file': str(path)}
+
+    @staticmethod
+    def _on_world_tick(weak_self, timestamp):
+        # the player state of this tick, for the sensor bundle of the same frame
+        self = weak_self()
+        if not self or self.player is None:
+            return
+        # controller and condition as of this tick, the row is written a few frames later
+        transform = self.player.get_transform()
+        target = self._teleport_target
+        if target is not None and transform.location.distance(target) < 2.0:
+            # first tick with the player at its new spawn point, the sensor events of earlier frames are stale
+            self._respawn_frame = timestamp.frame_count - 1
+            self.collision_sensor.clear(after=self._respawn_frame)
+            self._teleport_target = None
+        state = {'transform': transform, 'control': self.player.get_control(),
+                 'controller': self.controller, 'condition': self.condition}
+        self.sensor_hub.push('state', timestamp.frame_count, state)
+
+    def dispatch_sensor_events(self):
+        # sensor callbacks only queue their events, the HUD flags and notifications are set here
+        if self._teleport_target is not None:
+            # until the teleport shows in a tick, events may still come from the old location
+            return
+        if self.collision_sensor.dispatch(after=self._respawn_frame):
+            # respawns with the 'far' strategy avoid where the player crashed
+            self.spawn_manager.add_collision(self.player.get_location())
+        self.lane_invasion_sensor.dispatch(after=self._respawn_frame)
+
+    def set_network(self, network, name):
+        # a single reference swap, the worker picks the new network up on its next frame
+        self.network = network
+        if self.inference_worker is not None:
+            self.inference_worker.network = network
+        # an exported agent runs its artifact whatever checkpoint name it was loaded under
+        name = getattr(network, 'artifact', name)
+        if name != self.network_name:
+            self.network_name = name
+            self.hud.notification(f'Network {name} loaded')
 
     def next_weather(self, reverse=False):
         self._weather_index += -1 if reverse else 1
@@ -135,42 +270,58 @@ class World(object):
         self.player.get_world().set_weather(preset[0])
 
     def tick(self, clock):
-        self.hud.tick(self, clock)
+        with self.profiler.measure('HUD.tick'):
+            self.hud.tick(self, clock)
 
     def render(self, display):
+        with self.profiler.measure('World.render'):
+            self._render(display)
+
+    def _render(self, display):
         self.camera_manager.render(display)
         # ======================================Recording=========================================================
-        clock = pygame.time.Clock()
         self.render_frame += 1
-        self.displaybuffer = pygame.transform.scale(display, (640, 360))
+        # one row every capture_fps render frames, image and state of a row come from the same simulator frame
+        bundles = self.sensor_hub.drain()
         if self.render_frame % self.capture_fps == 0 and self.capture_true:
-            if len(self.save_buff) < 10:
-                self.save_buff.append(display)
-            else:
-                self.save_buff.append(display)
-                self.capture_frame += 1
-                self.total_frame += 1
-                imagename = f"{str(self.datafolder)}/{self.total_frame}.jpeg"
-                pygame.image.save(pygame.transform.scale(self.save_buff.pop(), (640, 360)), imagename)
-                t = self.player.get_transform()
-                c = self.player.get_control()
-                stage = 'M' if self.controller == 'PID' or self.controller == 'Manual' else 'P'
-                row = {
-                    'imagepath': f"{str(self.datafolder.stem)}/{self.capture_frame}.jpeg",
-                    'Heading': t.rotation.yaw,
-                    'Location': [t.location.x, t.location.y],
-                    'Throttle': c.throttle,
-                    'Steer': c.steer,
-                    'Brake': c.brake,
-                    'Stage': stage,  # 'P'=policy,'M'=Manual
-                    'Condition': self.condition
-                }
-                self.cvs_writer.writerow(row)
+            self.capture_due = True
+        if self.capture_due and self.capture_true and bundles:
+            # a capture due before the sensors caught up takes the next bundle
+            self.capture_due = False
+            self._record(bundles[-1])
         # ======================================End=========================================================
         self.hud.render(display)
 
+    def _record(self, bundle):
+        self.capture_frame += 1
+        self.total_frame += 1
+        imagename = f"{str(self.datafolder)}/{self.total_frame}.jpeg"
+        self.encoder.submit(imagename, bundle.data['camera'])
+        if self.occupancy_sensor is not None and self.occupancy_sensor.grid.scans:
+            # LiDAR hits accumulated since the previous saved frame
+            self.occupancy_sensor.grid.save(f"{str(self.datafolder)}/{self.total_frame}_occupancy.npy", clear=True)
+        state = bundle.data['state']
+        t = state['transform']
+        c = state['control']
+        stage = 'M' if state['controller'] == 'PID' or state['controller'] == 'Manual' else 'P'
+        row = {
+            'imagepath': f"{str(self.datafolder.stem)}/{self.capture_frame}.jpeg",
+            'Heading': t.rotation.yaw,
+            'Location': [t.location.x, t.location.y],
+            'Throttle': c.throttle,
+            'Steer': c.steer,
+            'Brake': c.brake,
+            'Stage': stage,  # 'P'=policy,'M'=Manual
+            'Condition': state['condition']
+        }
+        for name in self.rig:
+            self.encoder.submit(f"{str(self.datafolder)}/{self.total_frame}_{name}.jpeg", bundle.data[f'camera_{name}'])
+            row[f'imagepath_{name}'] = f"{str(self.datafolder.stem)}/{self.capture_frame}_{name}.jpeg"
+        self.cvs_writer.writerow(row)
+
     def destroy_sensors(self):
-        self.camera_manager.sensor.destroy()
+        if self.camera_manager.sensor is not None:
+            self.camera_manager.sensor.destroy()
         self.camera_manager.sensor = None
         self.camera_manager.index = None
 
@@ -178,13 +329,18 @@ class World(object):
         # if self.cvs_writer is not None:self.cvs_writer.close()
         actors = [
             self.camera_manager.sensor,
+            self.camera_manager.capture_sensor,
             self.collision_sensor.sensor,
             self.lane_invasion_sensor.sensor,
             self.gnss_sensor.sensor,
+            self.occupancy_sensor.sensor if self.occupancy_sensor is not None else None,
             self.player]
         for actor in actors:
             if actor is not None:
                 actor.destroy()
+        if self.camera_rig is not None:
+            self.camera_rig.destroy()
+            self.camera_rig = None
 
 
 # ==============================================================================
@@ -193,7 +349,7 @@ class World(object):
 
 
 class KeyboardControl(object):
-    def __init__(self, world, experiment, start_in_Roaming):
+    def __init__(self, world, experiment, start_in_Roaming, network_factory=None, checkpoint_dir=None):
         self._Roaming_enabled = start_in_Roaming
         self._experiment = experiment
         self.hold_condition = False
@@ -202,7 +358,13 @@ class KeyboardControl(object):
         current_iteration = max([int(i.stem[-1]) for i in self.datafolder.glob('iter*')])
         self.iter = f"iter_{current_iteration+1}"
         self.iter_folder = self.datafolder / self.iter
-        world.network.load(f'{self._experiment}_{current_iteration}.pth.tar')
+        if network_factory is None:
+            world.network.load(f'{self._experiment}_{current_iteration}.pth.tar')
+            self.checkpoint_loader = None
+        else:
+            # load in the background, the Network controller stays unavailable until it is ready
+            self.checkpoint_loader = CheckpointLoader(network_factory, self._experiment, current_iteration,
+                                                      directory=checkpoint_dir)
         if isinstance(world.player, carla.Vehicle):
             self._control = carla.VehicleControl()
 
@@ -217,7 +379,10 @@ class KeyboardControl(object):
             world.capture_frame = 0
             world.capture_true = False
             world.hud.notification('Waiting...')
-        world.restart()
+        if world.fast_respawn:
+            world.reset_player()
+        else:
+            world.restart()
 
     def invasion_switch(self, world):
         world.hud.notification(f"Lane invasion Back to {world.controller}")
@@ -227,14 +392,24 @@ class KeyboardControl(object):
         world.hud.laneinvasion_flag = False
 
     def parse_events(self, client, world, clock):
+        world.dispatch_sensor_events()
+        if self.checkpoint_loader is not None:
+            loaded = self.checkpoint_loader.poll()
+            if loaded is not None:
+                world.set_network(*loaded)
+            error = self.checkpoint_loader.error()
+            if error is not None:
+                world.hud.error(error, seconds=10.0)
         period = 1 if world.condition not in [1, 2] else 3
         if world.controller == 'Network' and world.condition in [1, 2]:
             world.controller = 'PID'
             world.recover_time = 0
-        if  world.controller == 'PID' and time()-world.recover_time>period and self._experiment not in ['baseline_1','baseline_4']:
+        if  world.controller == 'PID' and time()-world.recover_time>period and self._experiment not in ['baseline_1','baseline_4'] \
+                and world.network is not None:
         # if world.controller == 'PID' and time() - world.recover_time > period:
             world.controller = 'Network'
             world.recover_time = 0
+            world.reset_inference()
         if world.hud.collision_flag:
             self.collsion_respawn(world)
         if world.hud.laneinvasion_flag:
@@ -256,7 +431,7 @@ class KeyboardControl(object):
                     world.datafolder = folder
                     csvfile = open(f'{str(folder)}_RAW.csv', 'a')
                     fieldnames = ['imagepath', 'Heading', 'Location', 'Throttle', 'Steer', 'Brake', 'Stage',
-                                  'Condition']
+                                  'Condition'] + [f'imagepath_{name}' for name in world.rig]
                     world.cvs_writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
                     world.cvs_writer.writeheader()
 
@@ -292,6 +467,8 @@ class KeyboardControl(object):
                 elif event.key == K_TAB:
 
                     world.camera_manager.toggle_camera()
+                    if world.camera_rig is not None:
+                        world.camera_rig.set_transform(world.camera_manager.transform)
                 elif event.key == K_c and pygame.key.get_mods() & KMOD_SHIFT:
                     world.next_weather(reverse=True)
                 elif event.key == K_c:
@@ -347,7 +524,8 @@ class KeyboardControl(object):
         keys = pygame.key.get_pressed()
         self._parse_vehicle_keys(keys, clock.get_time(), world)
 
-        result = world.agent.run_step()
+        with world.profiler.measure('agent.run_step'):
+            result = world.agent.run_step()
         control = result['control']
         if self.hold_condition == False and result['road'] in [1, 2]:
             self.hold_condition = True
@@ -357,16 +535,48 @@ class KeyboardControl(object):
             control.manual_gear_shift = False
             world.player.apply_control(control)
         elif world.controller == 'Network':
-            # ======================================Network =========================================================
-            state = pygame.surfarray.pixels3d(world.displaybuffer)
-            brake, steer = world.network.inference(state, world.condition)
-
-            # control.brake=brake
-            control.steer = steer
-            world.player.apply_control(control)
+            with world.profiler.measure('inference'):
+                self._network_control(world, control)
         elif world.controller == 'Manual':
             world.player.apply_control(self._control)
 
+    def _network_control(self, world, control):
+        # ======================================Network =========================================================
+        timer = world.inference_timer
+        scheduler = world.inference_scheduler
+        frame_bus = world.camera_manager.frame_bus
+        speed = curvature = 0.0
+        if scheduler.adaptive and world.agent.target_waypoint is not None:
+            speed = get_speed(world.player)
+            curvature = compute_curvature(world.player.get_transform(), world.agent.target_waypoint)
+        acquired = None
+        if scheduler.due(world.render_frame, speed, curvature):
+            acquired = frame_bus.acquire()
+        if acquired is not None:
+            _, state, token = acquired
+            if world.inference_worker is not None:
+                # the frame stays pinned until the worker is done with it
+                world.inference_worker.submit(state, world.condition, world.render_frame,
+                                              release=lambda: frame_bus.release(token))
+            else:
+                try:
+                    brake, steer = timed_inference(world.network, timer, state, world.condition)
+                finally:
+                    frame_bus.release(token)
+
+                # control.brake=brake
+                scheduler.update(world.render_frame, steer)
+        if world.inference_worker is not None:
+            # apply the freshest result
+            result = world.inference_worker.latest()
+            if result is not None and result.frame >= world.inference_frame and result.frame != scheduler.latest_frame:
+                scheduler.update(result.frame, result.steer)
+        # held or extrapolated between inferences
+        steer = scheduler.predict(world.render_frame)
+        if steer is not None:
+            control.steer = steer
+        world.player.apply_control(control)
+
     def _parse_vehicle_keys(self, keys, milliseconds, world):
         self._control.throttle = 1.0 if keys[K_UP] or keys[K_w] else 0.0
         steer_increment = 5e-4 * milliseconds
@@ -418,15 +628,19 @@ class KeyboardControl(object):
 # ==============================================================================
 
 def game_loop(args):
+    startup = StartupTimer(LAUNCH)
+    startup.mark('imports')
     pygame.init()
     pygame.font.init()
     print(f'Experiment: {args.experiment} with {args.policy}')
-    if args.experiment in [1, 2, 3]:
-        policies = {'basic': BasicResNet(), 'branch': BranchNet()}
-        network = ActionInterventionAgent(policies[args.policy], args=args)
+    if args.inference_server:
+        network, network_factory = InferenceClient(args.inference_server, slot=args.inference_slot), None
+    elif args.exported:
+        network, network_factory = None, lambda: ExportedAgent(lambda: build_network(args, selective=False), args.exported)
     else:
-        policies = {'branch': SelfPred()}
-        network = IntentionInterventionAgent(policies[args.policy],args= args)
+        network, network_factory = None, lambda: build_network(args)
+    world = None
+    controller = None
     try:
         client = carla.Client(args.host, args.port)
         client.set_timeout(4.0)
@@ -435,27 +649,71 @@ def game_loop(args):
             (args.width, args.height),
             pygame.HWSURFACE | pygame.DOUBLEBUF)
 
-        hud = HUD(args.width, args.height)
-        world = World(client.get_world(), hud, args.filter, network)
-        controller = KeyboardControl(world, experiment=args.experiment, start_in_Roaming=False)
+        hud = HUD(args.width, args.height, slow_refresh=args.hud_refresh)
+        startup.mark('display')
+        camera_options = {}
+        if args.capture_camera or args.no_display_camera:
+            # the policy and the recorder get their own 640x360 camera
+            camera_options = {'capture_size': (640, 360), 'display': not args.no_display_camera,
+                              'display_tick': args.display_tick}
+        carla_world = client.get_world()
+        startup.mark('connect')
+        world = World(carla_world, hud, args.filter, network, gains=args.gains,
+                      occupancy=args.lidar_occupancy, camera_options=camera_options,
+                      rig=args.rig, encode_processes=args.encode_processes,
+                      image_writer=ImageWriter(args.record_format, compression=args.record_compression,
+                                               memory_budget=args.record_budget * 2**20))
+        startup.mark('world')
+        world.profiler = FrameProfiler(trace=args.trace is not None)
+        world.fast_respawn = args.fast_respawn
+        world.spawn_strategy = args.spawn_strategy
+        world.inference_scheduler = InferenceScheduler(args.inference_every, adaptive=args.adaptive_inference,
+                                                       extrapolate=args.extrapolate_steer)
+        if args.async_inference:
+            world.inference_worker = InferenceWorker(network, timer=world.inference_timer)
+        controller = KeyboardControl(world, experiment=args.experiment, start_in_Roaming=False,
+                                     network_factory=network_factory,
+                                     checkpoint_dir=args.checkpoint_dir if args.hot_swap else None)
+        startup.mark('controller')
 
         clock = pygame.time.Clock()
+        profiler = world.profiler
         while True:
             clock.tick_busy_loop(60)
-            if controller.parse_events(client, world, clock):
-                return
+            with profiler.frame_scope():
+                with profiler.measure('parse_events'):
+                    if controller.parse_events(client, world, clock):
+                        return
 
-            # # as soon as the server is ready continue!
-            # if not world.world.wait_for_tick(10.0):
-            #     continue
+                # # as soon as the server is ready continue!
+                # if not world.world.wait_for_tick(10.0):
+                #     continue
 
-            world.tick(clock)
-            world.render(display)
-            pygame.display.flip()
+                world.tick(clock)
+                world.render(display)
+                with profiler.measure('display.flip'):
+                    pygame.display.flip()
+            if startup is not None:
+                startup.mark('first frame')
+                logging.info(startup.report())
+                startup = None
 
 
     finally:
+        if controller is not None and controller.checkpoint_loader is not None:
+            controller.checkpoint_loader.stop()
         if world is not None:
+            if world.inference_worker is not None:
+                world.inference_worker.stop()
+            if args.inference_stats:
+                path = world.inference_timer.dump(args.inference_stats,
+                                                  {'steer_error': world.inference_scheduler.summary()})
+                print(f'inference timings written to {path}')
+            if args.trace:
+                path = world.profiler.dump_trace(args.trace)
+                print(f'frame trace written to {path}')
+            world.encoder.close()
+            world.image_writer.close()
             world.destroy()
 
         pygame.quit()
@@ -503,9 +761,137 @@ def main():
     argparser.add_argument('--experiment', type=str, default='baseline_2')
     argparser.add_argument('-p', '--policy', type=str, default='branch')
     argparser.add_argument('-t', '--test', type=int, default=0)
+    argparser.add_argument(
+        '--hud-refresh',
+        metavar='SECONDS',
+        default=1.0,
+        type=float,
+        help='refresh interval of the slow-changing HUD fields (default: 1.0)')
+    argparser.add_argument(
+        '--fast-respawn',
+        action='store_true',
+        help='respawn by teleporting the vehicle and keeping its sensors instead of recreating them')
+    argparser.add_argument(
+        '--spawn-strategy',
+        choices=SpawnPointManager.STRATEGIES,
+        default='random',
+        help='how respawns pick a free spawn point: random, far from recent collisions, or spread (default: random)')
+    argparser.add_argument(
+        '--gains',
+        metavar='PATH',
+        default=None,
+        help='PID gain file, or folder of per-town gain files written by tune_pid.py (default: planner defaults)')
+    argparser.add_argument(
+        '--async-inference',
+        action='store_true',
+        help='run the network on a background thread and apply its latest result without blocking')
+    argparser.add_argument(
+        '--selective-branches',
+        action='store_true',
+        help='run only the shared trunk and the branch of the current condition')
+    argparser.add_argument(
+        '--exported',
+        metavar='DIR',
+        default=None,
+        help='run the CPU artifact written by export_policy.py instead of the training checkpoint')
+    argparser.add_argument(
+        '--checkpoint-dir',
+        metavar='DIR',
+        default=None,
+        help='folder of the <experiment>_<N>.pth.tar checkpoints watched by --hot-swap')
+    argparser.add_argument(
+        '--hot-swap',
+        action='store_true',
+        help='load newer checkpoints appearing in --checkpoint-dir while driving (not with --exported)')
+    argparser.add_argument(
+        '--inference-every',
+        metavar='K',
+        default=1,
+        type=int,
+        help='run the network every K frames, the largest interval in adaptive mode (default: 1)')
+    argparser.add_argument(
+        '--adaptive-inference',
+        action='store_true',
+        help='shorten the inference interval with speed and path curvature')
+    argparser.add_argument(
+        '--extrapolate-steer',
+        action='store_true',
+        help='extrapolate steer between inferences instead of holding it')
+    argparser.add_argument(
+        '--inference-stats',
+        metavar='PATH',
+        default=None,
+        help='write inference timing percentiles to PATH at exit (.json or .csv)')
+    argparser.add_argument(
+        '--capture-camera',
+        action='store_true',
+        help='spawn a second camera at 640x360 for the network and the recorder')
+    argparser.add_argument(
+        '--no-display-camera',
+        action='store_true',
+        help='do not spawn the window-size camera, implies --capture-camera')
+    argparser.add_argument(
+        '--display-tick',
+        metavar='SECONDS',
+        default=0.0,
+        type=float,
+        help='seconds between display camera frames with --capture-camera (default: every tick)')
+    argparser.add_argument(
+        '--rig',
+        metavar='NAMES',
+        default='',
+        help='extra dataset cameras next to the capture camera, e.g. left,right (default: none)')
+    argparser.add_argument(
+        '--encode-processes',
+        default=2,
+        type=int,
+        help='processes encoding the dataset images (default: 2)')
+    argparser.add_argument(
+        '--record-format',
+        choices=['png', 'jpeg', 'raw'],
+        default='png',
+        help='format of the images saved by the R recording toggle (default: png)')
+    argparser.add_argument(
+        '--record-compression',
+        default=1,
+        type=int,
+        help='zlib level 0-9 of the raw recording format (default: 1)')
+    argparser.add_argument(
+        '--record-budget',
+        metavar='MB',
+        default=256,
+        type=int,
+        help='memory for recorded images waiting to be written, beyond it frames are dropped (default: 256)')
+    argparser.add_argument(
+        '--lidar-occupancy',
+        action='store_true',
+        help='accumulate LiDAR hits into a bird\'s-eye occupancy grid saved with every captured frame')
+    argparser.add_argument(
+        '--trace',
+        metavar='PATH',
+        default=None,
+        help='record every frame stage and write a Chrome trace-event json to PATH at exit')
+    argparser.add_argument(
+        '--inference-server',
+        metavar='NAME',
+        default=None,
+        help='use the shared inference server started by inference_server.py instead of a local model')
+    argparser.add_argument(
+        '--inference-slot',
+        default=None,
+        type=int,
+        help='slot of this client on the inference server, one per client (default: the first free slot)')
     args = argparser.parse_args()
 
     args.width, args.height = [int(x) for x in args.res.split('x')]
+    args.rig = [name for name in args.rig.split(',') if name]
+    if set(args.rig) - set(RIG_OFFSETS):
+        argparser.error('--rig cameras must be among %s' % ', '.join(RIG_OFFSETS))
+    if args.hot_swap and args.checkpoint_dir is None:
+        argparser.error('--hot-swap needs --checkpoint-dir')
+    if args.hot_swap and (args.exported or args.inference_server):
+        argparser.error('--hot-swap only works with a local training checkpoint, the weights come from '
+                        'the artifact or the inference server otherwise')
 
     log_level = logging.DEBUG if args.debug else logging.INFO
     logging.basicConfig(format='%(levelname)s: %(message)s', level=log_level)
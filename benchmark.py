@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""Benchmark the navigation and client hot paths offline and compare the results between commits"""
+
+import argparse
+import logging
+import os
+import sys
+
+from benchmarks import fake_carla
+
+
+def parse_list(text):
+    """'0,10,50' -> [0, 10, 50]"""
+    return [int(x) for x in text.split(',') if x]
+
+
+def parse_resolutions(text):
+    """'640x360,1280x720' -> [(640, 360), (1280, 720)]"""
+    return [tuple(int(v) for v in x.split('x')) for x in text.split(',') if x]
+
+
+def print_comparison(rows, threshold):
+    print('%-60s %12s %12s %8s' % ('case', 'before ms', 'after ms', 'ratio'))
+    for name, before, after, ratio, status in rows:
+        print('%-60s %12s %12s %8s  %s' % (
+            name,
+            '-' if before is None else '%.4f' % before,
+            '-' if after is None else '%.4f' % after,
+            '-' if ratio is None else '%.2fx' % ratio,
+            status))
+    regressions = [row for row in rows if row[4] == 'regression']
+    print('%d of %d cases slower by more than %.0f%%' % (len(regressions), len(rows), 100 * threshold))
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        '-o', '--output',
+        metavar='PATH',
+        default='benchmark_results.json',
+        help='json file the results are written to (default: benchmark_results.json)')
+    argparser.add_argument(
+        '--compare',
+        metavar='BASELINE',
+        default=None,
+        help='results file of an earlier commit; exits with status 1 if a case regressed')
+    argparser.add_argument(
+        '--load',
+        metavar='PATH',
+        default=None,
+        help='compare this results file with --compare instead of running the benchmarks')
+    argparser.add_argument(
+        '--threshold',
+        default=0.1,
+        type=float,
+        help='relative p50 slowdown counted as a regression (default: 0.1)')
+    argparser.add_argument(
+        '-k', '--select',
+        metavar='NAME',
+        action='append',
+        default=None,
+        help='only run the cases whose name contains NAME, may be repeated')
+    argparser.add_argument(
+        '--npcs',
+        type=parse_list,
+        default=parse_list('0,10,50,100'),
+        help='NPC counts of the agent and HUD benchmarks (default: 0,10,50,100)')
+    argparser.add_argument(
+        '--resolutions',
+        type=parse_resolutions,
+        default=parse_resolutions('640x360,1280x720,1920x1080'),
+        help='window sizes of the HUD and camera benchmarks (default: 640x360,1280x720,1920x1080)')
+    argparser.add_argument(
+        '--town-size',
+        default=5,
+        type=int,
+        help='junctions per side of the synthetic town (default: 5)')
+    argparser.add_argument(
+        '--town-sizes',
+        type=parse_list,
+        default=parse_list('4,8'),
+        help='town sizes of the route planner benchmarks (default: 4,8)')
+    argparser.add_argument(
+        '--route-resolution',
+        default=2.0,
+        type=float,
+        help='sampling resolution of the route planner in meters (default: 2.0)')
+    argparser.add_argument(
+        '--seconds',
+        default=0.5,
+        type=float,
+        help='time spent in the timed calls of each case (default: 0.5)')
+    argparser.add_argument(
+        '--max-calls',
+        default=20000,
+        type=int,
+        help='upper bound of timed calls per case (default: 20000)')
+    argparser.add_argument(
+        '--seed',
+        default=0,
+        type=int,
+        help='seed of the scenes and route choices (default: 0)')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.WARNING)
+
+    # the suite imports navigation and carladep, which must find the stand-in as carla
+    fake_carla.install()
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+    from benchmarks import suite
+
+    if args.load:
+        if not args.compare:
+            argparser.error('--load needs --compare')
+        current = suite.load(args.load)
+    else:
+        results = suite.run(args, select=args.select)
+        path = suite.save(args.output, results, args)
+        print(f'results written to {path}')
+        current = suite.load(path)
+
+    if args.compare:
+        rows = suite.compare(suite.load(args.compare), current, args.threshold)
+        if print_comparison(rows, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,592 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" This module is an offline stand-in for the carla module, used by the benchmark suite.
+
+It implements the subset of the 0.9.5 Python API that navigation/ and carladep/ use, on a synthetic town: a square
+grid of two-way roads with one lane per direction, joined by junctions where every turn but a U-turn is allowed.
+Vehicles are KinematicVehicle bicycle models integrated by World.tick() under the last applied control. Sensors never
+fire on their own, the benchmarks call their callbacks.
+
+install() registers the module as `carla` and must run before navigation or carladep are imported. """
+
+import bisect
+import collections
+import fnmatch
+import itertools
+import math
+import sys
+import types
+
+import numpy as np
+
+
+# ==============================================================================
+# -- Geometry ------------------------------------------------------------------
+# ==============================================================================
+
+
+class Vector3D(object):
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+
+    def __add__(self, other):
+        return type(self)(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return type(self)(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __repr__(self):
+        return '%s(x=%.2f, y=%.2f, z=%.2f)' % (type(self).__name__, self.x, self.y, self.z)
+
+
+class Location(Vector3D):
+    def distance(self, other):
+        return math.sqrt((self.x - other.x) ** 2 + (self.y - other.y) ** 2 + (self.z - other.z) ** 2)
+
+
+class Rotation(object):
+    def __init__(self, pitch=0.0, yaw=0.0, roll=0.0):
+        self.pitch = float(pitch)
+        self.yaw = float(yaw)
+        self.roll = float(roll)
+
+
+class Transform(object):
+    def __init__(self, location=None, rotation=None):
+        self.location = location if location is not None else Location()
+        self.rotation = rotation if rotation is not None else Rotation()
+
+
+class Color(object):
+    def __init__(self, r=0, g=0, b=0, a=255):
+        self.r, self.g, self.b, self.a = r, g, b, a
+
+
+# ==============================================================================
+# -- Enums and controls --------------------------------------------------------
+# ==============================================================================
+
+
+class LaneChange(object):
+    NONE = 0
+    Right = 1
+    Left = 2
+    Both = 3
+
+
+class LaneType(object):
+    NONE = 0
+    Driving = 1
+
+
+class TrafficLightState(object):
+    Red = 0
+    Yellow = 1
+    Green = 2
+
+
+class ColorConverter(object):
+    Raw = 0
+    Depth = 1
+    LogarithmicDepth = 2
+    CityScapesPalette = 3
+
+
+class WeatherParameters(object):
+    ClearNoon = 1
+    CloudyNoon = 2
+    WetNoon = 3
+    HardRainSunset = 4
+
+
+class VehicleControl(object):
+    def __init__(self, throttle=0.0, steer=0.0, brake=0.0, hand_brake=False, reverse=False,
+                 manual_gear_shift=False, gear=0):
+        self.throttle = throttle
+        self.steer = steer
+        self.brake = brake
+        self.hand_brake = hand_brake
+        self.reverse = reverse
+        self.manual_gear_shift = manual_gear_shift
+        self.gear = gear
+
+
+class WalkerControl(object):
+    def __init__(self, speed=0.0, jump=False):
+        self.speed = speed
+        self.jump = jump
+
+
+class _ApplyVehicleControl(object):
+    def __init__(self, actor_id, control):
+        self.actor_id = actor_id
+        self.control = control
+
+
+command = types.SimpleNamespace(ApplyVehicleControl=_ApplyVehicleControl)
+
+
+class Timestamp(object):
+    def __init__(self, frame_count, elapsed_seconds, delta_seconds):
+        self.frame_count = frame_count
+        self.elapsed_seconds = elapsed_seconds
+        self.delta_seconds = delta_seconds
+        self.platform_timestamp = elapsed_seconds
+
+
+class Image(object):
+    """
+    Camera frame with carla's BGRA raw_data layout.
+    """
+
+    def __init__(self, width, height, frame_number=0, raw_data=None):
+        self.width = width
+        self.height = height
+        self.frame_number = frame_number
+        self.raw_data = raw_data if raw_data is not None else bytes(4 * width * height)
+        self.fov = 90.0
+
+    def convert(self, color_converter):
+        pass
+
+    def save_to_disk(self, path, color_converter=None):
+        pass
+
+
+# ==============================================================================
+# -- Map -----------------------------------------------------------------------
+# ==============================================================================
+
+
+class _Lane(object):
+    """
+    Directed polyline of a road lane or of a junction connector, with the lanes it leads to.
+    """
+
+    def __init__(self, index, points, road_id, lane_id, is_junction):
+        self.index = index
+        self.points = [(float(x), float(y)) for x, y in points]
+        self.road_id = road_id
+        self.lane_id = lane_id
+        self.is_junction = is_junction
+        self.successors = []
+        self.cumulative = [0.0]
+        self.yaws = []
+        for (x1, y1), (x2, y2) in zip(self.points[:-1], self.points[1:]):
+            self.cumulative.append(self.cumulative[-1] + math.hypot(x2 - x1, y2 - y1))
+            self.yaws.append(math.degrees(math.atan2(y2 - y1, x2 - x1)))
+        self.length = self.cumulative[-1]
+
+    def transform_at(self, s):
+        i = min(max(bisect.bisect_right(self.cumulative, s) - 1, 0), len(self.yaws) - 1)
+        (x1, y1), (x2, y2) = self.points[i], self.points[i + 1]
+        span = self.cumulative[i + 1] - self.cumulative[i]
+        t = (s - self.cumulative[i]) / span if span > 0 else 0.0
+        return Transform(Location(x1 + t * (x2 - x1), y1 + t * (y2 - y1), 0.0), Rotation(yaw=self.yaws[i]))
+
+
+class Waypoint(object):
+    def __init__(self, lane, s):
+        self._lane = lane
+        self.s = s
+        self.id = hash((lane.index, round(s, 3)))
+        self.road_id = lane.road_id
+        self.section_id = 0
+        self.lane_id = lane.lane_id
+        self.is_intersection = lane.is_junction
+        self.is_junction = lane.is_junction
+        self.lane_width = 3.5
+        self.lane_type = LaneType.Driving
+        self.lane_change = LaneChange.NONE
+        self._transform = None
+
+    @property
+    def transform(self):
+        if self._transform is None:
+            self._transform = self._lane.transform_at(self.s)
+        return self._transform
+
+    @transform.setter
+    def transform(self, transform):
+        self._transform = transform
+
+    def next(self, distance):
+        s = self.s + distance
+        if s <= self._lane.length:
+            return [Waypoint(self._lane, s)]
+        waypoints = []
+        for lane in self._lane.successors:
+            waypoints.extend(Waypoint(lane, 0.0).next(s - self._lane.length))
+        return waypoints
+
+    def get_left_lane(self):
+        return None
+
+    def get_right_lane(self):
+        return None
+
+
+class Map(object):
+    """
+    Grid town of size x size junctions, block metres apart.
+    """
+
+    def __init__(self, size=5, block=80.0, junction_radius=8.0, lane_offset=1.75, name='BenchTown'):
+        self.name = name
+        self._lanes = []
+        # right-hand traffic in carla's left-handed frame: the right of (dx, dy) is (-dy, dx)
+        directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+        center = lambda i, j: np.array([i * block, j * block])
+        road_ids = itertools.count(1)
+        roads = {}
+        incoming = collections.defaultdict(list)
+        outgoing = collections.defaultdict(list)
+        for i, j in itertools.product(range(size), repeat=2):
+            for dx, dy in directions:
+                ni, nj = i + dx, j + dy
+                if not (0 <= ni < size and 0 <= nj < size):
+                    continue
+                key = frozenset([(i, j), (ni, nj)])
+                if key not in roads:
+                    roads[key] = next(road_ids)
+                d, right = np.array([dx, dy]), np.array([-dy, dx])
+                start = center(i, j) + d * junction_radius + right * lane_offset
+                end = center(ni, nj) - d * junction_radius + right * lane_offset
+                lane = self._add_lane([start, end], roads[key], -1 if dx + dy > 0 else 1, False)
+                outgoing[(i, j)].append((d, lane))
+                incoming[(ni, nj)].append((d, lane))
+        for junction in incoming:
+            for d_in, lane_in in incoming[junction]:
+                for d_out, lane_out in outgoing[junction]:
+                    if (d_in == -d_out).all():
+                        continue
+                    start, end = np.array(lane_in.points[-1]), np.array(lane_out.points[0])
+                    if (d_in == d_out).all():
+                        points = [start, end]
+                    else:
+                        # quadratic curve through the corner where the two lanes would meet
+                        corner = start + d_in * np.dot(end - start, d_in)
+                        t = np.linspace(0.0, 1.0, 12)[:, None]
+                        points = (1 - t) ** 2 * start + 2 * (1 - t) * t * corner + t ** 2 * end
+                    connector = self._add_lane(points, next(road_ids), -1, True)
+                    lane_in.successors.append(connector)
+                    connector.successors.append(lane_out)
+        self._build_index()
+
+    def _add_lane(self, points, road_id, lane_id, is_junction):
+        lane = _Lane(len(self._lanes), points, road_id, lane_id, is_junction)
+        self._lanes.append(lane)
+        return lane
+
+    def _build_index(self, spacing=1.0, cell=2.0):
+        # lane samples every `spacing` metres, bucketed by grid cell for get_waypoint
+        samples = []
+        for lane in self._lanes:
+            for s in np.arange(0.0, lane.length + 1e-6, spacing):
+                location = lane.transform_at(s).location
+                samples.append((location.x, location.y, lane.index, s))
+        self._samples = np.array(samples)
+        self._cell = cell
+        buckets = collections.defaultdict(list)
+        for n, key in enumerate(np.floor(self._samples[:, :2] / cell).astype(np.int64).tolist()):
+            buckets[tuple(key)].append(n)
+        self._buckets = {}
+        for cx, cy in buckets:
+            for key in itertools.product((cx - 1, cx, cx + 1), (cy - 1, cy, cy + 1)):
+                if key not in self._buckets:
+                    nearby = [n for dx, dy in itertools.product((-1, 0, 1), repeat=2)
+                              for n in buckets.get((key[0] + dx, key[1] + dy), ())]
+                    self._buckets[key] = [tuple(self._samples[n]) for n in nearby]
+
+    def get_waypoint(self, location, project_to_road=True):
+        x, y = location.x, location.y
+        candidates = self._buckets.get((math.floor(x / self._cell), math.floor(y / self._cell)))
+        if candidates is None:
+            # off the roads, fall back to all the samples
+            n = int(np.argmin((self._samples[:, 0] - x) ** 2 + (self._samples[:, 1] - y) ** 2))
+            _, _, lane, s = self._samples[n]
+        else:
+            _, _, lane, s = min(candidates, key=lambda c: (c[0] - x) ** 2 + (c[1] - y) ** 2)
+        return Waypoint(self._lanes[int(lane)], float(s))
+
+    def get_spawn_points(self):
+        return [lane.transform_at(0.5 * lane.length) for lane in self._lanes if not lane.is_junction]
+
+    def get_topology(self):
+        return [(Waypoint(lane, 0.0), Waypoint(lane, lane.length)) for lane in self._lanes]
+
+    def generate_waypoints(self, distance):
+        return [Waypoint(lane, s) for lane in self._lanes for s in np.arange(0.0, lane.length, distance)]
+
+
+# ==============================================================================
+# -- Blueprints ----------------------------------------------------------------
+# ==============================================================================
+
+
+class ActorAttribute(object):
+    def __init__(self, value, recommended_values=()):
+        self.value = value
+        self.recommended_values = list(recommended_values) or [value]
+
+    def __int__(self):
+        return int(self.value)
+
+    def __str__(self):
+        return str(self.value)
+
+
+class ActorBlueprint(object):
+    def __init__(self, blueprint_id, attributes=None):
+        self.id = blueprint_id
+        self.tags = blueprint_id.split('.')
+        self._attributes = dict(attributes or {})
+
+    def has_attribute(self, name):
+        return name in self._attributes
+
+    def get_attribute(self, name):
+        return self._attributes[name]
+
+    def set_attribute(self, name, value):
+        recommended = self._attributes[name].recommended_values if name in self._attributes else ()
+        self._attributes[name] = ActorAttribute(value, recommended)
+
+    def copy(self):
+        return ActorBlueprint(self.id, self._attributes)
+
+
+class BlueprintLibrary(object):
+    def __init__(self, blueprints):
+        self._blueprints = list(blueprints)
+
+    def find(self, blueprint_id):
+        for blueprint in self._blueprints:
+            if blueprint.id == blueprint_id:
+                return blueprint.copy()
+        raise IndexError('blueprint %r not found' % blueprint_id)
+
+    def filter(self, pattern):
+        return BlueprintLibrary(b.copy() for b in self._blueprints if fnmatch.fnmatch(b.id, pattern))
+
+    def __iter__(self):
+        return iter(self._blueprints)
+
+    def __len__(self):
+        return len(self._blueprints)
+
+    def __getitem__(self, index):
+        return self._blueprints[index]
+
+
+def _vehicle_blueprint(blueprint_id):
+    return ActorBlueprint(blueprint_id, {'number_of_wheels': ActorAttribute('4'),
+                                         'color': ActorAttribute('255,0,0', ['255,0,0', '0,0,255', '20,20,20'])})
+
+
+BLUEPRINTS = [
+    _vehicle_blueprint('vehicle.bench.sedan'),
+    _vehicle_blueprint('vehicle.bench.van'),
+    ActorBlueprint('sensor.camera.rgb'),
+    ActorBlueprint('sensor.lidar.ray_cast'),
+    ActorBlueprint('sensor.other.collision'),
+    ActorBlueprint('sensor.other.lane_invasion'),
+    ActorBlueprint('sensor.other.gnss'),
+]
+
+
+# ==============================================================================
+# -- Actors --------------------------------------------------------------------
+# ==============================================================================
+
+
+class Actor(object):
+    _ids = itertools.count(1)
+
+    def __init__(self, world, type_id, transform, parent=None):
+        self.id = next(Actor._ids)
+        self.type_id = type_id
+        self.parent = parent
+        self.is_alive = True
+        self.attributes = {}
+        self._world = world
+        self._transform = transform
+
+    def get_world(self):
+        return self._world
+
+    def get_transform(self):
+        if self.parent is None:
+            return self._transform
+        parent = self.parent.get_location()
+        offset = self._transform.location
+        return Transform(Location(parent.x + offset.x, parent.y + offset.y, parent.z + offset.z),
+                         self._transform.rotation)
+
+    def get_location(self):
+        return self.get_transform().location
+
+    def set_transform(self, transform):
+        self._transform = transform
+
+    def get_velocity(self):
+        return Vector3D()
+
+    def destroy(self):
+        self.is_alive = False
+        self._world._actors.pop(self.id, None)
+        return True
+
+
+class Vehicle(Actor):
+    def __init__(self, world, type_id, transform, parent=None):
+        from navigation.tuning import KinematicVehicle
+        super(Vehicle, self).__init__(world, type_id, transform, parent)
+        self._model = KinematicVehicle(transform.location.x, transform.location.y, transform.rotation.yaw)
+        self._control = VehicleControl()
+
+    def get_transform(self):
+        return self._model.get_transform()
+
+    def set_transform(self, transform):
+        self._model.x, self._model.y = transform.location.x, transform.location.y
+        self._model.yaw = transform.rotation.yaw
+
+    def get_velocity(self):
+        return self._model.get_velocity()
+
+    def set_velocity(self, velocity):
+        self._model.speed = math.sqrt(velocity.x ** 2 + velocity.y ** 2)
+
+    def set_angular_velocity(self, velocity):
+        pass
+
+    def get_control(self):
+        return self._control
+
+    def apply_control(self, control):
+        self._control = control
+
+    def step(self, dt):
+        self._model.step(self._control.throttle, self._control.steer, self._control.brake, dt)
+
+
+class Sensor(Actor):
+    def __init__(self, world, type_id, transform, parent=None):
+        super(Sensor, self).__init__(world, type_id, transform, parent)
+        self.callback = None
+
+    def listen(self, callback):
+        self.callback = callback
+
+    @property
+    def is_listening(self):
+        return self.callback is not None
+
+    def stop(self):
+        self.callback = None
+
+
+class ActorList(list):
+    def filter(self, pattern):
+        return ActorList(actor for actor in self if fnmatch.fnmatch(actor.type_id, pattern))
+
+
+class DebugHelper(object):
+    def draw_point(self, *args, **kwargs):
+        pass
+
+    def draw_arrow(self, *args, **kwargs):
+        pass
+
+    def draw_string(self, *args, **kwargs):
+        pass
+
+
+# ==============================================================================
+# -- World ---------------------------------------------------------------------
+# ==============================================================================
+
+
+class World(object):
+    """
+    Episode on a grid town. tick() advances the vehicles and runs the on_tick callbacks.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, carla_map=None):
+        self.id = next(World._ids)
+        self.debug = DebugHelper()
+        self.frame = 0
+        self.elapsed_seconds = 0.0
+        self._map = carla_map if carla_map is not None else Map()
+        self._actors = collections.OrderedDict()
+        self._callbacks = []
+        self._library = BlueprintLibrary(BLUEPRINTS)
+
+    def get_map(self):
+        return self._map
+
+    def get_blueprint_library(self):
+        return BlueprintLibrary(self._library)
+
+    def get_actors(self, actor_ids=None):
+        if actor_ids is None:
+            return ActorList(self._actors.values())
+        return ActorList(self._actors[i] for i in actor_ids if i in self._actors)
+
+    def spawn_actor(self, blueprint, transform, attach_to=None):
+        actor_type = Vehicle if blueprint.id.startswith('vehicle.') else \
+            Sensor if blueprint.id.startswith('sensor.') else Actor
+        actor = actor_type(self, blueprint.id, transform, attach_to)
+        self._actors[actor.id] = actor
+        return actor
+
+    def try_spawn_actor(self, blueprint, transform, attach_to=None):
+        return self.spawn_actor(blueprint, transform, attach_to)
+
+    def on_tick(self, callback):
+        self._callbacks.append(callback)
+        return len(self._callbacks)
+
+    def tick(self, dt=0.05):
+        for actor in list(self._actors.values()):
+            if isinstance(actor, Vehicle):
+                actor.step(dt)
+        self.frame += 1
+        self.elapsed_seconds += dt
+        timestamp = Timestamp(self.frame, self.elapsed_seconds, dt)
+        for callback in self._callbacks:
+            callback(timestamp)
+        return self.frame
+
+    def wait_for_tick(self, seconds=10.0):
+        self.tick()
+        return Timestamp(self.frame, self.elapsed_seconds, 0.05)
+
+    def populate(self, vehicles, rng):
+        """
+        Spawn parked vehicles at random spawn points, e.g. the NPCs of a benchmark.
+
+        :param vehicles: number of vehicles
+        :param rng: random.Random used to pick the spawn points
+        :return: list of the spawned carla.Vehicle actors
+        """
+        library = self.get_blueprint_library().filter('vehicle.*')
+        spawn_points = self._map.get_spawn_points()
+        return [self.spawn_actor(rng.choice(list(library)), rng.choice(spawn_points)) for _ in range(vehicles)]
+
+
+def install():
+    """
+    Register this module as `carla`; returns it.
+    """
+    module = sys.modules[__name__]
+    sys.modules['carla'] = module
+    return module
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" This module contains the benchmarks of the navigation and client hot paths.
+
+Every benchmark builds its scene on the fake_carla stand-in and returns the call to time, plus an untimed step that
+advances the scene between calls (apply the control, tick the world). Timings are collected per call with a
+StageTimer, so the results hold the same count/mean/p50/p95/p99/rate summary as the inference timings, in
+milliseconds and calls per second. Absolute numbers include the stand-in's own cost; compare results of the same
+machine between commits.
+
+fake_carla.install() must have run before this module is imported. """
+
+import collections
+import inspect
+import itertools
+import json
+import os
+import pathlib
+import platform
+import random
+import subprocess
+import time
+import types
+import weakref
+
+import numpy as np
+
+import carla
+from carladep.timing import StageTimer
+from navigation.controller import VehiclePIDController
+from navigation.local_planner import LocalPlanner
+from navigation.roaming_agent import RoamingAgent
+
+Case = collections.namedtuple('Case', 'group params call advance')
+
+# registry of benchmark groups, in the order they run
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(group):
+    """
+    Register a generator of Cases under `group`.
+    """
+
+    def register(function):
+        BENCHMARKS[group] = function
+        return function
+    return register
+
+
+def case_name(group, params):
+    """
+    'RoamingAgent.run_step[npcs=10]'
+    """
+    if not params:
+        return group
+    return '%s[%s]' % (group, ','.join('%s=%s' % item for item in params.items()))
+
+
+def _scene(options, npcs=0, size=None):
+    """
+    World with an ego vehicle on the first spawn point and `npcs` parked vehicles.
+    """
+    rng = random.Random(options.seed)
+    world = carla.World(carla.Map(size or options.town_size))
+    spawn_points = world.get_map().get_spawn_points()
+    ego = world.spawn_actor(world.get_blueprint_library().find('vehicle.bench.sedan'), spawn_points[0])
+    world.populate(npcs, rng)
+    return world, ego
+
+
+def _drive(world, vehicle, control):
+    vehicle.apply_control(control)
+    world.tick()
+
+
+# ==============================================================================
+# -- Navigation ----------------------------------------------------------------
+# ==============================================================================
+
+
+@benchmark('VehiclePIDController.run_step')
+def pid_controller(options):
+    world, ego = _scene(options)
+    controller = VehiclePIDController(ego, args_lateral={'K_P': 0.15, 'K_D': 0.002, 'K_I': 20, 'dt': 0.04},
+                                      args_longitudinal={'K_P': 6, 'K_D': 0.05, 'K_I': 2, 'dt': 0.04})
+    waypoint = world.get_map().get_waypoint(ego.get_location()).next(5.0)[0]
+    yield Case('VehiclePIDController.run_step', {}, lambda: controller.run_step(25.0, waypoint), None)
+
+
+@benchmark('LocalPlanner._compute_next_waypoints')
+def compute_next_waypoints(options):
+    world, ego = _scene(options)
+    planner = LocalPlanner(ego)
+    queue = planner._waypoints_queue
+
+    def advance():
+        # keep the queue short of its maxlen, which would turn the call into a no-op
+        if len(queue) > queue.maxlen - 20:
+            last = queue[-1]
+            queue.clear()
+            queue.append(last)
+
+    yield Case('LocalPlanner._compute_next_waypoints', {'k': 10}, lambda: planner._compute_next_waypoints(k=10),
+               advance)
+
+
+@benchmark('LocalPlanner.run_step')
+def local_planner(options):
+    world, ego = _scene(options)
+    planner = LocalPlanner(ego)
+    result = {}
+
+    def call():
+        result['control'] = planner.run_step()['control']
+
+    yield Case('LocalPlanner.run_step', {}, call, lambda: _drive(world, ego, result['control']))
+
+
+@benchmark('RoamingAgent.run_step')
+def roaming_agent(options):
+    for npcs in options.npcs:
+        world, ego = _scene(options, npcs)
+        agent = RoamingAgent(ego)
+        result = {}
+
+        def call(agent=agent, result=result):
+            result['control'] = agent.run_step()['control']
+
+        yield Case('RoamingAgent.run_step', {'npcs': npcs}, call,
+                   lambda world=world, ego=ego, result=result: _drive(world, ego, result['control']))
+
+
+@benchmark('GlobalRoutePlanner.setup')
+def route_planner_setup(options):
+    # networkx is only needed by the route planner
+    from navigation.global_route_planner import GlobalRoutePlanner
+    from navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+    for size in options.town_sizes:
+        carla_map = carla.Map(size)
+
+        def call(carla_map=carla_map):
+            GlobalRoutePlanner(GlobalRoutePlannerDAO(carla_map, options.route_resolution)).setup()
+
+        yield Case('GlobalRoutePlanner.setup', {'town': size}, call, None)
+
+
+@benchmark('GlobalRoutePlanner.trace_route')
+def trace_route(options):
+    from navigation.global_route_planner import GlobalRoutePlanner
+    from navigation.global_route_planner_dao import GlobalRoutePlannerDAO
+    for size in options.town_sizes:
+        carla_map = carla.Map(size)
+        planner = GlobalRoutePlanner(GlobalRoutePlannerDAO(carla_map, options.route_resolution))
+        planner.setup()
+        rng = random.Random(options.seed)
+        locations = [p.location for p in carla_map.get_spawn_points()]
+        pairs = itertools.cycle([tuple(rng.sample(locations, 2)) for _ in range(64)])
+
+        def call(planner=planner, pairs=pairs):
+            planner.trace_route(*next(pairs))
+
+        yield Case('GlobalRoutePlanner.trace_route', {'town': size}, call, None)
+
+
+# ==============================================================================
+# -- Client --------------------------------------------------------------------
+# ==============================================================================
+
+
+def _pygame_fonts():
+    import pygame
+    pygame.font.init()
+    # the HUD renders with the first monospace font installed
+    if not [font for font in pygame.font.get_fonts() if 'mono' in font]:
+        raise RuntimeError('no monospace font installed, the HUD cannot be created')
+    return pygame
+
+
+def _hud_world(options, npcs, width, height):
+    """
+    The attributes of auto_control.World that HUD.tick reads, on a fake scene.
+    """
+    from carladep.hud import HUD
+    from carladep.sensor import CollisionSensor, GnssSensor
+    world, ego = _scene(options, npcs)
+    # slow_refresh=0 collects the vehicle list every tick, the part that grows with the NPCs; older HUDs
+    # without the argument always do, so the same case measures them too
+    hud_options = {'slow_refresh': 0.0} if 'slow_refresh' in inspect.signature(HUD).parameters else {}
+    hud = HUD(width, height, **hud_options)
+    world.on_tick(hud.on_world_tick)
+    state = types.SimpleNamespace(
+        world=world, player=ego, map=world.get_map(), hud=hud,
+        collision_sensor=CollisionSensor(ego, hud), gnss_sensor=GnssSensor(ego),
+        total_frame=0, capture_true=False, condition=3, controller='PID', render_frame=0)
+    ego.apply_control(carla.VehicleControl(throttle=0.5))
+    # the HUD reads the simulation time of the first tick
+    world.tick()
+    return state
+
+
+@benchmark('HUD.tick')
+def hud_tick(options):
+    pygame = _pygame_fonts()
+    width, height = options.resolutions[0]
+    for npcs in options.npcs:
+        state = _hud_world(options, npcs, width, height)
+        clock = pygame.time.Clock()
+        yield Case('HUD.tick', {'npcs': npcs}, lambda state=state, clock=clock: state.hud.tick(state, clock),
+                   state.world.tick)
+
+
+@benchmark('HUD.render')
+def hud_render(options):
+    pygame = _pygame_fonts()
+    for width, height in options.resolutions:
+        state = _hud_world(options, 0, width, height)
+        clock = pygame.time.Clock()
+        display = pygame.Surface((width, height))
+
+        def advance(state=state, clock=clock):
+            state.world.tick()
+            state.hud.tick(state, clock)
+
+        advance()
+        yield Case('HUD.render', {'resolution': '%dx%d' % (width, height)},
+                   lambda state=state, display=display: state.hud.render(display), advance)
+
+
+@benchmark('CameraManager._parse_image')
+def parse_image(options):
+    from carladep.sensor import CameraManager
+    rng = np.random.RandomState(options.seed)
+    for width, height in options.resolutions:
+        world, ego = _scene(options)
+        hud = types.SimpleNamespace(dim=(width, height), notification=lambda *args, **kwargs: None)
+        camera = CameraManager(ego, hud)
+        camera.set_sensor(0, notify=False)
+        weak_camera = weakref.ref(camera)
+        image = carla.Image(width, height, 0, rng.randint(0, 256, 4 * width * height, dtype=np.uint8).tobytes())
+
+        def advance(image=image):
+            image.frame_number += 1
+
+        yield Case('CameraManager._parse_image', {'resolution': '%dx%d' % (width, height)},
+                   lambda camera=camera, weak_camera=weak_camera, image=image:
+                   CameraManager._parse_image(weak_camera, image),
+                   advance)
+
+
+# ==============================================================================
+# -- Runner --------------------------------------------------------------------
+# ==============================================================================
+
+
+def measure(case, seconds=0.5, min_calls=5, max_calls=20000, warmup=3):
+    """
+    Time case.call until `seconds` of calls or max_calls, whichever comes first, after a few warm-up calls.
+
+    :return: StageTimer summary of the case, durations in milliseconds
+    """
+    for _ in range(warmup):
+        case.call()
+        if case.advance is not None:
+            case.advance()
+    timer = StageTimer(window=max_calls)
+    spent = 0.0
+    calls = 0
+    while calls < max_calls and (spent < seconds or calls < min_calls):
+        start = time.perf_counter()
+        case.call()
+        duration = time.perf_counter() - start
+        timer.add('call', 1000.0 * duration)
+        spent += duration
+        calls += 1
+        if case.advance is not None:
+            case.advance()
+    summary = timer.summary()['call']
+    # calls per second of the timed code alone, rate would include the untimed advance step
+    summary['throughput'] = calls / spent if spent > 0 else 0.0
+    return summary
+
+
+def run(options, select=None, log=print):
+    """
+    Run every registered benchmark whose case name contains one of the `select` substrings.
+
+    :return: dict mapping case name to {'group', 'params', summary fields} or {'group', 'skipped': reason}
+    """
+    results = collections.OrderedDict()
+    for group, cases in BENCHMARKS.items():
+        if select and not any(s in group for s in select):
+            continue
+        random.seed(options.seed)
+        try:
+            for case in cases(options):
+                name = case_name(case.group, case.params)
+                if select and not any(s in name for s in select):
+                    continue
+                results[name] = dict(group=case.group, params=case.params,
+                                     **measure(case, options.seconds, max_calls=options.max_calls))
+                log('%-60s p50 %9.3f ms  p95 %9.3f ms  %10.1f calls/s' % (
+                    name, results[name]['p50'], results[name]['p95'], results[name]['throughput']))
+        except (ImportError, RuntimeError) as error:
+            results[group] = {'group': group, 'skipped': str(error)}
+            log('%-60s skipped: %s' % (group, error))
+    return results
+
+
+def environment():
+    """
+    Commit and machine the results were measured on.
+    """
+    root = pathlib.Path(__file__).resolve().parent.parent
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(root), stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpus': os.cpu_count()}
+
+
+def save(path, results, options):
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    content = {'environment': environment(), 'options': vars(options), 'results': results}
+    with open(str(path), 'w') as f:
+        json.dump(content, f, indent=4)
+    return path
+
+
+def load(path):
+    with open(str(path)) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.1, field='p50'):
+    """
+    Pair the cases of two result files.
+
+    :param baseline: content of the older results file
+    :param current: content of the newer results file
+    :param threshold: relative slowdown of `field` above which a case counts as a regression
+    :return: list of (name, baseline ms, current ms, ratio, status) with status 'regression', 'improvement',
+             'same', 'new', 'removed' or 'skipped'
+    """
+    old, new = baseline['results'], current['results']
+    rows = []
+    for name in list(new) + [name for name in old if name not in new]:
+        before = old.get(name, {}).get(field)
+        after = new.get(name, {}).get(field)
+        if before is None or after is None:
+            status = 'new' if name not in old else 'removed' if name not in new else 'skipped'
+            rows.append((name, before, after, None, status))
+            continue
+        ratio = after / before if before > 0 else float('inf')
+        status = 'regression' if ratio > 1.0 + threshold else 'improvement' if ratio < 1.0 - threshold else 'same'
+        rows.append((name, before, after, ratio, status))
+    return rows
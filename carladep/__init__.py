@@ -1,6 +1,16 @@
+import os
 import sys
-sys.path.append('/home/vision/CARLA/PythonAPI/carla/dist/carla-0.9.5-py3.5-linux-x86_64.egg')
-import carla
+try:
+    import carla
+except ImportError:
+    # the simulator's PythonAPI egg, CARLA_EGG points to another install
+    sys.path.append(os.environ.get('CARLA_EGG',
+                                   '/home/vision/CARLA/PythonAPI/carla/dist/carla-0.9.5-py3.5-linux-x86_64.egg'))
+    try:
+        import carla
+    except ImportError:
+        # headless tools (inference_server.py, export_policy.py) only use the torch side of the package
+        carla = None
 
 
 
@@ -9,44 +19,9 @@ import argparse
 import datetime
 import logging
 import random
-import sys
 import pathlib
 import csv
-import pygame
-from pygame.locals import KMOD_CTRL
-from pygame.locals import KMOD_SHIFT
-from pygame.locals import K_0
-from pygame.locals import K_9
-from pygame.locals import K_BACKQUOTE
-from pygame.locals import K_BACKSPACE
-from pygame.locals import K_COMMA
-from pygame.locals import K_DOWN
-from pygame.locals import K_ESCAPE
-from pygame.locals import K_F1
-from pygame.locals import K_LEFT
-from pygame.locals import K_PERIOD
-from pygame.locals import K_RIGHT
-from pygame.locals import K_SLASH
-from pygame.locals import K_SPACE
-from pygame.locals import K_TAB
-from pygame.locals import K_UP
-from pygame.locals import K_a
-from pygame.locals import K_j
-from pygame.locals import K_k
-from pygame.locals import K_c
-from pygame.locals import K_d
-from pygame.locals import K_h
-from pygame.locals import K_m
-from pygame.locals import K_p
-from pygame.locals import K_q
-from pygame.locals import K_r
-from pygame.locals import K_s
-from pygame.locals import K_i
-from pygame.locals import K_1
-from pygame.locals import K_2
-from pygame.locals import K_3
-from pygame.locals import K_4
-from pygame.locals import K_w
-from pygame.locals import K_MINUS
-from pygame.locals import K_EQUALS
-import numpy as np
\ No newline at end of file
+
+# pygame and numpy are left to the modules that use them, so scripts that only
+# need carla or one submodule (spawn_npc.py, inference_server.py) do not load them
+__all__ = ['carla', 'argparse', 'datetime', 'logging', 'random', 'sys', 'pathlib', 'csv']
@@ -0,0 +1,462 @@
+import copy
+import json
+import logging
+import pathlib
+import sys
+import time
+import numpy as np
+from carladep.timing import RollingStats
+
+# ==============================================================================
+# -- Export --------------------------------------------------------------------
+# ==============================================================================
+# torch is imported lazily: the driving client only needs it when it runs a
+# local model, and the agents bring it in themselves.
+
+CONDITIONS = (1, 2, 3)
+
+
+def policy_attribute(agent):
+    """Name of the attribute holding the agent's torch policy module."""
+    import torch
+    names = [name for name, value in vars(agent).items() if isinstance(value, torch.nn.Module)]
+    if not names:
+        raise ValueError('%s holds no torch.nn.Module' % type(agent).__name__)
+    return names[0]
+
+
+def capture_inputs(agent, state, condition):
+    """Run agent.inference once and return the positional arguments its policy forward received."""
+    policy = getattr(agent, policy_attribute(agent))
+    captured = []
+    handle = policy.register_forward_pre_hook(lambda module, args: captured.append(args))
+    try:
+        agent.inference(state, condition)
+    finally:
+        handle.remove()
+    if not captured:
+        raise RuntimeError('agent.inference did not call its policy')
+    return captured[0]
+
+
+def _policy_module(network):
+    """The torch policy of an agent, or of the agent an ExportedAgent/BranchSelectiveAgent wraps; None without one."""
+    # a network that holds a module has imported torch already, remote ones never need it
+    if 'torch' not in sys.modules:
+        return None
+    while network is not None:
+        try:
+            return getattr(network, policy_attribute(network))
+        except ValueError:
+            network = getattr(network, 'agent', None)
+    return None
+
+
+def timed_inference(network, timer, state, condition):
+    """network.inference, timed into the preprocess/forward/postprocess stages of a StageTimer.
+
+    Forward pre- and post-hooks on the policy module, as in capture_inputs,
+    split the call where the agent's preprocessing ends and its
+    postprocessing starts. Networks without a local policy, such as the
+    InferenceClient, are timed as a whole under 'forward'.
+    """
+    policy = _policy_module(network)
+    marks = []
+    handles = []
+    if policy is not None:
+        handles.append(policy.register_forward_pre_hook(lambda module, args: marks.append(time.perf_counter())))
+        handles.append(policy.register_forward_hook(lambda module, args, output: marks.append(time.perf_counter())))
+    start = time.perf_counter()
+    try:
+        result = network.inference(state, condition)
+    finally:
+        for handle in handles:
+            handle.remove()
+    end = time.perf_counter()
+    if len(marks) >= 2:
+        timer.add('preprocess', 1000.0 * (marks[0] - start))
+        timer.add('forward', 1000.0 * (marks[-1] - marks[0]))
+        timer.add('postprocess', 1000.0 * (end - marks[-1]))
+    else:
+        timer.add('forward', 1000.0 * (end - start))
+    return result
+
+
+class _Captured(Exception):
+    pass
+
+
+def _stack(values):
+    """Concatenate per-request tensors of batch size 1 along the batch dimension; python values must agree."""
+    import torch
+    first = values[0]
+    if isinstance(first, torch.Tensor):
+        if not all(isinstance(v, torch.Tensor) and v.dim() and v.shape[0] == 1 and v.shape == first.shape
+                   for v in values):
+            raise ValueError('policy inputs are not batch-size-1 tensors of one shape')
+        return torch.cat(values, dim=0)
+    if not all(v == first for v in values):
+        raise ValueError('policy inputs differ outside of tensors')
+    return first
+
+
+def _take(output, index):
+    """Row `index` of a batched policy output, keeping its batch dimension and container types."""
+    import torch
+    if isinstance(output, torch.Tensor):
+        return output[index:index + 1]
+    if isinstance(output, (tuple, list)):
+        return type(output)(_take(o, index) for o in output)
+    if isinstance(output, dict):
+        return {key: _take(o, index) for key, o in output.items()}
+    return output
+
+
+def batch_inference(agent, states, condition):
+    """agent.inference over many states of one condition, with a single forward of the policy.
+
+    Each state goes through the agent's own preprocessing with the policy
+    forward cut short, as in capture_inputs, and the captured inputs are
+    stacked along the batch dimension. The policy then runs once and every
+    request is replayed through agent.inference with the forward answering
+    its row of the batched output, so the postprocessing is the agent's too.
+    Preprocessing runs twice per request; it is small next to the forward.
+    Inputs that cannot be stacked fall back to one inference per request.
+    """
+    import torch
+    policy = getattr(agent, policy_attribute(agent))
+    own_forward = vars(policy).get('forward')
+    captured = []
+
+    def capture(*args, **kwargs):
+        captured.append((args, kwargs))
+        raise _Captured()
+
+    def answer(row):
+        return lambda *args, **kwargs: row
+
+    def restore():
+        if own_forward is None:
+            vars(policy).pop('forward', None)
+        else:
+            policy.forward = own_forward
+
+    policy.forward = capture
+    try:
+        for state in states:
+            try:
+                agent.inference(state, condition)
+            except _Captured:
+                pass
+    finally:
+        restore()
+    if len(captured) != len(states):
+        raise RuntimeError('agent.inference did not call its policy')
+    try:
+        args = tuple(_stack([c[0][i] for c in captured]) for i in range(len(captured[0][0])))
+        kwargs = {key: _stack([c[1][key] for c in captured]) for key in captured[0][1]}
+    except (ValueError, KeyError, IndexError) as error:
+        logging.debug('no batched forward (%s), running the requests one by one', error)
+        return [agent.inference(state, condition) for state in states]
+    with torch.no_grad():
+        output = policy(*args, **kwargs)
+    results = []
+    try:
+        for index, state in enumerate(states):
+            policy.forward = answer(_take(output, index))
+            results.append(agent.inference(state, condition))
+    finally:
+        restore()
+    return results
+
+
+def batch_path(network):
+    """Callable running network.inference over (states, conditions) with batched forwards, or None if there is none.
+
+    Networks may bring their own batch_inference; agents holding their torch
+    policy module are batched per condition with batch_inference above.
+    """
+    if hasattr(network, 'batch_inference'):
+        return network.batch_inference
+    try:
+        policy_attribute(network)
+    except (ImportError, ValueError):
+        return None
+
+    def run(states, conditions):
+        results = [None] * len(states)
+        for condition in sorted(set(int(c) for c in conditions)):
+            members = [i for i, c in enumerate(conditions) if int(c) == condition]
+            for i, output in zip(members, batch_inference(network, [states[i] for i in members], condition)):
+                results[i] = output
+        return results
+    return run
+
+
+def export_policy(agent, output, sample_state, quantize=False, selective=False, conditions=CONDITIONS):
+    """Trace, optionally int8-quantize and freeze the agent's policy for CPU inference.
+
+    One graph is traced per condition from the exact tensors agent.inference
+    feeds the policy, so a condition passed as a python value is baked in
+    instead of silently fixed to the traced one. With selective=True the
+    branch heads are gated while tracing, so each graph only holds the trunk
+    and its own head; a policy that BranchSelectiveAgent refuses to gate is
+    refused here too. The agent itself is left untouched. The artifact is a
+    folder of condition_<c>.pt files plus a meta.json.
+    """
+    import torch
+    if selective:
+        # refuses policies whose output changes when the inactive heads are zeroed
+        BranchSelectiveAgent(copy.deepcopy(agent), sample_state)
+    output = pathlib.Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    name = policy_attribute(agent)
+    policy = getattr(agent, name)
+    examples = {condition: tuple(a.cpu() if isinstance(a, torch.Tensor) else a
+                                 for a in capture_inputs(agent, sample_state, condition))
+                for condition in conditions}
+    # trace a copy, the agent keeps its own mode, device and branches for parity checks against it
+    module = copy.deepcopy(policy).eval().cpu()
+    if quantize:
+        module = torch.quantization.quantize_dynamic(module, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8)
+    gate = install_branch_gates(module) if selective else None
+    for condition, example in examples.items():
+        if gate is not None:
+            with torch.no_grad():
+                module(*example)  # record the head output shapes with every branch active
+            gate.select(condition)
+        with torch.no_grad():
+            graph = torch.jit.trace(module, example, check_trace=False)
+        if gate is not None:
+            gate.active = None
+        try:
+            graph = torch.jit.freeze(graph)
+        except RuntimeError:
+            logging.warning('could not freeze the condition %d graph, saving it unfrozen', condition)
+        torch.jit.save(graph, str(output / f'condition_{condition}.pt'))
+    meta = {'attribute': name, 'quantized': quantize, 'selective': selective, 'conditions': list(conditions), 'policy': type(policy).__name__}
+    with open(str(output / 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+    return output
+
+
+def _dispatch_module(graphs):
+    import torch
+
+    class ConditionDispatch(torch.nn.Module):
+        """Stands in for the policy module and forwards to the graph traced for the current condition."""
+
+        def __init__(self):
+            super(ConditionDispatch, self).__init__()
+            self.graphs = torch.nn.ModuleDict({str(c): graph for c, graph in graphs.items()})
+            self.condition = CONDITIONS[-1]
+
+        def forward(self, *args):
+            return self.graphs[str(self.condition)](*args)
+
+    return ConditionDispatch()
+
+
+class ExportedAgent(object):
+    """Same inference(state, condition) API as the agents, running an exported artifact.
+
+    The agent is built without weights so its own pre- and postprocessing are
+    kept; only its policy module is replaced by the exported graphs.
+    """
+
+    def __init__(self, factory, artifact):
+        import torch
+        artifact = pathlib.Path(artifact)
+        self.artifact = artifact.name
+        with open(str(artifact / 'meta.json')) as f:
+            self.meta = json.load(f)
+        graphs = {c: torch.jit.load(str(artifact / f'condition_{c}.pt'), map_location='cpu') for c in self.meta['conditions']}
+        self.agent = factory()
+        self._dispatch = _dispatch_module(graphs)
+        setattr(self.agent, self.meta['attribute'], self._dispatch)
+
+    # the graphs keep the batch size they were traced with, so requests run one by one
+    batch_inference = None
+
+    def load(self, checkpoint):
+        # the weights are part of the artifact
+        logging.info('exported policy in use, ignoring checkpoint %s', checkpoint)
+
+    def inference(self, state, condition):
+        self._dispatch.condition = condition if str(condition) in self._dispatch.graphs else CONDITIONS[-1]
+        return self.agent.inference(state, condition)
+
+
+# ==============================================================================
+# -- Branch selection ----------------------------------------------------------
+# ==============================================================================
+
+
+class BranchGate(object):
+    """Shared switch telling gated branches whether to run; active=None runs them all."""
+
+    def __init__(self, branches):
+        self.branches = branches
+        self.active = None
+        self.installed = []
+
+    def uninstall(self):
+        """Put the original heads back into their ModuleLists."""
+        for branches, index, branch in self.installed:
+            branches[index] = branch
+        self.installed = []
+        self.active = None
+
+    def select(self, condition):
+        # 1 left, 2 right, 3 straight; anything else (e.g. 4 lane follow) falls back to the last branch
+        self.active = condition - 1 if 0 < condition <= self.branches else self.branches - 1
+
+
+def _gated_branch(branch, gate, index):
+    import torch
+
+    class GatedBranch(torch.nn.Module):
+        """Runs the wrapped head only when it is the active branch, otherwise returns zeros of its output shape."""
+
+        def __init__(self):
+            super(GatedBranch, self).__init__()
+            self.branch = branch
+            self.shape = None
+
+        def forward(self, x):
+            if gate.active is None or gate.active == index or self.shape is None:
+                out = self.branch(x)
+                self.shape = tuple(out.shape[1:])
+                return out
+            return torch.zeros((x.shape[0],) + self.shape, dtype=x.dtype, device=x.device)
+
+    return GatedBranch()
+
+
+def install_branch_gates(policy):
+    """Wrap every branch of the policy's branch ModuleLists so only the selected one is computed.
+
+    Heads are found as ModuleLists whose name contains 'branch'. The shared
+    trunk is untouched and the inactive heads return zeros, so the policy's
+    own selection of the active head still yields the same output.
+    """
+    import torch
+    lists = [module for name, module in policy.named_modules()
+             if isinstance(module, torch.nn.ModuleList) and 'branch' in name.lower()]
+    if not lists:
+        raise ValueError('%s has no branch ModuleList to gate' % type(policy).__name__)
+    gate = BranchGate(len(lists[0]))
+    for branches in lists:
+        for index in range(len(branches)):
+            gate.installed.append((branches, index, branches[index]))
+            branches[index] = _gated_branch(branches[index], gate, index)
+    return gate
+
+
+class BranchSelectiveAgent(object):
+    """Wraps an agent so inference runs the shared trunk plus the branch of the given condition only.
+
+    Zeroing the inactive heads is only exact when the condition picks a
+    single head, so the wrapper first compares the gated and ungated agent
+    on a sample state for every condition. On a mismatch, e.g. a policy that
+    mixes its heads, the gates are removed again and ValueError is raised.
+    """
+
+    def __init__(self, agent, sample_state=None, tolerance=1e-4):
+        self.agent = agent
+        self.gate = install_branch_gates(getattr(agent, policy_attribute(agent)))
+        if sample_state is None:
+            sample_state = np.random.RandomState(0).randint(0, 256, (640, 360, 3), dtype=np.uint8)
+        try:
+            worst = parity_check(agent, self, [sample_state])
+        except Exception:
+            self.gate.uninstall()
+            raise
+        if max(worst.values()) > tolerance:
+            self.gate.uninstall()
+            raise ValueError('%s does not select a single branch per condition, gating changes its output by %.3g'
+                             % (type(getattr(agent, policy_attribute(agent))).__name__, max(worst.values())))
+
+    def load(self, checkpoint):
+        self.agent.load(checkpoint)
+
+    def inference(self, state, condition):
+        self.gate.select(condition)
+        try:
+            return self.agent.inference(state, condition)
+        finally:
+            self.gate.active = None
+
+    def batch_inference(self, states, conditions):
+        """Group requests by condition and run each group with its branch only, results in request order."""
+        results = [None] * len(states)
+        for condition in sorted(set(int(c) for c in conditions)):
+            members = [i for i, c in enumerate(conditions) if int(c) == condition]
+            self.gate.select(condition)
+            try:
+                if hasattr(self.agent, 'batch_inference'):
+                    outputs = self.agent.batch_inference([states[i] for i in members], [condition] * len(members))
+                else:
+                    outputs = batch_inference(self.agent, [states[i] for i in members], condition)
+            finally:
+                self.gate.active = None
+            for i, output in zip(members, outputs):
+                results[i] = output
+        return results
+
+
+# ==============================================================================
+# -- Parity and benchmark ------------------------------------------------------
+# ==============================================================================
+
+
+def parity_check(reference, candidate, states, conditions=CONDITIONS):
+    """Largest absolute (brake, steer) difference between two networks over states x conditions."""
+    worst = np.zeros(2)
+    for state in states:
+        for condition in conditions:
+            expected = np.asarray(reference.inference(state, condition), dtype=np.float64)
+            actual = np.asarray(candidate.inference(state, condition), dtype=np.float64)
+            worst = np.maximum(worst, np.abs(expected - actual))
+    return {'brake': float(worst[0]), 'steer': float(worst[1])}
+
+
+def benchmark(network, state, condition=3, repeats=200, warmup=20):
+    """Latency summary in ms (RollingStats.summary) and cpu time per call of network.inference."""
+    for _ in range(warmup):
+        network.inference(state, condition)
+    stats = RollingStats(window=repeats)
+    cpu = time.process_time()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        network.inference(state, condition)
+        stats.add(1000.0 * (time.perf_counter() - start))
+    summary = stats.summary()
+    summary['cpu_ms'] = 1000.0 * (time.process_time() - cpu) / repeats
+    return summary
+
+
+# ==============================================================================
+# -- Networks ------------------------------------------------------------------
+# ==============================================================================
+
+
+def build_network(args, selective=True):
+    # the agents and policies pull in torch, import them only when a network is built
+    if args.experiment in [1, 2, 3]:
+        from agent.action_intervention import ActionInterventionAgent
+        from policy.Branch import BranchNet
+        from policy.ResNet import BasicResNet
+        policies = {'basic': BasicResNet(), 'branch': BranchNet()}
+        network = ActionInterventionAgent(policies[args.policy], args=args)
+    else:
+        from agent.intention_intervention import IntentionInterventionAgent
+        from policy.SelfPred import SelfPred
+        policies = {'branch': SelfPred()}
+        network = IntentionInterventionAgent(policies[args.policy],args= args)
+    if selective and getattr(args, 'selective_branches', False):
+        try:
+            network = BranchSelectiveAgent(network)
+        except ValueError as error:
+            logging.warning('selective branches disabled: %s', error)
+    return network
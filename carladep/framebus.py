@@ -0,0 +1,78 @@
+import contextlib
+import threading
+import numpy as np
+
+# ==============================================================================
+# -- FrameBus ------------------------------------------------------------------
+# ==============================================================================
+
+
+class FrameBus(object):
+    """Latest camera frame in the layout the policy expects.
+
+    Camera callbacks publish the raw BGRA buffer; it is resized (nearest
+    neighbour, like pygame.transform.scale) and channel-reordered to RGB in a
+    single np.take pass into one of a few preallocated, contiguous uint8
+    arrays of shape (width, height, 3), the same layout as
+    pygame.surfarray.pixels3d. Readers pin the array they are using so the
+    writer never overwrites it.
+    """
+
+    def __init__(self, size=(640, 360), buffers=4):
+        self.size = size
+        self.frame = None
+        self.published = 0
+        self.dropped = 0
+        self._buffers = [np.zeros((size[0], size[1], 3), dtype=np.uint8) for _ in range(buffers)]
+        self._pins = [0] * buffers
+        self._front = None
+        self._index = None
+        self._source_size = None
+        self._lock = threading.Lock()
+
+    def _build_index(self, width, height):
+        # flat offsets into the (height, width, 4) BGRA source for every (x, y, c) of the output
+        cols = (np.arange(self.size[0]) * width // self.size[0]).astype(np.intp)
+        rows = (np.arange(self.size[1]) * height // self.size[1]).astype(np.intp)
+        channels = np.array([2, 1, 0], dtype=np.intp)
+        self._index = (rows[None, :, None] * width + cols[:, None, None]) * 4 + channels[None, None, :]
+        self._source_size = (width, height)
+
+    def publish(self, image):
+        """Copy a BGRA carla.Image (or anything with raw_data, width, height, frame_number) into the bus."""
+        if self._source_size != (image.width, image.height):
+            self._build_index(image.width, image.height)
+        with self._lock:
+            free = [i for i in range(len(self._buffers)) if i != self._front and self._pins[i] == 0]
+        if not free:
+            self.dropped += 1
+            return
+        back = free[0]
+        raw = np.frombuffer(image.raw_data, dtype=np.uint8)
+        np.take(raw, self._index, out=self._buffers[back], mode='clip')
+        with self._lock:
+            self._front = back
+            self.frame = image.frame_number
+            self.published += 1
+
+    def acquire(self):
+        """Pin the latest frame. Returns (frame, array, token) or None; pass the token to release()."""
+        with self._lock:
+            if self._front is None:
+                return None
+            self._pins[self._front] += 1
+            return self.frame, self._buffers[self._front], self._front
+
+    def release(self, token):
+        with self._lock:
+            self._pins[token] -= 1
+
+    @contextlib.contextmanager
+    def read(self):
+        """with bus.read() as latest: latest is (frame, array) or None while the array is pinned."""
+        acquired = self.acquire()
+        try:
+            yield acquired[:2] if acquired is not None else None
+        finally:
+            if acquired is not None:
+                self.release(acquired[2])
@@ -1,10 +1,48 @@
 from . import carla
+import functools
 import re
+
+
+@functools.lru_cache(maxsize=None)
 def find_weather_presets():
+    # the presets of the carla module never change, scan them once per process
     rgx = re.compile('.+?(?:(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])|$)')
     name = lambda x: ' '.join(m.group(0) for m in rgx.finditer(x))
     presets = [x for x in dir(carla.WeatherParameters) if re.match('[A-Z].+', x)]
-    return [(getattr(carla.WeatherParameters, x), name(x)) for x in presets]
+    return tuple((getattr(carla.WeatherParameters, x), name(x)) for x in presets)
+
+
+_blueprint_libraries = {}
+
+
+def get_blueprint_library(world):
+    """The blueprint library of the world's episode, fetched from the server only once.
+
+    find() and filter() on it run in the client and return copies, so callers
+    can still set attributes on the blueprints they get.
+    """
+    library = _blueprint_libraries.get(world.id)
+    if library is None:
+        library = _blueprint_libraries[world.id] = world.get_blueprint_library()
+    return library
+
+
+_blueprint_filters = {}
+
+
+def filter_blueprints(world, pattern):
+    """get_blueprint_library(world).filter(pattern) as a list of fresh blueprints.
+
+    Only the matching ids are kept per episode and pattern; each call looks
+    them up again with find(), so attributes set on one result never leak
+    into the next.
+    """
+    key = (world.id, pattern)
+    library = get_blueprint_library(world)
+    ids = _blueprint_filters.get(key)
+    if ids is None:
+        ids = _blueprint_filters[key] = tuple(bp.id for bp in library.filter(pattern))
+    return [library.find(bp_id) for bp_id in ids]
 
 
 def get_actor_display_name(actor, truncate=250):
@@ -0,0 +1,138 @@
+import collections
+import threading
+
+# ==============================================================================
+# -- SensorHub -----------------------------------------------------------------
+# ==============================================================================
+
+SensorBundle = collections.namedtuple('SensorBundle', 'frame data')
+
+
+class SensorHub(object):
+    """Collects the outputs of the sensor callbacks by frame number into bundles.
+
+    A bundle is complete once every required source has pushed its data for
+    the frame. Complete bundles go to a bounded queue that drops the oldest
+    bundle when consumers fall behind. Optional sources (e.g. collision
+    events) join the bundle of their frame if it is still pending, otherwise
+    the next one, in a list under their name. Pending frames older than a
+    completed one are evicted and their absent sources counted as missing;
+    required data arriving after its frame was handed out counts as late.
+    """
+
+    def __init__(self, required=('camera', 'gnss', 'state'), maxsize=32, max_pending=64):
+        self.required = tuple(required)
+        self.max_pending = max_pending
+        self.bundles = collections.deque(maxlen=maxsize)
+        self.completed = 0
+        self.dropped = 0
+        self.late = collections.Counter()
+        self.missing = collections.Counter()
+        self._pending = collections.OrderedDict()
+        self._carry = collections.defaultdict(list)
+        self._last = None
+        self._ready = threading.Condition()
+
+    def push(self, source, frame, data):
+        with self._ready:
+            if source not in self.required:
+                self._push_optional(source, frame, data)
+                return
+            if self._last is not None and frame <= self._last:
+                self.late[source] += 1
+                return
+            bundle = self._pending.get(frame)
+            if bundle is None:
+                bundle = self._pending[frame] = {}
+                if len(self._pending) > self.max_pending:
+                    self._evict(next(iter(self._pending)))
+            bundle[source] = data
+            if all(name in bundle for name in self.required):
+                self._complete(frame)
+
+    def _push_optional(self, source, frame, data):
+        if frame in self._pending:
+            self._pending[frame].setdefault(source, []).append(data)
+        else:
+            self._carry[source].append(data)
+
+    def _evict(self, frame):
+        bundle = self._pending.pop(frame)
+        for name in self.required:
+            if name not in bundle:
+                self.missing[name] += 1
+        # keep the events of the incomplete frame for the next bundle
+        for name, value in bundle.items():
+            if name not in self.required:
+                self._carry[name].extend(value)
+
+    def _complete(self, frame):
+        for older in [f for f in self._pending if f < frame]:
+            self._evict(older)
+        data = self._pending.pop(frame)
+        for name, values in self._carry.items():
+            data[name] = values + data.get(name, [])
+        self._carry.clear()
+        self._last = frame
+        if len(self.bundles) == self.bundles.maxlen:
+            self.dropped += 1
+        self.bundles.append(SensorBundle(frame, data))
+        self.completed += 1
+        self._ready.notify_all()
+
+    def get(self, timeout=None):
+        """Oldest complete bundle, waiting up to timeout seconds; None if there is none."""
+        with self._ready:
+            if not self.bundles:
+                self._ready.wait(timeout)
+            return self.bundles.popleft() if self.bundles else None
+
+    def drain(self):
+        """All complete bundles, oldest first."""
+        with self._ready:
+            bundles = list(self.bundles)
+            self.bundles.clear()
+        return bundles
+
+    def reset(self):
+        # after a respawn the frames of the old actors never complete
+        with self._ready:
+            self._pending.clear()
+            self._carry.clear()
+            self.bundles.clear()
+
+    def summary(self):
+        return {'completed': self.completed, 'dropped': self.dropped,
+                'late': dict(self.late), 'missing': dict(self.missing)}
+
+
+# ==============================================================================
+# -- EventChannel --------------------------------------------------------------
+# ==============================================================================
+
+
+class EventChannel(object):
+    """Hands events from one sensor callback thread to the game loop.
+
+    deque.append and deque.popleft are atomic, so the callback only appends
+    and returns, and the loop drains whatever arrived once per frame. When
+    the loop stalls the oldest events beyond maxlen are discarded. Events put
+    with their simulation frame can be dropped on drain when they are stale.
+    """
+
+    def __init__(self, maxlen=256):
+        self._events = collections.deque(maxlen=maxlen)
+
+    def put(self, event, frame=None):
+        self._events.append((frame, event))
+
+    def drain(self, after=None):
+        """Events in arrival order, without those of frames at or before `after`."""
+        events = []
+        while True:
+            try:
+                frame, event = self._events.popleft()
+            except IndexError:
+                return events
+            if after is None or frame is None or frame > after:
+                events.append(event)
@@ -37,15 +37,33 @@ from . import carla
 import pygame
 import datetime
 import math
+import collections
 import sys
+import time
+import numpy as np
 
 def get_actor_display_name(actor, truncate=250):
     name = ' '.join(actor.type_id.replace('_', '.').title().split('.')[1:])
     return (name[:truncate - 1] + u'\u2026') if len(name) > truncate else name
 
+STAGE_COLORS = [(255, 136, 0), (66, 135, 245), (80, 200, 120), (230, 80, 80), (180, 120, 220), (240, 220, 80)]
+
+def _same_items(a, b):
+    # list equality that also holds numpy arrays, e.g. the collision graph
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        if isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
+            if not np.array_equal(x, y):
+                return False
+        elif x != y:
+            return False
+    return True
+
 class HUD(object):
-    def __init__(self, width, height):
+    def __init__(self, width, height, slow_refresh=1.0, line_cache=256):
         self.dim = (width, height)
+        self.slow_refresh = slow_refresh
         font = pygame.font.Font(pygame.font.get_default_font(), 20)
         fonts = [x for x in pygame.font.get_fonts() if 'mono' in x]
         default_font = 'ubuntumono'
@@ -59,6 +77,12 @@ class HUD(object):
         self.simulation_time = 0
         self._show_info = True
         self._info_text = []
+        self._slow_info = None
+        self._slow_time = 0.0
+        self._panel = None
+        self._panel_dirty = True
+        self._lines = collections.OrderedDict()
+        self._line_cache = line_cache
         self._server_clock = pygame.time.Clock()
         self.collision_flag = False
         self.laneinvasion_flag=False
@@ -72,6 +96,78 @@ class HUD(object):
         if self.simulation_time_init==None:
             self.simulation_time_init=timestamp.elapsed_seconds
 
+    def invalidate(self):
+        """Refresh the slow-changing fields on the next tick, e.g. after a respawn."""
+        self._slow_info = None
+
+    def _collect_slow(self, world, clock, t):
+        # counters, statistics, vehicle list, GNSS and names change slowly or are only
+        # readable at a slow pace, they are refreshed every slow_refresh seconds
+        info = {
+            'fps': [
+                'Server:  % 16.0f FPS' % self.server_fps,
+                'Client:  % 16.0f FPS' % clock.get_fps(),
+                ''],
+            'profile': [],
+            'inference': [],
+            'worker': [],
+            'header': [
+                'Vehicle: % 20s' % get_actor_display_name(world.player, truncate=20),
+                'Map:     % 20s' % world.map.name],
+            'gnss': 'GNSS:% 24s' % ('(% 2.6f, % 3.6f)' % (world.gnss_sensor.lat, world.gnss_sensor.lon))}
+        vehicles = world.world.get_actors().filter('vehicle.*')
+        info['vehicles'] = ['Number of vehicles: % 8d' % len(vehicles)]
+        if len(vehicles) > 1:
+            info['vehicles'] += ['Nearby vehicles:']
+            distance = lambda l: math.sqrt((l.x - t.location.x)**2 + (l.y - t.location.y)**2 + (l.z - t.location.z)**2)
+            vehicles = [(distance(x.get_location()), x) for x in vehicles if x.id != world.player.id]
+            for d, vehicle in sorted(vehicles, key=lambda item: item[0]):
+                if d > 200.0:
+                    break
+                vehicle_type = get_actor_display_name(vehicle, truncate=22)
+                info['vehicles'].append('% 4dm %s' % (d, vehicle_type))
+        profiler = getattr(world, 'profiler', None)
+        if profiler is not None and len(profiler.stats['frame']):
+            bar = profiler.stacked()
+            # segments are drawn left to right in the order of the lines below the bar
+            info['profile'] += [('Frame:', bar), 'ms             mean    p95']
+            for name in ('frame',) + tuple(name for name, _ in bar):
+                info['profile'].append('%-14s% 5.1f % 6.1f' % (name, profiler.stats[name].mean(),
+                                                               profiler.stats[name].percentiles((95,))[0]))
+            info['profile'].append('')
+        timer = getattr(world, 'inference_timer', None)
+        if timer is not None and len(timer.stats['forward']):
+            info['inference'] += ['Inference:  % 13.1f /s' % timer.stats['forward'].rate(),
+                                  'ms     p50    p95    p99']
+            for name, label in (('preprocess', 'pre '), ('forward', 'fwd '), ('postprocess', 'post')):
+                info['inference'].append('%s % 6.1f % 6.1f % 6.1f' % ((label,) + tuple(timer.stats[name].percentiles())))
+            scheduler = getattr(world, 'inference_scheduler', None)
+            if scheduler is not None and scheduler.inferences and (scheduler.every > 1 or scheduler.adaptive):
+                per_inference = sum(timer.stats[name].mean() for name in ('preprocess', 'forward', 'postprocess'))
+                saved = scheduler.skipped() * clock.get_fps() * per_inference
+                info['inference'] += [
+                    'Inference every: % 8.1f fr' % (scheduler.frames / scheduler.inferences),
+                    'CPU saved:    % 10.0f ms/s' % saved,
+                    'Steer err p95:  % 11.3f' % scheduler.steer_error.percentiles((95,))[0]]
+            info['inference'].append('')
+        worker = getattr(world, 'inference_worker', None)
+        lag = worker.lag(world.render_frame) if worker is not None else None
+        if lag is not None:
+            info['worker'] += [
+                'Inference lag: % 3d fr % 5.0f ms' % lag,
+                'Inference dropped: % 11d' % worker.dropped]
+        writer = getattr(world, 'image_writer', None)
+        if writer is not None and (writer.written or writer.dropped):
+            info['worker'] += [
+                'Recorded: % 19d' % writer.written,
+                'Recording dropped: % 10d' % writer.dropped]
+        hub = getattr(world, 'sensor_hub', None)
+        if hub is not None and hub.completed:
+            info['worker'] += [
+                'Bundles: % 20d' % hub.completed,
+                'Bundles late/missing: % 4d/%d' % (sum(hub.late.values()), sum(hub.missing.values()))]
+        return info
+
     def tick(self, world, clock):
         self._notifications.tick(world, clock)
         if not self._show_info:
@@ -79,15 +175,17 @@ class HUD(object):
         t = world.player.get_transform()
         v = world.player.get_velocity()
         c = world.player.get_control()
+        now = time.time()
+        if self._slow_info is None or now - self._slow_time >= self.slow_refresh:
+            self._slow_info = self._collect_slow(world, clock, t)
+            self._slow_time = now
+        slow = self._slow_info
         heading = 'N' if abs(t.rotation.yaw) < 89.5 else ''
         heading += 'S' if abs(t.rotation.yaw) > 90.5 else ''
         heading += 'E' if 179.5 > t.rotation.yaw > 0.5 else ''
         heading += 'W' if -0.5 > t.rotation.yaw > -179.5 else ''
-        colhist = world.collision_sensor.get_collision_history()
-        collision = [colhist[x + self.frame_number - 200] for x in range(0, 200)]
-        max_col = max(1.0, max(collision))
-        collision = [x / max_col for x in collision]
-        vehicles = world.world.get_actors().filter('vehicle.*')
+        collision = world.collision_sensor.get_collision_window(self.frame_number, 200)
+        collision = collision / max(1.0, float(collision.max()))
         # if int(self.simulation_time - self.simulation_time_init)>60*10:
         #     world.destroy()
         #     pygame.quit()
@@ -96,54 +194,44 @@ class HUD(object):
             world.destroy()
             pygame.quit()
             sys.exit()
-        self._info_text = [
-            'Server:  % 16.0f FPS' % self.server_fps,
-            'Client:  % 16.0f FPS' % clock.get_fps(),
-            '',
-            'Vehicle: % 20s' % get_actor_display_name(world.player, truncate=20),
-            'Map:     % 20s' % world.map.name,
+        info_text = slow['fps'] + slow['profile'] + slow['inference'] + slow['header'] + [
             'Simulation time: % 12s' % datetime.timedelta(seconds=int(self.simulation_time-self.simulation_time_init)),
             '',
             'Speed:   % 15.0f km/h' % (3.6 * math.sqrt(v.x**2 + v.y**2 + v.z**2)),
             u'Heading:% 16.0f\N{DEGREE SIGN} % 2s' % (t.rotation.yaw, heading),
             'Location:% 20s' % ('(% 5.1f, % 5.1f)' % (t.location.x, t.location.y)),
-            'GNSS:% 24s' % ('(% 2.6f, % 3.6f)' % (world.gnss_sensor.lat, world.gnss_sensor.lon)),
+            slow['gnss'],
             'Height:  % 18.0f m' % t.location.z,
             '']
         data= "Collecting" if world.capture_true else 'Waiting'
         index = world.condition - 1 if 0 < world.condition <= 3 else 2
         cond={0:'left',1:'right',2:'Stright'}
         if isinstance(c, carla.VehicleControl):
-            self._info_text += [
-                ('Throttle:', c.throttle, 0.0, 1.0),
-                ('Steer:', c.steer, -1.0, 1.0),
-                ('Brake:', c.brake, 0.0, 1.0),
+            info_text += [
+                # rounded to what the bars can show, so small jitter does not force a redraw
+                ('Throttle:', round(c.throttle, 2), 0.0, 1.0),
+                ('Steer:', round(c.steer, 2), -1.0, 1.0),
+                ('Brake:', round(c.brake, 2), 0.0, 1.0),
                 (' '),
                 f'Data:         {data}',
                 f'Frame:        {world.total_frame}',
                 f'Condition:        {cond[index]}',
                 'Controller:         ' f'{world.controller}'
 
-            ]
+            ] + slow['worker']
         elif isinstance(c, carla.WalkerControl):
-            self._info_text += [
+            info_text += [
                 ('Speed:', c.speed, 0.0, 5.556),
                 ('Jump:', c.jump)]
-        self._info_text += [
+        info_text += [
             '',
             'Collision:',
             collision,
-            '',
-            'Number of vehicles: % 8d' % len(vehicles)]
-        if len(vehicles) > 1:
-            self._info_text += ['Nearby vehicles:']
-            distance = lambda l: math.sqrt((l.x - t.location.x)**2 + (l.y - t.location.y)**2 + (l.z - t.location.z)**2)
-            vehicles = [(distance(x.get_location()), x) for x in vehicles if x.id != world.player.id]
-            for d, vehicle in sorted(vehicles):
-                if d > 200.0:
-                    break
-                vehicle_type = get_actor_display_name(vehicle, truncate=22)
-                self._info_text.append('% 4dm %s' % (d, vehicle_type))
+            '']
+        info_text += slow['vehicles']
+        if not _same_items(info_text, self._info_text):
+            self._info_text = info_text
+            self._panel_dirty = True
 
     def toggle_info(self):
         self._show_info = not self._show_info
@@ -151,44 +239,74 @@ class HUD(object):
     def notification(self, text, seconds=2.0):
         self._notifications.set_text(text, seconds=seconds)
 
-    def error(self, text):
-        self._notifications.set_text('Error: %s' % text, (255, 0, 0))
+    def error(self, text, seconds=2.0):
+        self._notifications.set_text('Error: %s' % text, (255, 0, 0), seconds=seconds)
+
+    def _line_surface(self, text):
+        # rasterized lines keyed by their text, least recently used evicted first
+        surface = self._lines.get(text)
+        if surface is None:
+            surface = self._font_mono.render(text, True, (255, 255, 255))
+            self._lines[text] = surface
+            if len(self._lines) > self._line_cache:
+                self._lines.popitem(last=False)
+        else:
+            self._lines.move_to_end(text)
+        return surface
+
+    def _draw_panel(self):
+        if self._panel is None:
+            self._panel = pygame.Surface((220, self.dim[1]), pygame.SRCALPHA)
+        panel = self._panel
+        panel.fill((0, 0, 0, 100))
+        v_offset = 4
+        bar_h_offset = 100
+        bar_width = 106
+        for item in self._info_text:
+            if v_offset + 18 > self.dim[1]:
+                break
+            if isinstance(item, (list, np.ndarray)):
+                if len(item) > 1:
+                    values = item.tolist() if isinstance(item, np.ndarray) else item
+                    points = [(x + 8, v_offset + 8 + (1.0 - y) * 30) for x, y in enumerate(values)]
+                    pygame.draw.lines(panel, (255, 136, 0), False, points, 2)
+                item = None
+                v_offset += 18
+            elif isinstance(item, tuple):
+                if isinstance(item[1], bool):
+                    rect = pygame.Rect((bar_h_offset, v_offset + 8), (6, 6))
+                    pygame.draw.rect(panel, (255, 255, 255), rect, 0 if item[1] else 1)
+                elif isinstance(item[1], list):
+                    # stacked bar of (name, ms) segments, full width is two 60 fps frames or the total
+                    scale = bar_width / max(1000.0 / 30, sum(ms for _, ms in item[1]))
+                    x = bar_h_offset
+                    for n, (_, ms) in enumerate(item[1]):
+                        w = ms * scale
+                        rect = pygame.Rect((int(x), v_offset + 6), (max(1, int(x + w) - int(x)), 10))
+                        pygame.draw.rect(panel, STAGE_COLORS[n % len(STAGE_COLORS)], rect)
+                        x += w
+                    pygame.draw.rect(panel, (255, 255, 255), pygame.Rect((bar_h_offset, v_offset + 6), (bar_width, 10)), 1)
+                else:
+                    rect_border = pygame.Rect((bar_h_offset, v_offset + 8), (bar_width, 6))
+                    pygame.draw.rect(panel, (255, 255, 255), rect_border, 1)
+                    f = (item[1] - item[2]) / (item[3] - item[2])
+                    if item[2] < 0.0:
+                        rect = pygame.Rect((bar_h_offset + f * (bar_width - 6), v_offset + 8), (6, 6))
+                    else:
+                        rect = pygame.Rect((bar_h_offset, v_offset + 8), (f * bar_width, 6))
+                    pygame.draw.rect(panel, (255, 255, 255), rect)
+                item = item[0]
+            if item:  # At this point has to be a str.
+                panel.blit(self._line_surface(item), (8, v_offset))
+            v_offset += 18
+        self._panel_dirty = False
 
     def render(self, display):
         if self._show_info:
-            info_surface = pygame.Surface((220, self.dim[1]))
-            info_surface.set_alpha(100)
-            display.blit(info_surface, (0, 0))
-            v_offset = 4
-            bar_h_offset = 100
-            bar_width = 106
-            for item in self._info_text:
-                if v_offset + 18 > self.dim[1]:
-                    break
-                if isinstance(item, list):
-                    if len(item) > 1:
-                        points = [(x + 8, v_offset + 8 + (1.0 - y) * 30) for x, y in enumerate(item)]
-                        pygame.draw.lines(display, (255, 136, 0), False, points, 2)
-                    item = None
-                    v_offset += 18
-                elif isinstance(item, tuple):
-                    if isinstance(item[1], bool):
-                        rect = pygame.Rect((bar_h_offset, v_offset + 8), (6, 6))
-                        pygame.draw.rect(display, (255, 255, 255), rect, 0 if item[1] else 1)
-                    else:
-                        rect_border = pygame.Rect((bar_h_offset, v_offset + 8), (bar_width, 6))
-                        pygame.draw.rect(display, (255, 255, 255), rect_border, 1)
-                        f = (item[1] - item[2]) / (item[3] - item[2])
-                        if item[2] < 0.0:
-                            rect = pygame.Rect((bar_h_offset + f * (bar_width - 6), v_offset + 8), (6, 6))
-                        else:
-                            rect = pygame.Rect((bar_h_offset, v_offset + 8), (f * bar_width, 6))
-                        pygame.draw.rect(display, (255, 255, 255), rect)
-                    item = item[0]
-                if item:  # At this point has to be a str.
-                    surface = self._font_mono.render(item, True, (255, 255, 255))
-                    display.blit(surface, (8, v_offset))
-                v_offset += 18
+            # the panel is only redrawn when one of its values changed
+            if self._panel_dirty or self._panel is None:
+                self._draw_panel()
+            display.blit(self._panel, (0, 0))
         self._notifications.render(display)
         self.help.render(display)
 
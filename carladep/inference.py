@@ -0,0 +1,471 @@
+import collections
+import fcntl
+import logging
+import os
+import pathlib
+import re
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from carladep.export import batch_path, timed_inference
+from carladep.timing import RollingStats
+
+# ==============================================================================
+# -- InferenceWorker -----------------------------------------------------------
+# ==============================================================================
+
+InferenceResult = collections.namedtuple('InferenceResult', ['brake', 'steer', 'condition', 'frame', 'submitted', 'finished'])
+
+
+class InferenceWorker(object):
+    """Runs network.inference on a background thread with latest-frame semantics.
+
+    The game loop submits every frame; only the newest pending frame is kept and
+    older ones are dropped, so the worker never falls behind. The freshest
+    (brake, steer) is published as an InferenceResult that the loop reads
+    without blocking. clear() forgets the result and drops anything submitted
+    before a frame, for when the controller takes over again after a pause.
+    """
+
+    def __init__(self, network, timer=None):
+        self.network = network
+        self.timer = timer
+        self.dropped = 0
+        self.completed = 0
+        self._result = None
+        self._pending = None
+        self._since = None
+        self._running = True
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='InferenceWorker', daemon=True)
+        self._thread.start()
+
+    def submit(self, state, condition, frame, release=None):
+        # state must stay valid until release() is called (e.g. a pinned FrameBus array);
+        # release is also called when the frame is dropped for a newer one.
+        with self._cond:
+            dropped = self._pending
+            self._pending = (state, condition, frame, time.time(), release)
+            self._cond.notify()
+        if dropped is not None:
+            self.dropped += 1
+            if dropped[4] is not None:
+                dropped[4]()
+
+    def latest(self):
+        return self._result
+
+    def clear(self, frame):
+        """Forget the latest result and never publish one for a frame before `frame`."""
+        with self._cond:
+            dropped, self._pending = self._pending, None
+            self._since = frame
+            self._result = None
+        if dropped is not None and dropped[4] is not None:
+            dropped[4]()
+
+    def lag(self, frame):
+        """Age of the latest result as (frames, milliseconds), None before the first result."""
+        result = self._result
+        if result is None:
+            return None
+        return frame - result.frame, 1000.0 * (time.time() - result.submitted)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=2.0)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and self._pending is None:
+                    self._cond.wait()
+                if not self._running:
+                    if self._pending is not None and self._pending[4] is not None:
+                        self._pending[4]()
+                    return
+                state, condition, frame, submitted, release = self._pending
+                self._pending = None
+            try:
+                if self.timer is not None:
+                    brake, steer = timed_inference(self.network, self.timer, state, condition)
+                else:
+                    brake, steer = self.network.inference(state, condition)
+            except Exception:
+                logging.exception('inference failed on frame %d', frame)
+                continue
+            finally:
+                if release is not None:
+                    release()
+            with self._cond:
+                if self._since is not None and frame < self._since:
+                    continue
+                self._result = InferenceResult(brake, steer, condition, frame, submitted, time.time())
+            self.completed += 1
+
+
+# ==============================================================================
+# -- InferenceScheduler --------------------------------------------------------
+# ==============================================================================
+
+
+class InferenceScheduler(object):
+    """Decides on which frames the Network controller runs the policy.
+
+    With a fixed cadence the policy runs every `every` frames. In adaptive
+    mode the interval shrinks from `every` down to 1 as speed or path
+    curvature grow. Between inferences the last steer is held, or linearly
+    extrapolated from the last two results. Each new result is compared with
+    what was being applied to measure the steering error of skipping.
+    reset() starts over after a controller switch or a respawn, so neither a
+    stale steer nor the gap since it reaches the car or the error stats.
+    """
+
+    def __init__(self, every=1, adaptive=False, extrapolate=False, speed_ref=30.0, curvature_ref=0.1):
+        self.every = max(1, every)
+        self.adaptive = adaptive
+        self.extrapolate = extrapolate
+        self.speed_ref = speed_ref  # Km/h at which adaptive mode runs every frame
+        self.curvature_ref = curvature_ref  # 1/m at which adaptive mode runs every frame
+        self.interval = self.every
+        self.frames = 0
+        self.inferences = 0
+        self.steer_error = RollingStats()
+        self._last_run = None
+        self._results = collections.deque(maxlen=2)
+
+    def reset(self):
+        """Forget the previous results and steer error, so nothing is held or extrapolated across a pause.
+
+        frames and inferences keep counting, so skipped() still covers the whole session.
+        """
+        self._last_run = None
+        self._results.clear()
+        self.interval = self.every
+        self.steer_error = RollingStats()
+
+    def due(self, frame, speed=0.0, curvature=0.0):
+        """Called once per frame; True when the policy should run on this frame."""
+        self.frames += 1
+        if self.adaptive:
+            demand = min(1.0, max(speed / self.speed_ref, curvature / self.curvature_ref))
+            self.interval = max(1, int(round(self.every - (self.every - 1) * demand)))
+        if self._last_run is None or frame - self._last_run >= self.interval or frame < self._last_run:
+            self._last_run = frame
+            return True
+        return False
+
+    def update(self, frame, steer):
+        """Record the steer the policy returned for the input of `frame`."""
+        predicted = self.predict(frame)
+        if predicted is not None:
+            self.steer_error.add(abs(steer - predicted))
+        self._results.append((frame, steer))
+        self.inferences += 1
+
+    def predict(self, frame):
+        """Steer to apply on a frame without a fresh inference, None before the first result."""
+        if not self._results:
+            return None
+        last_frame, last_steer = self._results[-1]
+        if not self.extrapolate or len(self._results) < 2:
+            return last_steer
+        first_frame, first_steer = self._results[0]
+        if last_frame == first_frame:
+            return last_steer
+        # extrapolate at most one interval ahead, past that the trend is not worth trusting
+        ahead = min(frame - last_frame, self.every)
+        slope = (last_steer - first_steer) / (last_frame - first_frame)
+        return min(1.0, max(-1.0, last_steer + slope * ahead))
+
+    @property
+    def latest_frame(self):
+        return self._results[-1][0] if self._results else None
+
+    def skipped(self):
+        return 1.0 - self.inferences / self.frames if self.frames else 0.0
+
+    def summary(self):
+        return dict(self.steer_error.summary(), frames=self.frames, inferences=self.inferences,
+                    skipped=self.skipped())
+
+
+# ==============================================================================
+# -- CheckpointLoader ----------------------------------------------------------
+# ==============================================================================
+
+
+class CheckpointLoader(object):
+    """Builds, loads and warms up networks on a background thread.
+
+    The checkpoint of the current iteration is loaded first; if a directory
+    is given it is then polled for newer '<experiment>_<N>.pth.tar' files,
+    which are loaded by their full path. Each ready network is handed over
+    through poll(), which the game loop calls between frames so the running
+    agent is swapped atomically; a failed load of the current iteration is
+    reported once through error().
+    """
+
+    def __init__(self, factory, experiment, iteration, directory=None, interval=10.0, warmup_size=(640, 360)):
+        self.factory = factory
+        self.experiment = experiment
+        self.iteration = iteration
+        self.directory = pathlib.Path(directory) if directory is not None else None
+        self.interval = interval
+        self.warmup_size = warmup_size
+        self._pattern = re.compile(re.escape(experiment) + r'_(\d+)\.pth\.tar$')
+        self._ready = None
+        self._error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='CheckpointLoader', daemon=True)
+        self._thread.start()
+
+    def poll(self):
+        """Returns (network, checkpoint name) once when a new network is ready, None otherwise."""
+        with self._lock:
+            ready, self._ready = self._ready, None
+        return ready
+
+    def error(self):
+        """Returns the message of a failed initial load once, None otherwise."""
+        with self._lock:
+            error, self._error = self._error, None
+        return error
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+    def _newest(self):
+        newest = None
+        for path in self.directory.glob(f'{self.experiment}_*.pth.tar'):
+            match = self._pattern.match(path.name)
+            if match and (newest is None or int(match.group(1)) > newest[0]):
+                newest = (int(match.group(1)), path)
+        return newest
+
+    def _load(self, checkpoint):
+        name = pathlib.Path(checkpoint).name
+        network = self.factory()
+        network.load(str(checkpoint))
+        # the first forward pass pays for lazy allocations, do it off the game loop
+        network.inference(np.zeros(self.warmup_size + (3,), dtype=np.uint8), 3)
+        with self._lock:
+            self._ready = (network, name)
+        logging.info('checkpoint %s ready', name)
+
+    def _run(self):
+        try:
+            self._load(f'{self.experiment}_{self.iteration}.pth.tar')
+        except Exception:
+            logging.exception('could not load iteration %d of %s', self.iteration, self.experiment)
+            with self._lock:
+                self._error = f'{self.experiment}_{self.iteration} failed to load, no Network controller'
+        while self.directory is not None and not self._stop.wait(self.interval):
+            newest = self._newest()
+            if newest is None or newest[0] <= self.iteration:
+                continue
+            try:
+                self._load(newest[1])
+            except Exception:
+                # the file may still be being written, retry on the next poll
+                logging.exception('could not load %s', newest[1].name)
+                continue
+            self.iteration = newest[0]
+
+
+# ==============================================================================
+# -- InferenceServer -----------------------------------------------------------
+# ==============================================================================
+
+
+class SharedInferenceBuffer(object):
+    """Numpy views over the shared memory block used by InferenceServer and InferenceClient.
+
+    Layout: header int64[4] (slots, width, height, server pid), control
+    int64[slots, 4] (request seq, response seq, condition, status), results
+    float64[slots, 2] (brake, steer), frames uint8[slots, width, height, 3].
+    A slot has a pending request while its request seq differs from its
+    response seq; the status of the answer is OK or FAILED. Clients own
+    their slot through claim(), an exclusive lock on a per-slot file that the
+    system releases when the client process exits, however it exits.
+    """
+
+    OK, FAILED = 0, 1
+
+    def __init__(self, name, slots=None, size=(640, 360)):
+        create = slots is not None
+        if create:
+            nbytes = 32 + slots * 32 + slots * 16 + slots * size[0] * size[1] * 3
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.header = np.ndarray((4,), dtype=np.int64, buffer=self.shm.buf)
+        if create:
+            self.header[:] = (slots, size[0], size[1], os.getpid())
+        elif self.header[3] != os.getpid():
+            # attaching registers the block with this process' resource tracker,
+            # which would unlink it on exit and pull it from under the server.
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        slots, width, height = (int(x) for x in self.header[:3])
+        offset = 32
+        self.control = np.ndarray((slots, 4), dtype=np.int64, buffer=self.shm.buf, offset=offset)
+        offset += slots * 32
+        self.results = np.ndarray((slots, 2), dtype=np.float64, buffer=self.shm.buf, offset=offset)
+        offset += slots * 16
+        self.frames = np.ndarray((slots, width, height, 3), dtype=np.uint8, buffer=self.shm.buf, offset=offset)
+        if create:
+            self.control[:] = 0
+        self.slots = slots
+        self.size = (width, height)
+        self.name = name
+
+    def _lock_path(self, slot):
+        return pathlib.Path(tempfile.gettempdir()) / f'{self.name}.slot{slot}.lock'
+
+    def claim(self, slot=None):
+        """Take a slot for this process, the given one or the first free; returns (slot, lock handle)."""
+        for candidate in range(self.slots) if slot is None else [slot]:
+            handle = open(str(self._lock_path(candidate)), 'a')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                continue
+            return candidate, handle
+        if slot is None:
+            raise RuntimeError('all %d slots of %s are taken' % (self.slots, self.name))
+        raise RuntimeError('slot %d of %s is taken by another client' % (slot, self.name))
+
+    def close(self, unlink=False):
+        del self.header, self.control, self.results, self.frames
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+            for slot in range(self.slots):
+                try:
+                    self._lock_path(slot).unlink()
+                except OSError:
+                    pass
+
+
+class InferenceServer(object):
+    """Holds one network and serves every collection client on the box.
+
+    Clients write a frame and a condition into their slot of a shared memory
+    block. Pending slots are gathered into a micro-batch until max_batch
+    requests are waiting or max_wait seconds have passed since the first one,
+    then run together and answered in place. A network without a batched
+    forward (see export.batch_path) gains nothing from waiting, so its
+    pending requests are answered right away.
+    """
+
+    def __init__(self, network, name='lfi_inference', slots=8, size=(640, 360), max_batch=8, max_wait=0.005,
+                 poll=0.0002):
+        self.network = network
+        self._batch = batch_path(network)
+        self.buffer = SharedInferenceBuffer(name, slots=slots, size=size)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.poll = poll
+        self.batches = 0
+        self.requests = 0
+
+    def _pending(self):
+        control = self.buffer.control
+        return np.flatnonzero(control[:, 0] != control[:, 1])
+
+    def _run_batch(self, states, conditions):
+        """(brake, steer) rows and a status per request; a failed batch is retried request by request."""
+        statuses = np.full(len(states), SharedInferenceBuffer.OK, dtype=np.int64)
+        if self._batch is not None:
+            try:
+                return np.asarray(self._batch(states, conditions), dtype=np.float64).reshape(-1, 2), statuses
+            except Exception:
+                logging.exception('batch of %d requests failed, running them one by one', len(states))
+        outputs = np.full((len(states), 2), np.nan)
+        for i, (state, condition) in enumerate(zip(states, conditions)):
+            try:
+                outputs[i] = self.network.inference(state, condition)
+            except Exception:
+                logging.exception('inference failed for a condition %d request', condition)
+                statuses[i] = SharedInferenceBuffer.FAILED
+        return outputs, statuses
+
+    def step(self):
+        """Serve one micro-batch; returns the number of requests answered."""
+        pending = self._pending()
+        if not pending.size:
+            return 0
+        deadline = time.time() + (self.max_wait if self._batch is not None else 0.0)
+        while pending.size < self.max_batch and time.time() < deadline:
+            time.sleep(self.poll)
+            pending = self._pending()
+        batch = pending[:self.max_batch]
+        control = self.buffer.control
+        seqs = control[batch, 0].copy()
+        outputs, statuses = self._run_batch(self.buffer.frames[batch], control[batch, 2].copy())
+        self.buffer.results[batch] = outputs
+        control[batch, 3] = statuses
+        control[batch, 1] = seqs
+        self.batches += 1
+        self.requests += batch.size
+        return batch.size
+
+    def serve_forever(self):
+        # failed requests are answered with a FAILED status by step(), only a shutdown ends the loop
+        try:
+            while True:
+                if not self.step():
+                    time.sleep(self.poll)
+        finally:
+            self.buffer.close(unlink=True)
+
+
+class InferenceClient(object):
+    """Drop-in replacement for the agents' inference(state, condition) API backed by an InferenceServer.
+
+    slot=None claims the first free slot; a given slot must not be in use by another client.
+    """
+
+    def __init__(self, name='lfi_inference', slot=None, timeout=1.0, poll=0.0002):
+        self.buffer = SharedInferenceBuffer(name)
+        if slot is not None and not 0 <= slot < self.buffer.slots:
+            raise ValueError('slot %d out of range, the server has %d slots' % (slot, self.buffer.slots))
+        try:
+            self.slot, self._claim = self.buffer.claim(slot)
+        except RuntimeError:
+            self.buffer.close()
+            raise
+        self.timeout = timeout
+        self.poll = poll
+        self._seq = int(self.buffer.control[self.slot, 1])
+
+    def load(self, checkpoint):
+        # the server process owns the weights
+        logging.info('checkpoint %s is loaded by the inference server', checkpoint)
+
+    def inference(self, state, condition):
+        control = self.buffer.control[self.slot]
+        self.buffer.frames[self.slot] = state
+        control[2] = condition
+        self._seq += 1
+        control[0] = self._seq
+        deadline = time.time() + self.timeout
+        while control[1] != self._seq:
+            if time.time() > deadline:
+                raise TimeoutError('inference server did not answer slot %d within %.1fs' % (self.slot, self.timeout))
+            time.sleep(self.poll)
+        if control[3] != SharedInferenceBuffer.OK:
+            raise RuntimeError('inference server failed on the request of slot %d' % self.slot)
+        brake, steer = self.buffer.results[self.slot]
+        return float(brake), float(steer)
+
+    def close(self):
+        self.buffer.close()
+        self._claim.close()
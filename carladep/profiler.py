@@ -0,0 +1,72 @@
+import collections
+import contextlib
+import json
+import os
+import pathlib
+import threading
+import time
+from carladep.timing import StageTimer
+
+# ==============================================================================
+# -- FrameProfiler -------------------------------------------------------------
+# ==============================================================================
+
+# stages of one game_loop iteration, in the order they run
+STAGES = ('parse_events', 'agent.run_step', 'inference', 'HUD.tick', 'World.render', 'display.flip')
+# stages timed inside another one, subtracted from their parent in the stacked bar
+NESTED = {'parse_events': ('agent.run_step', 'inference')}
+
+
+class FrameProfiler(StageTimer):
+    """Rolling millisecond timings of the game_loop stages, optionally kept as Chrome trace events.
+
+    Stages are timed with the measure() context manager of StageTimer. With
+    trace=True every measured stage is also recorded as a complete ('X')
+    trace event, up to trace_limit of the most recent ones, and dump_trace()
+    writes them as a json file that chrome://tracing or Perfetto can open.
+    """
+
+    def __init__(self, stages=STAGES, window=600, trace=False, trace_limit=200000):
+        super(FrameProfiler, self).__init__(('frame',) + tuple(stages), window)
+        self.stages = tuple(stages)
+        self.events = collections.deque(maxlen=trace_limit) if trace else None
+        self.frame = 0
+        self._origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.add(name, 1000.0 * (end - start))
+            if self.events is not None:
+                self.events.append((name, start, end - start, threading.get_ident(), self.frame))
+
+    @contextlib.contextmanager
+    def frame_scope(self):
+        """Time one whole iteration of the loop as the 'frame' stage."""
+        with self.measure('frame'):
+            yield
+        self.frame += 1
+
+    def stacked(self):
+        """[(stage, mean ms)] with nested stages taken out of their parent, for the HUD bar."""
+        means = {name: self.stats[name].mean() for name in self.stages}
+        bar = []
+        for name in self.stages:
+            own = means[name] - sum(means.get(child, 0.0) for child in NESTED.get(name, ()))
+            bar.append((name, max(0.0, own)))
+        return bar
+
+    def dump_trace(self, path):
+        """Write the recorded stages as Chrome trace-event json, timestamps in microseconds."""
+        path = pathlib.Path(path)
+        pid = os.getpid()
+        events = [{'name': name, 'cat': 'frame', 'ph': 'X', 'pid': pid, 'tid': tid,
+                   'ts': 1e6 * (start - self._origin), 'dur': 1e6 * duration, 'args': {'frame': frame}}
+                  for name, start, duration, tid, frame in (self.events or ())]
+        with open(str(path), 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return path
@@ -0,0 +1,204 @@
+import collections
+import logging
+import multiprocessing
+import pathlib
+import queue
+import threading
+import weakref
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from . import carla
+from carladep.framebus import FrameBus
+from carladep.functions import get_blueprint_library
+
+# ==============================================================================
+# -- CameraRig -----------------------------------------------------------------
+# ==============================================================================
+
+# lateral offsets in metres and yaw in degrees from the capture camera, for augmentation
+RIG_OFFSETS = collections.OrderedDict([
+    ('left', (-1.5, 0.0)),
+    ('right', (1.5, 0.0)),
+])
+
+
+class CameraRig(object):
+    """Extra named rgb cameras spawned together, each pushing its frames to the sensor hub.
+
+    Every camera sits at its offset from `transform` (the capture camera) and
+    publishes into its own FrameBus, so the hub receives a (width, height, 3)
+    RGB copy under 'camera_<name>', the same layout as the main camera. When
+    the capture camera moves, set_transform() moves the rig along with it.
+    """
+
+    def __init__(self, parent_actor, transform, hub, names=('left', 'right'), size=(640, 360), offsets=RIG_OFFSETS):
+        self.hub = hub
+        self.names = tuple(names)
+        self.offsets = offsets
+        self.sensors = collections.OrderedDict()
+        self.frame_buses = {name: FrameBus(size) for name in self.names}
+        world = parent_actor.get_world()
+        bp = get_blueprint_library(world).find('sensor.camera.rgb')
+        bp.set_attribute('image_size_x', str(size[0]))
+        bp.set_attribute('image_size_y', str(size[1]))
+        weak_self = weakref.ref(self)
+        for name in self.names:
+            sensor = world.spawn_actor(bp, self._offset(transform, name), attach_to=parent_actor)
+            sensor.listen(lambda image, name=name: CameraRig._parse_image(weak_self, name, image))
+            self.sensors[name] = sensor
+
+    @staticmethod
+    def sources(names):
+        return tuple('camera_%s' % name for name in names)
+
+    def _offset(self, transform, name):
+        y, yaw = self.offsets[name]
+        location = carla.Location(x=transform.location.x, y=transform.location.y + y, z=transform.location.z)
+        rotation = carla.Rotation(pitch=transform.rotation.pitch, yaw=transform.rotation.yaw + yaw,
+                                  roll=transform.rotation.roll)
+        return carla.Transform(location, rotation)
+
+    def set_transform(self, transform):
+        # keep the rig at its offsets from the capture camera
+        for name, sensor in self.sensors.items():
+            sensor.set_transform(self._offset(transform, name))
+
+    def destroy(self):
+        for sensor in self.sensors.values():
+            sensor.destroy()
+        self.sensors.clear()
+
+    @staticmethod
+    def _parse_image(weak_self, name, image):
+        self = weak_self()
+        if not self:
+            return
+        frame_bus = self.frame_buses[name]
+        frame_bus.publish(image)
+        with frame_bus.read() as latest:
+            if latest is not None and latest[0] == image.frame_number:
+                self.hub.push('camera_%s' % name, latest[0], latest[1].copy())
+
+
+# ==============================================================================
+# -- DatasetEncoder ------------------------------------------------------------
+# ==============================================================================
+
+
+def encode_image(path, array):
+    """Save a (width, height, 3) RGB array; the format follows the file extension."""
+    import pygame
+    pygame.image.save(pygame.surfarray.make_surface(array), path)
+    return path
+
+
+class DatasetEncoder(object):
+    """Encodes dataset images in a process pool so the game loop only hands arrays over.
+
+    At most max_pending images are in flight; beyond that submit() waits for
+    the oldest one, so a slow disk slows capture down instead of losing
+    frames or growing memory without bound.
+    """
+
+    def __init__(self, processes=2, max_pending=32):
+        # spawn: forking the client would copy the carla and pygame threads' locks
+        self._pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+        self._pending = collections.deque()
+        self.max_pending = max_pending
+        self.encoded = 0
+        self.waited = 0
+
+    def submit(self, path, array):
+        while len(self._pending) >= self.max_pending:
+            self.waited += 1
+            self._finish(self._pending.popleft())
+        self._pending.append(self._pool.submit(encode_image, str(path), array))
+        while self._pending and self._pending[0].done():
+            self._finish(self._pending.popleft())
+
+    def _finish(self, future):
+        try:
+            future.result()
+            self.encoded += 1
+        except Exception:
+            logging.exception('could not encode a dataset image')
+
+    def close(self):
+        while self._pending:
+            self._finish(self._pending.popleft())
+        self._pool.shutdown()
+
+
+# ==============================================================================
+# -- ImageWriter ---------------------------------------------------------------
+# ==============================================================================
+
+
+class ImageWriter(object):
+    """Writes sensor images from a pool of threads instead of the sensor callback.
+
+    write() copies the raw BGRA buffer and returns; images that would push
+    the queued bytes over memory_budget are dropped and counted. Formats are
+    'png' and 'jpeg', or 'raw' for the BGRA bytes themselves, zlib-compressed
+    at `compression` (0 stores them as they are) in <name>_<w>x<h>.bgra[.z].
+    """
+
+    def __init__(self, image_format='png', compression=1, threads=2, memory_budget=256 * 2**20):
+        self.image_format = image_format
+        self.compression = compression
+        self.memory_budget = memory_budget
+        self.queued_bytes = 0
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def write(self, name, image):
+        """Queue a carla.Image (raw_data, width, height) to be saved as `name` plus the format's extension."""
+        size = 4 * image.width * image.height
+        with self._lock:
+            if self.queued_bytes + size > self.memory_budget:
+                self.dropped += 1
+                return False
+            self.queued_bytes += size
+        self._queue.put((name, bytes(image.raw_data), image.width, image.height))
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            name, raw, width, height = item
+            written = False
+            try:
+                self._save(name, raw, width, height)
+                written = True
+            except Exception:
+                logging.exception('could not write %s', name)
+            with self._lock:
+                self.queued_bytes -= len(raw)
+                self.written += written
+
+    def _save(self, name, raw, width, height):
+        pathlib.Path(name).parent.mkdir(parents=True, exist_ok=True)
+        if self.image_format == 'raw':
+            path = f'{name}_{width}x{height}.bgra'
+            if self.compression:
+                raw, path = zlib.compress(raw, self.compression), path + '.z'
+            with open(path, 'wb') as f:
+                f.write(raw)
+        else:
+            import pygame
+            surface = pygame.image.frombuffer(raw, (width, height), 'BGRA')
+            pygame.image.save(surface, f'{name}.{self.image_format}')
+
+    def close(self):
+        """Write what is queued, then stop the threads."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
@@ -4,37 +4,84 @@ from carla import ColorConverter as cc
 import pygame
 import datetime
 import math
+import sys
+import threading
 import weakref
 import collections
 import numpy as np
-from carladep.functions import get_actor_display_name
+from carladep.functions import get_actor_display_name, get_blueprint_library
+from carladep.framebus import FrameBus
+from carladep.hub import EventChannel
 # ==============================================================================
 # -- CollisionSensor -----------------------------------------------------------
 # ==============================================================================
 
 
 class CollisionSensor(object):
-    def __init__(self, parent_actor, hud):
+    def __init__(self, parent_actor, hud, frames=4000, hub=None):
         self.sensor = None
-        self.history = []
-        self.flag=False
+        self.hub = hub
+        # per-frame intensity, slot frame % frames; the buffer is stored twice
+        # back to back so any window of up to `frames` frames is one contiguous slice
+        self.frames = frames
+        self.intensity = np.zeros(2 * frames, dtype=np.float32)
+        self._last_frame = None
+        self._after = None
+        self._lock = threading.Lock()
+        self.events = EventChannel()
         self._parent = parent_actor
         self.hud = hud
         world = self._parent.get_world()
-        bp = world.get_blueprint_library().find('sensor.other.collision')
+        bp = get_blueprint_library(world).find('sensor.other.collision')
         self.sensor = world.spawn_actor(bp, carla.Transform(), attach_to=self._parent)
         # We need to pass the lambda a weak reference to self to avoid circular
         # reference.
         weak_self = weakref.ref(self)
         self.sensor.listen(lambda event: CollisionSensor._on_collision(weak_self, event))
 
+    def _advance(self, frame):
+        # clear the slots of the frames between the last seen one and `frame`, call with the lock held
+        if self._last_frame is None or frame - self._last_frame >= self.frames:
+            self.intensity[:] = 0.0
+        elif frame > self._last_frame:
+            start = (self._last_frame + 1) % self.frames
+            stop = start + frame - self._last_frame
+            self.intensity[start:stop] = 0.0
+            self.intensity[start + self.frames:min(stop + self.frames, 2 * self.frames)] = 0.0
+            if stop > self.frames:
+                self.intensity[:stop - self.frames] = 0.0
+        else:
+            return
+        self._last_frame = frame
+
+    def clear(self, after=None):
+        """Forget the intensity history and queued events, e.g. when the parent was teleported.
+
+        From then on collisions of frames at or before `after` are ignored.
+        """
+        with self._lock:
+            self.intensity[:] = 0.0
+            self._last_frame = None
+            self._after = after
+        self.events.drain()
+
+    def get_collision_window(self, frame, length=200):
+        """Intensities of the `length` frames before `frame`, oldest first, as a view into the buffer."""
+        length = min(length, self.frames)
+        with self._lock:
+            self._advance(frame - 1)
+            start = (frame - length) % self.frames
+            return self.intensity[start:start + length]
+
     def get_collision_history(self):
         history = collections.defaultdict(int)
-        if self.flag==True:
-            self.flag=False
-            self.hud.collision_flag=True
-        for frame, intensity in self.history:
-            history[frame] += intensity
+        with self._lock:
+            if self._last_frame is None:
+                return history
+            for frame in range(self._last_frame - self.frames + 1, self._last_frame + 1):
+                intensity = self.intensity[frame % self.frames]
+                if intensity:
+                    history[frame] += float(intensity)
         return history
 
     @staticmethod
@@ -43,13 +90,31 @@ class CollisionSensor(object):
         if not self:
             return
         actor_type = get_actor_display_name(event.other_actor)
-        self.hud.notification('Collision with %r' % actor_type)
-        self.flag=True
         impulse = event.normal_impulse
         intensity = math.sqrt(impulse.x**2 + impulse.y**2 + impulse.z**2)
-        self.history.append((event.frame_number, intensity))
-        if len(self.history) > 4000:
-            self.history.pop(0)
+        frame = event.frame_number
+        if self._after is not None and frame <= self._after:
+            return
+        if self.hub is not None:
+            self.hub.push('collision', frame, {'actor': actor_type, 'intensity': intensity})
+        with self._lock:
+            self._advance(frame)
+            if frame > self._last_frame - self.frames:
+                slot = frame % self.frames
+                self.intensity[slot] += intensity
+                self.intensity[slot + self.frames] += intensity
+        self.events.put(actor_type, frame)
+
+    def dispatch(self, after=None):
+        """Notify and flag the collisions received since the last call, from the game loop; returns them.
+
+        Collisions of frames at or before `after` are dropped.
+        """
+        events = self.events.drain(after)
+        for actor_type in events:
+            self.hud.notification('Collision with %r' % actor_type)
+            self.hud.collision_flag=True
+        return events
 
 
 # ==============================================================================
@@ -58,12 +123,14 @@ class CollisionSensor(object):
 
 
 class LaneInvasionSensor(object):
-    def __init__(self, parent_actor, hud):
+    def __init__(self, parent_actor, hud, hub=None):
         self.sensor = None
+        self.hub = hub
+        self.events = EventChannel()
         self._parent = parent_actor
         self.hud = hud
         world = self._parent.get_world()
-        bp = world.get_blueprint_library().find('sensor.other.lane_invasion')
+        bp = get_blueprint_library(world).find('sensor.other.lane_invasion')
         self.sensor = world.spawn_actor(bp, carla.Transform(), attach_to=self._parent)
         # We need to pass the lambda a weak reference to self to avoid circular
         # reference.
@@ -77,8 +144,15 @@ class LaneInvasionSensor(object):
             return
         lane_types = set(x.type for x in event.crossed_lane_markings)
         text = ['%r' % str(x).split()[-1] for x in lane_types]
-        self.hud.notification('Crossed line %s' % ' and '.join(text))
-        self.hud.laneinvasion_flag=True
+        if self.hub is not None:
+            self.hub.push('lane_invasion', event.frame_number, text)
+        self.events.put(text, event.frame_number)
+
+    def dispatch(self, after=None):
+        """Notify and flag the lane invasions received since the last call, from the game loop."""
+        for text in self.events.drain(after):
+            self.hud.notification('Crossed line %s' % ' and '.join(text))
+            self.hud.laneinvasion_flag=True
 
 # ==============================================================================
 # -- GnssSensor --------------------------------------------------------
@@ -86,13 +160,14 @@ class LaneInvasionSensor(object):
 
 
 class GnssSensor(object):
-    def __init__(self, parent_actor):
+    def __init__(self, parent_actor, hub=None):
         self.sensor = None
+        self.hub = hub
         self._parent = parent_actor
         self.lat = 0.0
         self.lon = 0.0
         world = self._parent.get_world()
-        bp = world.get_blueprint_library().find('sensor.other.gnss')
+        bp = get_blueprint_library(world).find('sensor.other.gnss')
         self.sensor = world.spawn_actor(bp, carla.Transform(carla.Location(x=1.0, z=2.8)), attach_to=self._parent)
         # We need to pass the lambda a weak reference to self to avoid circular
         # reference.
@@ -106,6 +181,88 @@ class GnssSensor(object):
             return
         self.lat = event.latitude
         self.lon = event.longitude
+        if self.hub is not None:
+            self.hub.push('gnss', event.frame_number, (event.latitude, event.longitude, event.altitude))
+
+
+# ==============================================================================
+# -- OccupancyGrid -------------------------------------------------------------
+# ==============================================================================
+
+
+class OccupancyGrid(object):
+    """Bird's-eye hit counts of LiDAR points around the vehicle, accumulated until cleared.
+
+    The grid is cells x cells at `resolution` metres per cell, centred on the
+    sensor with +x (forward) along the first axis. Scans are accumulated from
+    the sensor thread while the game loop saves and clears the grid.
+    """
+
+    def __init__(self, cells=200, resolution=0.5):
+        self.cells = cells
+        self.resolution = resolution
+        self.counts = np.zeros((cells, cells), dtype=np.uint32)
+        self.scans = 0
+        self._lock = threading.Lock()
+
+    def accumulate(self, points):
+        cells = np.floor(points[:, :2] / self.resolution).astype(np.intp) + self.cells // 2
+        inside = np.all((cells >= 0) & (cells < self.cells), axis=1)
+        cells = cells[inside]
+        hits = np.bincount(cells[:, 0] * self.cells + cells[:, 1],
+                           minlength=self.cells * self.cells).reshape(self.cells, self.cells).astype(np.uint32)
+        with self._lock:
+            self.counts += hits
+            self.scans += 1
+
+    def occupancy(self):
+        """Fraction of the accumulated scans that hit each cell, as float32."""
+        with self._lock:
+            return np.minimum(self.counts, max(1, self.scans)).astype(np.float32) / max(1, self.scans)
+
+    def save(self, path, clear=False):
+        """Save the occupancy; with clear=True the grid is emptied in the same step, so no scan is lost."""
+        with self._lock:
+            occupancy = np.minimum(self.counts, max(1, self.scans)).astype(np.float32) / max(1, self.scans)
+            if clear:
+                self.counts[:] = 0
+                self.scans = 0
+        np.save(path, occupancy)
+
+    def clear(self):
+        with self._lock:
+            self.counts[:] = 0
+            self.scans = 0
+
+
+class LidarOccupancySensor(object):
+    """A LiDAR of its own on the roof, accumulating every scan into an OccupancyGrid.
+
+    It runs next to the display sensors, so the grid fills whatever view the
+    CameraManager shows.
+    """
+
+    def __init__(self, parent_actor, grid=None, lidar_range=5000):
+        self.sensor = None
+        self.grid = grid if grid is not None else OccupancyGrid()
+        self._parent = parent_actor
+        world = self._parent.get_world()
+        bp = get_blueprint_library(world).find('sensor.lidar.ray_cast')
+        # centimetres, 50 m covers the default 100 m wide grid
+        bp.set_attribute('range', str(lidar_range))
+        self.sensor = world.spawn_actor(bp, carla.Transform(carla.Location(z=2.4)), attach_to=self._parent)
+        # We need to pass the lambda a weak reference to self to avoid circular
+        # reference.
+        weak_self = weakref.ref(self)
+        self.sensor.listen(lambda event: LidarOccupancySensor._on_scan(weak_self, event))
+
+    @staticmethod
+    def _on_scan(weak_self, event):
+        self = weak_self()
+        if not self:
+            return
+        points = np.frombuffer(event.raw_data, dtype=np.dtype('f4'))
+        self.grid.accumulate(np.reshape(points, (int(points.shape[0] / 3), 3)))
 
 
 # ==============================================================================
@@ -114,12 +271,31 @@ class GnssSensor(object):
 
 
 class CameraManager(object):
-    def __init__(self, parent_actor, hud):
+    def __init__(self, parent_actor, hud, hub=None, capture_size=None, display=True, display_tick=0.0,
+                 image_writer=None):
         self.sensor = None
+        self.hub = hub
+        self.image_writer = image_writer
+        # optional second rgb camera at the policy/dataset resolution; when present it feeds the
+        # frame bus and the sensor hub, and the display camera can be disabled or ticked slower
+        self.capture_size = capture_size
+        self.capture_sensor = None
+        self.display = display
         self.surface = None
         self._parent = parent_actor
         self.hud = hud
         self.recording = False
+        self.frame_bus = FrameBus()
+        # three persistent 32-bit surfaces in carla's BGRA layout: the callback writes the back one and
+        # swaps it with the ready one, render() swaps the ready one with the front one it blits, so a
+        # surface is never written while it is on screen
+        self._surfaces = [None, None, None]
+        self._back, self._ready, self._front = 0, 1, 2
+        self._fresh = False
+        self._swap_lock = threading.Lock()
+        # LiDAR view: a persistent canvas and the pixels lit by the last scan
+        self._lidar_canvas = None
+        self._lidar_lit = None
         self._camera_transforms = [
             carla.Transform(carla.Location(x=-7.5, z=5), carla.Rotation(pitch=-15)),
             carla.Transform(carla.Location(x=1.6, z=1.2)),
@@ -137,28 +313,55 @@ class CameraManager(object):
             # ['sensor.lidar.ray_cast', None, 'Lidar (Ray-Cast)']
         ]
         world = self._parent.get_world()
-        bp_library = world.get_blueprint_library()
+        bp_library = get_blueprint_library(world)
         for item in self.sensors:
             bp = bp_library.find(item[0])
             if item[0].startswith('sensor.camera'):
                 bp.set_attribute('image_size_x', str(hud.dim[0]))
                 bp.set_attribute('image_size_y', str(hud.dim[1]))
+                if display_tick > 0:
+                    bp.set_attribute('sensor_tick', str(display_tick))
             elif item[0].startswith('sensor.lidar'):
                 bp.set_attribute('range', '5000')
             item.append(bp)
         self.index = None
+        if capture_size is not None:
+            self._capture_bp = bp_library.find('sensor.camera.rgb')
+            self._capture_bp.set_attribute('image_size_x', str(capture_size[0]))
+            self._capture_bp.set_attribute('image_size_y', str(capture_size[1]))
+
+    @property
+    def transform(self):
+        return self._camera_transforms[self.transform_index]
 
     def toggle_camera(self):
         self.transform_index = (self.transform_index + 1) % len(self._camera_transforms)
-        self.sensor.set_transform(self._camera_transforms[self.transform_index])
+        for sensor in (self.sensor, self.capture_sensor):
+            if sensor is not None:
+                sensor.set_transform(self._camera_transforms[self.transform_index])
+
+    def _spawn_capture(self):
+        self.capture_sensor = self._parent.get_world().spawn_actor(
+            self._capture_bp,
+            self._camera_transforms[self.transform_index],
+            attach_to=self._parent)
+        weak_self = weakref.ref(self)
+        self.capture_sensor.listen(lambda image: CameraManager._parse_capture(weak_self, image))
 
     def set_sensor(self, index, notify=True):
         index = index % len(self.sensors)
+        if self.capture_size is not None and self.capture_sensor is None:
+            self._spawn_capture()
         needs_respawn = True if self.index is None \
             else self.sensors[index][0] != self.sensors[self.index][0]
+        if needs_respawn and not self.display:
+            self.index = index
+            return
         if needs_respawn:
             if self.sensor is not None:
                 self.sensor.destroy()
+                with self._swap_lock:
+                    self._fresh = False
                 self.surface = None
             self.sensor = self._parent.get_world().spawn_actor(
                 self.sensors[index][-1],
@@ -180,8 +383,71 @@ class CameraManager(object):
         self.hud.notification('Recording %s' % ('On' if self.recording else 'Off'))
 
     def render(self, display):
+        with self._swap_lock:
+            if self._fresh:
+                self._front, self._ready = self._ready, self._front
+                self._fresh = False
+                self.surface = self._surfaces[self._front]
         if self.surface is not None:
             display.blit(self.surface, (0, 0))
+        elif not self.display:
+            # nothing draws over the previous frame's HUD otherwise
+            display.fill((0, 0, 0))
+
+    def _write_surface(self, image):
+        # copy the BGRA bytes as they are into the back surface, whose masks read them as
+        # little-endian 0x00RRGGBB; returns None when the layout does not allow it
+        if sys.byteorder != 'little':
+            return None
+        surface = self._surfaces[self._back]
+        if surface is None or surface.get_size() != (image.width, image.height):
+            surface = pygame.Surface((image.width, image.height), 0, 32, (0xFF0000, 0xFF00, 0xFF, 0))
+            self._surfaces[self._back] = surface
+        if surface.get_pitch() != 4 * image.width:
+            return None
+        surface.get_buffer().write(np.frombuffer(image.raw_data, dtype=np.uint8), 0)
+        return surface
+
+    def _draw_lidar(self, points):
+        # top view, 100 m across the smaller window side; points outside the window are dropped
+        width, height = self.hud.dim
+        if self._lidar_canvas is None:
+            self._lidar_canvas = np.zeros((width, height, 3), dtype=np.uint8)
+        canvas = self._lidar_canvas
+        if self._lidar_lit is not None:
+            canvas[self._lidar_lit] = 0
+        pixels = (points[:, :2] * (min(width, height) / 100.0) + (0.5 * width, 0.5 * height)).astype(np.intp)
+        inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < width) & (pixels[:, 1] >= 0) & (pixels[:, 1] < height)
+        self._lidar_lit = (pixels[inside, 0], pixels[inside, 1])
+        canvas[self._lidar_lit] = 255
+        surface = self._surfaces[self._back]
+        if surface is None or surface.get_size() != (width, height):
+            surface = pygame.Surface((width, height), 0, 32, (0xFF0000, 0xFF00, 0xFF, 0))
+            self._surfaces[self._back] = surface
+        pygame.surfarray.blit_array(surface, canvas)
+        return surface
+
+    def _present(self, surface):
+        # hand the finished back surface over, called from the sensor callback
+        with self._swap_lock:
+            self._surfaces[self._back] = surface
+            self._back, self._ready = self._ready, self._back
+            self._fresh = True
+
+    def _publish(self, image):
+        self.frame_bus.publish(image)
+        if self.hub is not None:
+            # the bus reuses its arrays, the bundle keeps its own copy
+            with self.frame_bus.read() as latest:
+                if latest is not None and latest[0] == image.frame_number:
+                    self.hub.push('camera', latest[0], latest[1].copy())
+
+    @staticmethod
+    def _parse_capture(weak_self, image):
+        self = weak_self()
+        if not self:
+            return
+        self._publish(image)
 
     @staticmethod
     def _parse_image(weak_self, image):
@@ -191,22 +457,21 @@ class CameraManager(object):
         if self.sensors[self.index][0].startswith('sensor.lidar'):
             points = np.frombuffer(image.raw_data, dtype=np.dtype('f4'))
             points = np.reshape(points, (int(points.shape[0] / 3), 3))
-            lidar_data = np.array(points[:, :2])
-            lidar_data *= min(self.hud.dim) / 100.0
-            lidar_data += (0.5 * self.hud.dim[0], 0.5 * self.hud.dim[1])
-            lidar_data = np.fabs(lidar_data)  # pylint: disable=E1111
-            lidar_data = lidar_data.astype(np.int32)
-            lidar_data = np.reshape(lidar_data, (-1, 2))
-            lidar_img_size = (self.hud.dim[0], self.hud.dim[1], 3)
-            lidar_img = np.zeros(lidar_img_size)
-            lidar_img[tuple(lidar_data.T)] = (255, 255, 255)
-            self.surface = pygame.surfarray.make_surface(lidar_img)
+            self._present(self._draw_lidar(points))
         else:
             image.convert(self.sensors[self.index][1])
-            array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-            array = np.reshape(array, (image.height, image.width, 4))
-            array = array[:, :, :3]
-            array = array[:, :, ::-1]
-            self.surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
+            if self.sensors[self.index][0] == 'sensor.camera.rgb' and self.capture_sensor is None:
+                self._publish(image)
+            surface = self._write_surface(image)
+            if surface is None:
+                array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
+                array = np.reshape(array, (image.height, image.width, 4))
+                array = array[:, :, :3]
+                array = array[:, :, ::-1]
+                surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
+            self._present(surface)
         if self.recording:
-            image.save_to_disk('_out/%08d' % image.frame_number)
\ No newline at end of file
+            if self.image_writer is not None:
+                self.image_writer.write('_out/%08d' % image.frame_number, image)
+            else:
+                image.save_to_disk('_out/%08d' % image.frame_number)
\ No newline at end of file
@@ -0,0 +1,111 @@
+import collections
+import random
+import numpy as np
+
+# ==============================================================================
+# -- SpawnPointManager ---------------------------------------------------------
+# ==============================================================================
+
+
+class SpawnPointManager(object):
+    """Knows which spawn points of a map are free, for respawns and NPC placement.
+
+    Spawn points are bucketed once into a grid of `cell` metres. update()
+    takes the vehicle locations of the current tick and marks every spawn
+    point within `clearance` metres of one as occupied, looking only at the
+    grid cells around each vehicle. Points handed out by choose() stay
+    reserved until the next update, so one batch never gets a point twice.
+    Random choices are drawn from `rng` (a random.Random), the global random
+    module by default.
+    """
+
+    STRATEGIES = ('random', 'far', 'spread')
+
+    def __init__(self, spawn_points, cell=10.0, clearance=5.0, collisions=50, far_share=0.2, rng=None):
+        self.spawn_points = list(spawn_points)
+        self._random = rng if rng is not None else random
+        self.cell = cell
+        self.clearance = clearance
+        self.far_share = far_share
+        self.points = np.array([[p.location.x, p.location.y, p.location.z] for p in self.spawn_points],
+                               dtype=np.float64).reshape(-1, 3)
+        self.occupied = np.zeros(len(self.spawn_points), dtype=bool)
+        self.collisions = collections.deque(maxlen=collisions)
+        self._grid = collections.defaultdict(list)
+        for index, key in enumerate(self._cells(self.points)):
+            self._grid[key].append(index)
+        self._reach = int(np.ceil(clearance / cell))
+
+    def _cells(self, locations):
+        return [tuple(key) for key in np.floor(locations[:, :2] / self.cell).astype(np.int64).tolist()]
+
+    def update(self, locations):
+        """Mark the points near the given (x, y, z) locations as occupied and drop older reservations."""
+        self.occupied[:] = False
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+        offsets = range(-self._reach, self._reach + 1)
+        for location, (cx, cy) in zip(locations, self._cells(locations)):
+            nearby = [i for dx in offsets for dy in offsets for i in self._grid.get((cx + dx, cy + dy), ())]
+            if nearby:
+                nearby = np.array(nearby)
+                close = np.linalg.norm(self.points[nearby] - location, axis=1) <= self.clearance
+                self.occupied[nearby[close]] = True
+
+    def update_from_world(self, world, exclude=()):
+        """update() from the vehicles of the last tick, leaving out the actor ids in exclude."""
+        vehicles = [actor.get_location() for actor in world.get_actors().filter('vehicle.*') if actor.id not in exclude]
+        self.update([(l.x, l.y, l.z) for l in vehicles])
+
+    def add_collision(self, location):
+        self.collisions.append((location.x, location.y, location.z))
+
+    def free(self):
+        return np.flatnonzero(~self.occupied)
+
+    def choose(self, count=1, strategy='random'):
+        """Up to `count` free spawn point transforms, reserved until the next update().
+
+        random picks uniformly, far samples among the far_share of free points
+        farthest from the recent collisions (at least `count` of them), spread
+        places each point as far as possible from the occupied and already
+        chosen ones.
+        """
+        free = self.free()
+        if strategy == 'random' or (strategy == 'far' and not self.collisions):
+            chosen = self._random.sample(free.tolist(), min(count, len(free)))
+        elif strategy == 'far':
+            distance = self._distance_to(free, np.array(self.collisions))
+            # a pool rather than the very farthest, which would be the same point every respawn
+            pool = max(count, int(np.ceil(self.far_share * len(free))))
+            candidates = free[np.argsort(-distance)[:pool]].tolist()
+            chosen = self._random.sample(candidates, min(count, len(candidates)))
+        elif strategy == 'spread':
+            chosen = self._spread(free, count)
+        else:
+            raise ValueError('unknown spawn strategy %r, expected one of %s' % (strategy, ', '.join(self.STRATEGIES)))
+        self.occupied[chosen] = True
+        return [self.spawn_points[i] for i in chosen]
+
+    def _distance_to(self, indices, locations):
+        # distance from each indexed spawn point to the nearest of the locations
+        if len(locations) == 0:
+            return np.full(len(indices), np.inf)
+        delta = self.points[indices, None, :2] - locations[None, :, :2]
+        return np.sqrt((delta ** 2).sum(axis=2)).min(axis=1)
+
+    def _spread(self, free, count):
+        # greedy farthest-point sampling, seeded with the occupied points
+        chosen = []
+        if len(free) == 0:
+            return chosen
+        distance = self._distance_to(free, self.points[self.occupied])
+        # with nothing placed yet every point is infinitely far, start from a random one
+        pick = self._random.randrange(len(free)) if np.isinf(distance).all() else None
+        for _ in range(min(count, len(free))):
+            if pick is None:
+                pick = int(np.argmax(distance))
+            chosen.append(int(free[pick]))
+            distance = np.minimum(distance, self._distance_to(free, self.points[[free[pick]]]))
+            distance[pick] = -1.0
+            pick = None
+        return chosen
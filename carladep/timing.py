@@ -0,0 +1,124 @@
+import collections
+import contextlib
+import csv
+import json
+import pathlib
+import time
+import numpy as np
+
+# ==============================================================================
+# -- RollingStats --------------------------------------------------------------
+# ==============================================================================
+
+
+class RollingStats(object):
+    """Keeps the last `window` samples with their timestamps for percentiles and rates."""
+
+    def __init__(self, window=600):
+        self._values = collections.deque(maxlen=window)
+        self._stamps = collections.deque(maxlen=window)
+        self.total = 0
+
+    def add(self, value, stamp=None):
+        self._values.append(value)
+        self._stamps.append(time.perf_counter() if stamp is None else stamp)
+        self.total += 1
+
+    def __len__(self):
+        return len(self._values)
+
+    def percentiles(self, q=(50, 95, 99)):
+        if not self._values:
+            return [0.0] * len(q)
+        return np.percentile(np.fromiter(self._values, dtype=np.float64, count=len(self._values)), q).tolist()
+
+    def mean(self):
+        return sum(self._values) / len(self._values) if self._values else 0.0
+
+    def rate(self):
+        """Samples per second over the window."""
+        if len(self._stamps) < 2:
+            return 0.0
+        span = self._stamps[-1] - self._stamps[0]
+        return (len(self._stamps) - 1) / span if span > 0 else 0.0
+
+    def summary(self):
+        p50, p95, p99 = self.percentiles()
+        return {'count': self.total, 'window': len(self), 'mean': self.mean(),
+                'p50': p50, 'p95': p95, 'p99': p99, 'rate': self.rate()}
+
+
+# ==============================================================================
+# -- StageTimer ----------------------------------------------------------------
+# ==============================================================================
+
+
+class StageTimer(object):
+    """Rolling millisecond timings of named stages, e.g. the preprocess/forward/postprocess of inference."""
+
+    def __init__(self, stages=(), window=600):
+        self.window = window
+        self.stats = collections.OrderedDict((name, RollingStats(window)) for name in stages)
+
+    def add(self, name, milliseconds):
+        if name not in self.stats:
+            self.stats[name] = RollingStats(self.window)
+        self.stats[name].add(milliseconds)
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, 1000.0 * (time.perf_counter() - start))
+
+    def summary(self):
+        return collections.OrderedDict((name, stats.summary()) for name, stats in self.stats.items() if len(stats))
+
+    def dump(self, path, extra=None):
+        """Write the summary, plus any extra {name: summary dict} rows, as json or as csv when the path ends in .csv."""
+        path = pathlib.Path(path)
+        summary = self.summary()
+        summary.update(extra or {})
+        with open(str(path), 'w', newline='') as f:
+            if path.suffix == '.csv':
+                writer = csv.DictWriter(f, fieldnames=['stage', 'count', 'window', 'mean', 'p50', 'p95', 'p99', 'rate'],
+                                        extrasaction='ignore')
+                writer.writeheader()
+                for name, row in summary.items():
+                    writer.writerow(dict(row, stage=name))
+            else:
+                json.dump(summary, f, indent=4)
+        return path
+
+
+# ==============================================================================
+# -- StartupTimer --------------------------------------------------------------
+# ==============================================================================
+
+
+class StartupTimer(object):
+    """Milliseconds spent in each startup phase, from `origin` to the first controllable frame.
+
+    mark(name) closes the phase that ran since the previous mark, so the
+    phases add up to the total. origin is a time.perf_counter() value, e.g.
+    taken before the heavy imports of the entry script.
+    """
+
+    def __init__(self, origin=None):
+        self.origin = time.perf_counter() if origin is None else origin
+        self.phases = collections.OrderedDict()
+        self._last = self.origin
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + 1000.0 * (now - self._last)
+        self._last = now
+
+    def total(self):
+        return 1000.0 * (self._last - self.origin)
+
+    def report(self):
+        phases = ', '.join(f'{name} {ms:.0f} ms' for name, ms in self.phases.items())
+        return f'startup {self.total():.0f} ms ({phases})'
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""Export a trained policy to a CPU inference artifact, check parity and benchmark it"""
+
+import argparse
+import json
+import logging
+import pathlib
+
+import numpy as np
+
+from carladep.export import BranchSelectiveAgent, ExportedAgent, benchmark, build_network, export_policy, parity_check
+
+
+def load_frames(paths, size=(640, 360)):
+    """Dataset jpegs as (width, height, 3) uint8 arrays, the layout the agents receive."""
+    import pygame
+    frames = []
+    for path in paths:
+        surface = pygame.image.load(str(path))
+        if surface.get_size() != size:
+            surface = pygame.transform.scale(surface, size)
+        frames.append(pygame.surfarray.array3d(surface))
+    return frames
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument('-g', '--GPU', nargs='+', type=int, default=[0])
+    argparser.add_argument('--experiment', type=str, default='baseline_2')
+    argparser.add_argument('-p', '--policy', type=str, default='branch')
+    argparser.add_argument(
+        '--checkpoint',
+        required=True,
+        help='checkpoint passed to network.load, e.g. baseline_2_3.pth.tar')
+    argparser.add_argument(
+        '-o', '--output',
+        required=True,
+        help='artifact folder to write')
+    argparser.add_argument(
+        '--quantize',
+        action='store_true',
+        help='apply dynamic int8 quantization to linear and lstm layers')
+    argparser.add_argument(
+        '--selective',
+        action='store_true',
+        help='only compute the trunk and the branch of the requested condition')
+    argparser.add_argument(
+        '--frames',
+        metavar='JPEG',
+        nargs='*',
+        default=[],
+        help='dataset images used for the parity check (default: random frames)')
+    argparser.add_argument(
+        '--repeats',
+        default=200,
+        type=int,
+        help='benchmark iterations (default: 200)')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+    frames = load_frames(args.frames)
+    if not frames:
+        rng = np.random.RandomState(0)
+        frames = [rng.randint(0, 256, (640, 360, 3), dtype=np.uint8) for _ in range(8)]
+
+    eager = build_network(args)
+    eager.load(args.checkpoint)
+    report = {
+        'checkpoint': args.checkpoint,
+        'quantized': args.quantize,
+        'selective': args.selective,
+        'eager': benchmark(eager, frames[0], repeats=args.repeats),
+    }
+    if args.selective:
+        selective = build_network(args)
+        selective.load(args.checkpoint)
+        selective = BranchSelectiveAgent(selective)
+        report['eager_selective'] = benchmark(selective, frames[0], repeats=args.repeats)
+        report['selective_parity'] = parity_check(eager, selective, frames)
+        report['selective_cpu_saving'] = 1.0 - report['eager_selective']['cpu_ms'] / max(report['eager']['cpu_ms'], 1e-9)
+
+    output = export_policy(eager, args.output, frames[0], quantize=args.quantize, selective=args.selective)
+    exported = ExportedAgent(lambda: build_network(args), output)
+    report['parity'] = parity_check(eager, exported, frames)
+    report['exported'] = benchmark(exported, frames[0], repeats=args.repeats)
+    report['speedup'] = report['eager']['p50'] / max(report['exported']['p50'], 1e-9)
+    with open(str(pathlib.Path(output) / 'report.json'), 'w') as f:
+        json.dump(report, f, indent=4)
+
+    print('max |diff|   brake %.5f  steer %.5f' % (report['parity']['brake'], report['parity']['steer']))
+    if args.selective:
+        print('selective branches save %.0f%% cpu per call' % (100.0 * report['selective_cpu_saving']))
+    for name in ('eager', 'eager_selective', 'exported'):
+        if name not in report:
+            continue
+        print('%-9s p50 % 7.2f ms  p95 % 7.2f ms  cpu % 7.2f ms' % (
+            name, report[name]['p50'], report[name]['p95'], report[name]['cpu_ms']))
+    print('speedup x%.2f, report written to %s' % (report['speedup'], pathlib.Path(output) / 'report.json'))
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""Serve one policy to every collection client on this machine over shared memory"""
+
+import argparse
+import logging
+
+from carladep.export import build_network
+from carladep.inference import InferenceServer
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument('-g', '--GPU', nargs='+', type=int, default=[0])
+    argparser.add_argument('--experiment', type=str, default='baseline_2')
+    argparser.add_argument('-p', '--policy', type=str, default='branch')
+    argparser.add_argument(
+        '--checkpoint',
+        required=True,
+        help='checkpoint passed to network.load, e.g. baseline_2_3.pth.tar')
+    argparser.add_argument(
+        '--selective-branches',
+        action='store_true',
+        help='run only the shared trunk and the branch of each request, batching requests by condition')
+    argparser.add_argument(
+        '--name',
+        default='lfi_inference',
+        help='shared memory name, clients pass it as --inference-server (default: lfi_inference)')
+    argparser.add_argument(
+        '--slots',
+        default=8,
+        type=int,
+        help='maximum number of clients (default: 8)')
+    argparser.add_argument(
+        '--max-batch',
+        default=8,
+        type=int,
+        help='largest micro-batch (default: 8)')
+    argparser.add_argument(
+        '--max-wait',
+        default=5.0,
+        type=float,
+        help='latency deadline in ms for filling a micro-batch (default: 5)')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+    network = build_network(args)
+    network.load(args.checkpoint)
+    server = InferenceServer(network, name=args.name, slots=args.slots,
+                             max_batch=args.max_batch, max_wait=args.max_wait / 1000.0)
+    logging.info('serving %s on %s with %d slots', args.checkpoint, args.name, args.slots)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
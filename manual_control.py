@@ -165,6 +165,8 @@ class World(object):
         self.player.get_world().set_weather(preset[0])
 
     def tick(self, clock):
+        self.collision_sensor.dispatch()
+        self.lane_invasion_sensor.dispatch()
         self.hud.tick(self, clock)
 
     def render(self, display):
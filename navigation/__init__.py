@@ -1,6 +1,12 @@
+import os
 import sys
-sys.path.append('/home/vision/CARLA/PythonAPI/carla/dist/carla-0.9.5-py3.5-linux-x86_64.egg')
-import carla
+try:
+    import carla
+except ImportError:
+    # the simulator's PythonAPI egg, CARLA_EGG points to another install
+    sys.path.append(os.environ.get('CARLA_EGG',
+                                   '/home/vision/CARLA/PythonAPI/carla/dist/carla-0.9.5-py3.5-linux-x86_64.egg'))
+    import carla
 
 
 
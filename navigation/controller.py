@@ -67,6 +67,13 @@ class VehiclePIDController():
 
         return control
 
+    def reset(self):
+        """
+        Forget the accumulated errors of both controllers, e.g. after the vehicle was teleported.
+        """
+        self._lon_controller.reset()
+        self._lat_controller.reset()
+
 
 class PIDLongitudinalController():
     """
@@ -88,6 +95,12 @@ class PIDLongitudinalController():
         self._dt = dt
         self._e_buffer = deque(maxlen=30)
 
+    def reset(self):
+        """
+        Clear the error history used by the derivative and integral terms.
+        """
+        self._e_buffer.clear()
+
     def run_step(self, target_speed, debug=False):
         """
         Execute one step of longitudinal control to reach a given target speed.
@@ -143,6 +156,12 @@ class PIDLateralController():
         self._dt = dt
         self._e_buffer = deque(maxlen=10)
 
+    def reset(self):
+        """
+        Clear the error history used by the derivative and integral terms.
+        """
+        self._e_buffer.clear()
+
     def run_step(self, waypoint):
         """
         Execute one step of lateral control to steer the vehicle towards a certain waypoin.
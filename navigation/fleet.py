@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" This module drives many NPC vehicles from the client with batched PID control, instead of server autopilot. """
+
+from collections import deque
+import random
+
+import numpy as np
+
+from . import carla
+from .local_planner import RoadOption, _retrieve_options, load_gain_file
+
+
+class FleetDriver(object):
+    """
+    FleetDriver follows randomly chosen routes with every vehicle of a fleet, like a RoamingAgent per vehicle, but
+    keeps their state and the lateral/longitudinal PID controllers in arrays so one step is a few numpy operations
+    and a single apply_batch of ApplyVehicleControl commands.
+
+    Only route planning stays per vehicle, and it only runs when a vehicle's waypoint buffer runs low.
+    """
+
+    def __init__(self, vehicles, carla_map, opt_dict=None, seed=None):
+        """
+        :param vehicles: list of carla.Vehicle actors to drive
+        :param carla_map: carla.Map the vehicles are on
+        :param opt_dict: same keys as the LocalPlanner opt_dict: dt, target_speed, sampling_radius,
+                         lateral_control_dict, longitudinal_control_dict and gain_file
+        :param seed: seed of the route choices at intersections, for repeatable runs
+        """
+        self._vehicles = list(vehicles)
+        self._world = self._vehicles[0].get_world() if self._vehicles else None
+        self._map = carla_map
+        self._random = random.Random(seed)
+        self.ids = [vehicle.id for vehicle in self._vehicles]
+        n = len(self._vehicles)
+
+        target_speed = 25.0  # Km/h
+        dt = 1.0 / target_speed
+        sampling_radius = target_speed * 0.2 / 3.6
+        lateral = {'K_P': 0.15, 'K_D': 0.002, 'K_I': 20, 'dt': dt}
+        longitudinal = {'K_P': 6, 'K_D': 0.05, 'K_I': 2, 'dt': dt}
+        if opt_dict and 'gain_file' in opt_dict:
+            opt_dict = dict(load_gain_file(opt_dict['gain_file']), **opt_dict)
+        if opt_dict:
+            dt = opt_dict.get('dt', dt)
+            target_speed = opt_dict.get('target_speed', target_speed)
+            if 'sampling_radius' in opt_dict:
+                sampling_radius = target_speed * opt_dict['sampling_radius'] / 3.6
+            lateral = opt_dict.get('lateral_control_dict', lateral)
+            longitudinal = opt_dict.get('longitudinal_control_dict', longitudinal)
+
+        self._target_speed = target_speed
+        self._turning_speed = 10.0
+        self._sampling_radius = sampling_radius
+        self._min_distance = sampling_radius * 0.9
+        self._proximity_threshold = 12.0  # meters
+        self._lateral = dict({'K_P': 1.0, 'K_D': 0.0, 'K_I': 0.0, 'dt': 0.03}, **lateral)
+        self._longitudinal = dict({'K_P': 1.0, 'K_D': 0.0, 'K_I': 0.0, 'dt': 0.03}, **longitudinal)
+
+        # PID error histories as ring buffers, same lengths as the single-vehicle controllers
+        self._lat_errors = np.zeros((n, 10))
+        self._lon_errors = np.zeros((n, 30))
+        self._steps = 0
+
+        # per-vehicle routes: a queue of (waypoint, RoadOption) and the current target
+        self._queues = [deque(maxlen=50) for _ in range(n)]
+        self._targets = np.zeros((n, 2))
+        self._turning = np.zeros(n, dtype=bool)
+        self.location = np.zeros((n, 3))
+        self.yaw = np.zeros(n)
+        self.speed = np.zeros(n)
+        self._read_state()
+        for i in range(n):
+            waypoint = self._map.get_waypoint(carla.Location(*self.location[i]))
+            self._queues[i].append((waypoint.next(self._sampling_radius)[0], RoadOption.LANEFOLLOW))
+            self._plan(i)
+
+    def _read_state(self):
+        # transforms and velocities come from the client's copy of the last tick, no server round trip
+        for i, vehicle in enumerate(self._vehicles):
+            transform = vehicle.get_transform()
+            velocity = vehicle.get_velocity()
+            self.location[i] = (transform.location.x, transform.location.y, transform.location.z)
+            self.yaw[i] = transform.rotation.yaw
+            self.speed[i] = 3.6 * np.sqrt(velocity.x ** 2 + velocity.y ** 2 + velocity.z ** 2)
+
+    def _plan(self, i):
+        """
+        Top up the route of vehicle i, choosing randomly at intersections, and set its target.
+
+        :param i: index of the vehicle
+        """
+        queue = self._queues[i]
+        while len(queue) < 10:
+            last_waypoint = queue[-1][0]
+            next_waypoints = list(last_waypoint.next(self._sampling_radius))
+            if len(next_waypoints) <= 1:
+                queue.append((next_waypoints[0], RoadOption.LANEFOLLOW))
+            else:
+                road_options = _retrieve_options(next_waypoints, last_waypoint)
+                road_option = self._random.choice(road_options)
+                queue.append((next_waypoints[road_options.index(road_option)], road_option))
+        waypoint, road_option = queue[0]
+        self._targets[i] = (waypoint.transform.location.x, waypoint.transform.location.y)
+        self._turning[i] = road_option.value in [1, 2]
+
+    def _advance_routes(self):
+        # drop the waypoints a vehicle has reached, re-plan only those vehicles
+        reached = np.hypot(*(self._targets - self.location[:, :2]).T) < self._min_distance
+        for i in np.flatnonzero(reached):
+            queue = self._queues[i]
+            location = self.location[i]
+            while queue and np.hypot(queue[0][0].transform.location.x - location[0],
+                                     queue[0][0].transform.location.y - location[1]) < self._min_distance:
+                queue.popleft()
+            if not queue:
+                waypoint = self._map.get_waypoint(carla.Location(*location))
+                queue.append((waypoint.next(self._sampling_radius)[0], RoadOption.LANEFOLLOW))
+            self._plan(i)
+
+    def _pid(self, errors, error, gains):
+        # vectorized form of the PID*Controller._pid_control equations
+        errors[:, self._steps % errors.shape[1]] = error
+        if self._steps >= 1:
+            previous = errors[:, (self._steps - 1) % errors.shape[1]]
+            de = (error - previous) / gains['dt']
+            ie = errors.sum(axis=1) * gains['dt']
+        else:
+            de = ie = 0.0
+        return gains['K_P'] * error + gains['K_D'] * de / gains['dt'] + gains['K_I'] * ie * gains['dt']
+
+    def _hazards(self, vehicles):
+        """
+        Flag the fleet vehicles with another vehicle in their way, the vectorized form of Agent._is_vehicle_hazard.
+
+        A vehicle is in the way when it is closer than the proximity threshold within 30 degrees of the heading, is
+        not oncoming and is on the same road and lane. The geometric tests run on every pair at once; the map is
+        only queried for the few pairs that pass them.
+
+        :param vehicles: every vehicle of the world snapshot, the fleet, the ego vehicle and other actors
+        :return: boolean array, one flag per fleet vehicle
+        """
+        hazard = np.zeros(len(self.ids), dtype=bool)
+        vehicles = list(vehicles)
+        if not vehicles:
+            return hazard
+        transforms = [vehicle.get_transform() for vehicle in vehicles]
+        other_ids = np.array([vehicle.id for vehicle in vehicles])
+        other_location = np.array([(t.location.x, t.location.y, t.location.z) for t in transforms])
+        other_yaw = np.array([t.rotation.yaw for t in transforms])
+
+        heading = np.stack([np.cos(np.radians(self.yaw)), np.sin(np.radians(self.yaw))], axis=1)
+        delta = other_location[None, :, :2] - self.location[:, None, :2]
+        distance = np.hypot(delta[..., 0], delta[..., 1])
+        distance[np.array(self.ids)[:, None] == other_ids[None, :]] = np.inf
+        cosine = np.einsum('ijk,ik->ij', delta, heading) / np.maximum(distance, 1e-3)
+        same_direction = np.cos(np.radians(other_yaw[None, :] - self.yaw[:, None])) > 0.0
+        candidates = (distance < self._proximity_threshold) & (cosine > np.cos(np.radians(30.0))) & same_direction
+
+        lanes = {}
+
+        def lane(location):
+            key = tuple(location)
+            if key not in lanes:
+                waypoint = self._map.get_waypoint(carla.Location(*location))
+                lanes[key] = (waypoint.road_id, waypoint.lane_id)
+            return lanes[key]
+
+        for i, j in zip(*np.nonzero(candidates)):
+            if not hazard[i] and lane(self.location[i]) == lane(other_location[j]):
+                hazard[i] = True
+        return hazard
+
+    def run_step(self, vehicles=None):
+        """
+        Execute one step of navigation for the whole fleet.
+
+        :param vehicles: vehicles of the world snapshot that can block the fleet, all the vehicles of the world
+                         by default
+        :return: list of carla.command.ApplyVehicleControl, one per vehicle
+        """
+        self._read_state()
+        self._advance_routes()
+
+        heading = np.radians(self.yaw)
+        to_target = self._targets - self.location[:, :2]
+        angle = np.arctan2(to_target[:, 1], to_target[:, 0]) - heading
+        # signed angle in [-pi, pi], positive to the right like the lateral controller
+        angle = (angle + np.pi) % (2 * np.pi) - np.pi
+        steer = np.clip(self._pid(self._lat_errors, angle, self._lateral), -1.0, 1.0)
+
+        target_speed = np.where(self._turning, self._turning_speed, self._target_speed)
+        throttle = np.clip(self._pid(self._lon_errors, target_speed - self.speed, self._longitudinal), 0.0, 1.0)
+        self._steps += 1
+
+        if vehicles is None:
+            vehicles = self._world.get_actors().filter('vehicle.*') if self._vehicles else []
+        hazard = self._hazards(vehicles)
+        throttle[hazard] = 0.0
+        brake = hazard.astype(np.float64)
+
+        return [carla.command.ApplyVehicleControl(actor_id, carla.VehicleControl(
+                    throttle=float(t), steer=float(s), brake=float(b)))
+                for actor_id, t, s, b in zip(self.ids, throttle, steer, brake)]
+
+    def apply(self, client, vehicles=None):
+        """
+        Run one step and send all the controls in one batch.
+
+        :param client: carla.Client
+        :param vehicles: see run_step
+        """
+        client.apply_batch(self.run_step(vehicles))
@@ -10,6 +10,7 @@
 
 from enum import Enum
 from collections import deque
+import json
 import random
 import pdb
 from . import carla
@@ -59,6 +60,9 @@ class LocalPlanner(object):
 
             longitudinal_control_dict -- dictionary of arguments to setup the longitudinal PID controller
                                         {'K_P':, 'K_D':, 'K_I':, 'dt'}
+
+            gain_file -- path to a per-town gain file (see navigation/tuning.py); its target_speed,
+                         lateral_control_dict and longitudinal_control_dict are used unless given explicitly
         """
         self._vehicle = vehicle
         self._map = self._vehicle.get_world().get_map()
@@ -123,6 +127,8 @@ class LocalPlanner(object):
             'dt': self._dt}
 
         # parameters overload
+        if opt_dict and 'gain_file' in opt_dict:
+            opt_dict = dict(load_gain_file(opt_dict['gain_file']), **opt_dict)
         if opt_dict:
             if 'dt' in opt_dict:
                 self._dt = opt_dict['dt']
@@ -150,6 +156,25 @@ class LocalPlanner(object):
         # fill waypoint trajectory queue
         self._compute_next_waypoints(k=1)
 
+    def reset(self, location=None):
+        """
+        Restart planning from the vehicle's location, keeping the map and the controller settings.
+        Used after the vehicle was teleported instead of building a new planner.
+
+        :param location: where the vehicle now is, until the next tick reports it (default: its current location)
+        :return:
+        """
+        self._waypoints_queue.clear()
+        self._waypoint_buffer.clear()
+        self._vehicle_controller.reset()
+        self._global_plan = False
+        self.target_waypoint = None
+        self.new_plan = False
+        self._current_waypoint = self._map.get_waypoint(location or self._vehicle.get_location())
+        self._waypoints_queue.append((self._current_waypoint.next(self._sampling_radius)[0], RoadOption.LANEFOLLOW))
+        self._target_road_option = RoadOption.LANEFOLLOW
+        self._compute_next_waypoints(k=1)
+
     def set_speed(self, speed):
         """
         Request new target speed.
@@ -265,6 +290,19 @@ class LocalPlanner(object):
         return {'control':control,'road':self._target_road_option.value}
 
 
+def load_gain_file(path):
+    """
+    Read a per-town gain file written by navigation/tuning.py.
+
+    :param path: path to the json gain file
+    :return: dictionary with the target_speed, lateral_control_dict and longitudinal_control_dict entries found
+    """
+    with open(str(path)) as f:
+        gains = json.load(f)
+    return {key: gains[key] for key in ('target_speed', 'lateral_control_dict', 'longitudinal_control_dict')
+            if key in gains}
+
+
 def _retrieve_options(list_waypoints, current_waypoint):
     """
     Compute the type of connection between the current active waypoint and the multiple waypoints present in
@@ -87,6 +87,18 @@ def compute_magnitude_angle(target_location, current_location, orientation):
     return (norm_target, d_angle)
 
 
+def compute_curvature(vehicle_transform, waypoint):
+    """
+    Heading change required to reach a waypoint per meter travelled
+
+    :param vehicle_transform: current transform of the vehicle
+    :param waypoint: target waypoint
+    :return: curvature in 1/m
+    """
+    d_yaw = (waypoint.transform.rotation.yaw - vehicle_transform.rotation.yaw + 180.0) % 360.0 - 180.0
+    return abs(math.radians(d_yaw)) / max(distance_vehicle(waypoint, vehicle_transform), 1.0)
+
+
 def distance_vehicle(waypoint, vehicle_transform):
     loc = vehicle_transform.location
     dx = waypoint.transform.location.x - loc.x
@@ -21,17 +21,37 @@ class RoamingAgent(Agent):
     This robot respects traffic lights and other vehicles.
     """
 
-    def __init__(self, vehicle):
+    def __init__(self, vehicle, opt_dict=None):
         """
 
         :param vehicle: actor to apply to local planner logic onto
+        :param opt_dict: dictionary of arguments forwarded to the LocalPlanner
         """
         super(RoamingAgent, self).__init__(vehicle)
         self._proximity_threshold = 12.0  # meters
         self._state = AgentState.NAVIGATING
-        self._local_planner = LocalPlanner(self._vehicle)
+        self._local_planner = LocalPlanner(self._vehicle, opt_dict=opt_dict)
         self._previous_roadoption=None
         self.new_plan=False
+
+    @property
+    def target_waypoint(self):
+        """
+        Waypoint the local planner is currently steering towards.
+        """
+        return self._local_planner.target_waypoint
+
+    def reset(self, location=None):
+        """
+        Restart navigation from the vehicle's location, e.g. after it was teleported.
+
+        :param location: where the vehicle now is (default: its current location)
+        """
+        self._local_planner.reset(location)
+        self._state = AgentState.NAVIGATING
+        self._previous_roadoption = None
+        self.new_plan = False
+
     def run_step(self,debug=False):
         """
         Execute one step of navigation.
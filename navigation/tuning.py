@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" This module contains an offline harness to tune the PID gains used by the LocalPlanner.
+
+Candidate gains are evaluated against a kinematic bicycle model that stands in for the simulator, over synthetic
+routes or routes recorded in the dataset csv files, and the best candidate is written to a per-town gain file that
+LocalPlanner can load through opt_dict['gain_file']. """
+
+import ast
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import pathlib
+import random
+
+import numpy as np
+
+from . import carla
+from .controller import PIDLateralController, PIDLongitudinalController
+
+
+class KinematicVehicle(object):
+    """
+    KinematicVehicle is a kinematic bicycle model exposing the subset of the carla.Vehicle API used by the PID
+    controllers (get_transform, get_location, get_velocity).
+    """
+
+    def __init__(self, x, y, yaw, wheelbase=2.9, max_steer_angle=70.0, max_accel=4.0, drag=0.3):
+        """
+        :param x: initial x location in meters
+        :param y: initial y location in meters
+        :param yaw: initial heading in degrees
+        :param wheelbase: distance between axles in meters
+        :param max_steer_angle: wheel angle in degrees reached with steer = 1.0
+        :param max_accel: acceleration in m/s^2 reached with throttle = 1.0
+        :param drag: linear drag coefficient in 1/s
+        """
+        self.x = x
+        self.y = y
+        self.yaw = yaw
+        self.speed = 0.0
+        self._wheelbase = wheelbase
+        self._max_steer = math.radians(max_steer_angle)
+        self._max_accel = max_accel
+        self._drag = drag
+
+    def get_transform(self):
+        return carla.Transform(carla.Location(x=self.x, y=self.y), carla.Rotation(yaw=self.yaw))
+
+    def get_location(self):
+        return carla.Location(x=self.x, y=self.y)
+
+    def get_velocity(self):
+        yaw = math.radians(self.yaw)
+        return carla.Vector3D(x=self.speed * math.cos(yaw), y=self.speed * math.sin(yaw), z=0.0)
+
+    def step(self, throttle, steer, brake, dt):
+        """
+        Integrate the model for dt seconds under the given control.
+        """
+        accel = throttle * self._max_accel - brake * 2.0 * self._max_accel - self._drag * self.speed
+        self.speed = max(0.0, self.speed + accel * dt)
+        yaw = math.radians(self.yaw)
+        self.x += self.speed * math.cos(yaw) * dt
+        self.y += self.speed * math.sin(yaw) * dt
+        yaw += self.speed / self._wheelbase * math.tan(steer * self._max_steer) * dt
+        self.yaw = math.degrees(math.atan2(math.sin(yaw), math.cos(yaw)))
+
+
+class _RoutePoint(object):
+    """
+    Minimal waypoint stand-in: the lateral controller only reads waypoint.transform.location.
+    """
+
+    def __init__(self, x, y, yaw):
+        self.transform = carla.Transform(carla.Location(x=x, y=y), carla.Rotation(yaw=yaw))
+
+
+def synthetic_routes(spacing=1.0):
+    """
+    Build a set of synthetic routes covering the manoeuvres the planner faces: straight roads, left and right
+    intersection turns and lane-following curves.
+
+    :param spacing: distance between route points in meters
+    :return: dict mapping route name to an (N, 3) array of (x, y, yaw) rows
+    """
+
+    def build(segments):
+        x, y, yaw = 0.0, 0.0, 0.0
+        points = [(x, y, yaw)]
+        for length, radius in segments:
+            for _ in range(int(length / spacing)):
+                if radius:
+                    yaw += math.degrees(spacing / radius)
+                x += spacing * math.cos(math.radians(yaw))
+                y += spacing * math.sin(math.radians(yaw))
+                points.append((x, y, yaw))
+        return np.array(points)
+
+    quarter = lambda radius: 0.5 * math.pi * abs(radius)
+    return {
+        'straight': build([(120.0, None)]),
+        'left_turn': build([(40.0, None), (quarter(8.0), -8.0), (40.0, None)]),
+        'right_turn': build([(40.0, None), (quarter(8.0), 8.0), (40.0, None)]),
+        's_curve': build([(30.0, None), (quarter(30.0), 30.0), (quarter(30.0), -30.0), (30.0, None)]),
+    }
+
+
+def recorded_routes(csv_paths, min_points=20, max_gap=5.0):
+    """
+    Load routes from the dataset csv files written by auto_control.py (Location and Heading columns).
+
+    Capture resumes at a new spawn point after every collision respawn, so a file is split into one route per
+    stretch of consecutive rows closer than max_gap.
+
+    :param csv_paths: iterable of csv file paths
+    :param min_points: routes shorter than this are skipped
+    :param max_gap: distance in meters between consecutive rows above which a new route starts
+    :return: dict mapping route name to an (N, 3) array of (x, y, yaw) rows
+    """
+    routes = {}
+    for path in csv_paths:
+        path = pathlib.Path(path)
+        with open(str(path)) as csvfile:
+            rows = [(*ast.literal_eval(row['Location']), float(row['Heading'])) for row in csv.DictReader(csvfile)]
+        if not rows:
+            continue
+        rows = np.array(rows)
+        gaps = np.flatnonzero(np.hypot(*np.diff(rows[:, :2], axis=0).T) > max_gap) + 1
+        pieces = [piece for piece in np.split(rows, gaps) if len(piece) >= min_points]
+        for n, piece in enumerate(pieces):
+            routes[path.stem if len(pieces) == 1 else f'{path.stem}_{n}'] = piece
+    return routes
+
+
+def turning_points(route, max_radius=15.0):
+    """
+    Flag the route points on a turn tighter than max_radius, the intersection turns the LocalPlanner drives at its
+    turning speed (RoadOption LEFT and RIGHT); gentler lane-following curves are driven at cruise speed.
+
+    :param route: (N, 3) array of (x, y, yaw) route points
+    :param max_radius: radius in meters below which a bend counts as a turn
+    :return: boolean array, one flag per route point
+    """
+    step = np.hypot(*np.diff(route[:, :2], axis=0).T)
+    yaw = np.radians(route[:, 2])
+    turn = np.abs(np.arctan2(np.sin(np.diff(yaw)), np.cos(np.diff(yaw))))
+    tight = turn > step / max_radius
+    return np.concatenate([[False], tight]) | np.concatenate([tight, [False]])
+
+
+def simulate(route, lateral_dict, longitudinal_dict, target_speed=25.0, sim_dt=None, sampling_radius=None,
+             max_deviation=5.0, turning_speed=10.0):
+    """
+    Drive the kinematic model along a route with the planner's PID controllers.
+
+    :param route: (N, 3) array of (x, y, yaw) route points
+    :param lateral_dict: lateral PID arguments {'K_P':, 'K_D':, 'K_I':, 'dt'}
+    :param longitudinal_dict: longitudinal PID arguments {'K_P':, 'K_D':, 'K_I':, 'dt'}
+    :param target_speed: cruise speed in Km/h
+    :param sim_dt: integration step of the stand-in simulator in seconds, defaults to the controller dt so the
+                   I and D terms act as they do in the real loop
+    :param sampling_radius: look-ahead distance in meters, defaults to the LocalPlanner one
+    :param max_deviation: cross-track error in meters after which the episode is aborted
+    :param turning_speed: speed in Km/h on the turns found by turning_points, as the LocalPlanner drives them
+    :return: dict with the cost and its components; routes that are aborted or not completed add a finite penalty
+             that grows with the part of the route left
+    """
+    if sim_dt is None:
+        sim_dt = lateral_dict.get('dt', 0.03)
+    if sampling_radius is None:
+        sampling_radius = target_speed * 0.2 / 3.6
+    min_distance = sampling_radius * 0.9
+    points = [_RoutePoint(*p) for p in route]
+    xy = route[:, :2]
+    turning = turning_points(route)
+
+    vehicle = KinematicVehicle(*route[0])
+    lateral = PIDLateralController(vehicle, **lateral_dict)
+    longitudinal = PIDLongitudinalController(vehicle, **longitudinal_dict)
+
+    target = 1
+    errors, steers, speed_errors = [], [], []
+    max_steps = int(3.0 * len(route) / max(min(target_speed, turning_speed) / 3.6 * sim_dt, 1e-3))
+    for _ in range(max_steps):
+        position = np.array([vehicle.x, vehicle.y])
+        # purge the route points already reached, as the LocalPlanner does with its buffer
+        while target < len(points) - 1 and np.hypot(*(xy[target] - position)) < min_distance:
+            target += 1
+        if target >= len(points) - 1:
+            break
+        window = xy[max(0, target - 20):target + 20]
+        error = np.min(np.hypot(window[:, 0] - position[0], window[:, 1] - position[1]))
+        if error > max_deviation:
+            errors.append(max_deviation)
+            break
+
+        speed = turning_speed if turning[target] else target_speed
+        throttle = longitudinal.run_step(speed)
+        steer = lateral.run_step(points[target])
+        vehicle.step(throttle, steer, 0.0, sim_dt)
+        errors.append(error)
+        steers.append(steer)
+        speed_errors.append(3.6 * vehicle.speed - speed)
+
+    completed = target >= len(points) - 1
+    progress = min(1.0, target / max(1, len(points) - 1))
+    cross_track = float(np.sqrt(np.mean(np.square(errors)))) if errors else 0.0
+    smoothness = float(np.mean(np.abs(np.diff(steers)))) if len(steers) > 1 else 0.0
+    speed_error = float(np.mean(np.abs(speed_errors))) if speed_errors else 0.0
+    cost = cross_track + 2.0 * smoothness + 0.01 * speed_error + (0.0 if completed else 10.0 + 10.0 * (1.0 - progress))
+    return {'cost': cost, 'cross_track': cross_track, 'smoothness': smoothness,
+            'speed_error': speed_error, 'completed': completed, 'progress': progress}
+
+
+def _evaluate(task):
+    """
+    Process pool entry point: evaluate one candidate over every route.
+    """
+    candidate, routes, options = task
+    results = [simulate(route, candidate['lateral_control_dict'], candidate['longitudinal_control_dict'], **options)
+               for route in routes.values()]
+    return candidate, float(np.mean([r['cost'] for r in results])), results
+
+
+def grid_candidates(lateral_grid, longitudinal_grid, dt):
+    """
+    Enumerate every combination of the lateral and longitudinal gain grids.
+
+    :param lateral_grid: dict mapping 'K_P', 'K_D', 'K_I' to lists of values
+    :param longitudinal_grid: dict mapping 'K_P', 'K_D', 'K_I' to lists of values
+    :param dt: controller time differential stored in each candidate
+    :return: list of candidate dicts
+    """
+    keys = ('K_P', 'K_D', 'K_I')
+    lateral = [dict(zip(keys, values), dt=dt) for values in itertools.product(*(lateral_grid[k] for k in keys))]
+    longitudinal = [dict(zip(keys, values), dt=dt)
+                    for values in itertools.product(*(longitudinal_grid[k] for k in keys))]
+    return [{'lateral_control_dict': lat, 'longitudinal_control_dict': lon}
+            for lat, lon in itertools.product(lateral, longitudinal)]
+
+
+def random_candidates(lateral_grid, longitudinal_grid, dt, samples, seed=0):
+    """
+    Draw candidates uniformly (log-uniformly for positive ranges) between the min and max of each grid axis.
+    """
+    rng = random.Random(seed)
+
+    def draw(low, high):
+        if low > 0.0 and high / low > 10.0:
+            return math.exp(rng.uniform(math.log(low), math.log(high)))
+        return rng.uniform(low, high)
+
+    def sample(grid):
+        return dict({k: draw(min(grid[k]), max(grid[k])) for k in ('K_P', 'K_D', 'K_I')}, dt=dt)
+
+    return [{'lateral_control_dict': sample(lateral_grid), 'longitudinal_control_dict': sample(longitudinal_grid)}
+            for _ in range(samples)]
+
+
+def tune(routes, candidates, target_speed=25.0, sim_dt=None, processes=None, chunksize=4):
+    """
+    Evaluate candidates in parallel across a process pool.
+
+    :param routes: dict mapping route name to an (N, 3) array of (x, y, yaw) rows
+    :param candidates: list of candidate dicts with lateral_control_dict and longitudinal_control_dict
+    :param target_speed: cruise speed in Km/h
+    :param sim_dt: integration step of the stand-in simulator in seconds, defaults to each candidate's controller dt
+    :param processes: number of worker processes, defaults to the cpu count
+    :return: list of (cost, candidate, per-route results), the candidates completing the most routes first, then by
+             cost
+    """
+    options = {'target_speed': target_speed, 'sim_dt': sim_dt}
+    tasks = [(candidate, routes, options) for candidate in candidates]
+    with multiprocessing.Pool(processes) as pool:
+        scored = [(cost, candidate, results)
+                  for candidate, cost, results in pool.imap_unordered(_evaluate, tasks, chunksize=chunksize)]
+    scored.sort(key=lambda item: (-sum(r['completed'] for r in item[2]), item[0]))
+    return scored
+
+
+def save_gain_file(path, town, candidate, target_speed, cost=None):
+    """
+    Write a gain file in the format read by navigation.local_planner.load_gain_file.
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    content = {
+        'town': town,
+        'target_speed': target_speed,
+        'lateral_control_dict': candidate['lateral_control_dict'],
+        'longitudinal_control_dict': candidate['longitudinal_control_dict'],
+    }
+    if cost is not None:
+        content['cost'] = cost
+    with open(str(path), 'w') as f:
+        json.dump(content, f, indent=4)
+    return path
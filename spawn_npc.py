@@ -10,8 +10,11 @@
 
 
 
-from carladep import *
+from carladep import carla
+from carladep.spawn import SpawnPointManager
+from navigation.fleet import FleetDriver
 
+import argparse
 import logging
 import random
 
@@ -47,6 +50,20 @@ def main():
         default= True,
         action='store_true',
         help='avoid spawning vehicles prone to accidents')
+    argparser.add_argument(
+        '--spawn-strategy',
+        choices=SpawnPointManager.STRATEGIES,
+        default='random',
+        help='random free spawn points, or spread them evenly across the map (default: random)')
+    argparser.add_argument(
+        '--fleet',
+        action='store_true',
+        help='drive the NPCs from this client with batched PID control instead of server autopilot')
+    argparser.add_argument(
+        '--seed',
+        default=None,
+        type=int,
+        help='seed of the blueprints, spawn points and fleet routes of the NPCs (default: random)')
     args = argparser.parse_args()
 
     logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
@@ -58,6 +75,8 @@ def main():
     try:
 
         world = client.get_world()
+        # one generator for every random choice, so a seed repeats the whole run
+        rng = random.Random(args.seed)
         blueprints = world.get_blueprint_library().filter('vehicle.*')
 
         if args.safe:
@@ -65,13 +84,14 @@ def main():
             blueprints = [x for x in blueprints if not x.id.endswith('isetta')]
             blueprints = [x for x in blueprints if not x.id.endswith('carlacola')]
 
-        spawn_points = world.get_map().get_spawn_points()
+        # only spawn points no vehicle is standing on, so the batch does not fail on collisions
+        spawn_manager = SpawnPointManager(world.get_map().get_spawn_points(), rng=rng)
+        spawn_manager.update_from_world(world)
+        spawn_points = spawn_manager.choose(args.number_of_vehicles, args.spawn_strategy)
         number_of_spawn_points = len(spawn_points)
 
-        if args.number_of_vehicles < number_of_spawn_points:
-            random.shuffle(spawn_points)
-        elif args.number_of_vehicles > number_of_spawn_points:
-            msg = 'requested %d vehicles, but could only find %d spawn points'
+        if args.number_of_vehicles > number_of_spawn_points:
+            msg = 'requested %d vehicles, but could only find %d free spawn points'
             logging.warning(msg, args.number_of_vehicles, number_of_spawn_points)
             args.number_of_vehicles = number_of_spawn_points
 
@@ -84,12 +104,15 @@ def main():
         for n, transform in enumerate(spawn_points):
             if n >= args.number_of_vehicles:
                 break
-            blueprint = random.choice(blueprints)
+            blueprint = rng.choice(blueprints)
             if blueprint.has_attribute('color'):
-                color = random.choice(blueprint.get_attribute('color').recommended_values)
+                color = rng.choice(blueprint.get_attribute('color').recommended_values)
                 blueprint.set_attribute('color', color)
             blueprint.set_attribute('role_name', 'autopilot')
-            batch.append(SpawnActor(blueprint, transform).then(SetAutopilot(FutureActor, True)))
+            if args.fleet:
+                batch.append(SpawnActor(blueprint, transform))
+            else:
+                batch.append(SpawnActor(blueprint, transform).then(SetAutopilot(FutureActor, True)))
 
         for response in client.apply_batch_sync(batch):
             if response.error:
@@ -99,6 +122,13 @@ def main():
 
         print('spawned %d vehicles, press Ctrl+C to exit.' % len(actor_list))
 
+        if args.fleet:
+            world.wait_for_tick()
+            fleet = FleetDriver(list(world.get_actors(actor_list)), world.get_map(), seed=rng.getrandbits(32))
+            while True:
+                world.wait_for_tick()
+                fleet.apply(client)
+
         while True:
             world.wait_for_tick()
 
@@ -0,0 +1,12 @@
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+try:
+    import carla  # noqa: F401
+except ImportError:
+    # no simulator egg on this machine, the client-side code runs on the benchmarks' stand-in
+    from benchmarks import fake_carla
+    fake_carla.install()
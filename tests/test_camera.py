@@ -0,0 +1,55 @@
+import sys
+
+import carla
+import numpy as np
+import pygame
+import pytest
+
+from carladep.sensor import CameraManager
+
+
+class Hud(object):
+    dim = (8, 4)
+
+    def notification(self, text, seconds=2.0):
+        pass
+
+
+@pytest.fixture
+def camera():
+    world = carla.World()
+    blueprint = world.get_blueprint_library().filter('vehicle.*')[0]
+    vehicle = world.spawn_actor(blueprint, carla.Transform(carla.Location(), carla.Rotation()))
+    camera = CameraManager(vehicle, Hud())
+    camera.set_sensor(0, notify=False)
+    yield camera
+    camera.sensor.destroy()
+
+
+def frame(number, value):
+    return carla.Image(8, 4, number, bytes([value]) * (8 * 4 * 4))
+
+
+@pytest.mark.skipif(sys.byteorder != 'little', reason='BGRA frames are only copied as they are on little-endian')
+def test_callback_never_writes_the_displayed_surface(camera):
+    display = pygame.Surface((8, 4))
+    CameraManager._parse_image(lambda: camera, frame(1, 10))
+    camera.render(display)
+    shown = camera.surface
+    # frames keep arriving while the main thread still shows the first one
+    for number in range(2, 6):
+        CameraManager._parse_image(lambda: camera, frame(number, 20 * number))
+        assert camera.surface is shown
+        assert pygame.surfarray.pixels3d(shown)[0, 0, 0] == 10
+    camera.render(display)
+    assert camera.surface is not shown
+    np.testing.assert_array_equal(pygame.surfarray.array3d(display)[0, 0], (100, 100, 100))
+
+
+def test_render_keeps_the_front_surface_without_a_new_frame(camera):
+    display = pygame.Surface((8, 4))
+    CameraManager._parse_image(lambda: camera, frame(1, 10))
+    camera.render(display)
+    shown = camera.surface
+    camera.render(display)
+    assert camera.surface is shown
@@ -0,0 +1,61 @@
+import numpy as np
+
+from carladep.framebus import FrameBus
+
+
+class Image(object):
+    def __init__(self, width, height, frame, seed=0):
+        self.width = width
+        self.height = height
+        self.frame_number = frame
+        self.bgra = np.random.RandomState(seed).randint(0, 256, (height, width, 4), dtype=np.uint8)
+        self.raw_data = self.bgra.tobytes()
+
+
+def test_publish_resizes_and_reorders_to_rgb():
+    bus = FrameBus(size=(8, 4))
+    image = Image(16, 8, frame=7)
+    bus.publish(image)
+    with bus.read() as (frame, array):
+        assert frame == 7
+        assert array.shape == (8, 4, 3)
+        # nearest neighbour: output (x, y) samples source (2x, 2y), BGR -> RGB
+        expected = image.bgra[::2, ::2, 2::-1].transpose(1, 0, 2)
+        np.testing.assert_array_equal(array, expected)
+
+
+def test_read_without_frame():
+    bus = FrameBus(size=(4, 4))
+    assert bus.acquire() is None
+    with bus.read() as latest:
+        assert latest is None
+
+
+def test_pinned_buffer_is_not_overwritten():
+    bus = FrameBus(size=(4, 4), buffers=3)
+    bus.publish(Image(4, 4, frame=1, seed=1))
+    frame, array, token = bus.acquire()
+    pinned = array.copy()
+    for n in range(2, 10):
+        bus.publish(Image(4, 4, frame=n, seed=n))
+    np.testing.assert_array_equal(array, pinned)
+    assert bus.frame == 9
+    bus.release(token)
+
+
+def test_buffers_are_reused_and_frames_dropped_when_all_pinned():
+    bus = FrameBus(size=(4, 4), buffers=2)
+    bus.publish(Image(4, 4, frame=1))
+    first = bus.acquire()
+    bus.publish(Image(4, 4, frame=2))
+    second = bus.acquire()
+    assert first[2] != second[2]
+    # the front buffer and the only other one are pinned, nothing is left to write into
+    bus.publish(Image(4, 4, frame=3))
+    assert bus.dropped == 1 and bus.frame == 2
+    bus.release(first[2])
+    bus.publish(Image(4, 4, frame=4))
+    assert bus.frame == 4 and bus.published == 3
+    with bus.read() as (frame, array):
+        assert array is first[1]
+    bus.release(second[2])
@@ -0,0 +1,98 @@
+import threading
+
+from carladep.hub import EventChannel, SensorHub
+
+
+def test_bundle_completes_when_every_required_source_pushed():
+    hub = SensorHub(required=('camera', 'state'))
+    hub.push('camera', 5, 'image5')
+    assert hub.drain() == []
+    hub.push('state', 5, 'state5')
+    bundles = hub.drain()
+    assert [bundle.frame for bundle in bundles] == [5]
+    assert bundles[0].data == {'camera': 'image5', 'state': 'state5'}
+    assert hub.drain() == []
+
+
+def test_bundles_come_out_in_frame_order_and_evict_older_pending():
+    hub = SensorHub(required=('camera', 'state'))
+    hub.push('camera', 1, 'image1')
+    hub.push('camera', 2, 'image2')
+    hub.push('state', 2, 'state2')
+    hub.push('camera', 3, 'image3')
+    hub.push('state', 3, 'state3')
+    assert [bundle.frame for bundle in hub.drain()] == [2, 3]
+    # frame 1 never got its state and was evicted by frame 2
+    assert hub.missing == {'state': 1}
+    # its state arriving now is late
+    hub.push('state', 1, 'state1')
+    assert hub.late == {'state': 1}
+    assert hub.drain() == []
+
+
+def test_optional_events_join_their_frame_or_the_next_bundle():
+    hub = SensorHub(required=('camera', 'state'))
+    hub.push('collision', 1, 'before')
+    hub.push('camera', 2, 'image2')
+    hub.push('collision', 2, 'during')
+    hub.push('state', 2, 'state2')
+    hub.push('camera', 3, 'image3')
+    hub.push('state', 3, 'state3')
+    first, second = hub.drain()
+    assert first.data['collision'] == ['before', 'during']
+    assert 'collision' not in second.data
+
+
+def test_full_queue_drops_the_oldest_bundle():
+    hub = SensorHub(required=('state',), maxsize=2)
+    for frame in range(4):
+        hub.push('state', frame, frame)
+    assert [bundle.frame for bundle in hub.drain()] == [2, 3]
+    assert hub.dropped == 2
+    assert hub.completed == 4
+
+
+def test_get_waits_for_a_bundle_from_another_thread():
+    hub = SensorHub(required=('state',))
+    assert hub.get(timeout=0.01) is None
+    timer = threading.Timer(0.05, hub.push, ('state', 9, 'state9'))
+    timer.start()
+    bundle = hub.get(timeout=5.0)
+    timer.join()
+    assert bundle.frame == 9
+
+
+def test_reset_forgets_pending_and_complete_bundles():
+    hub = SensorHub(required=('camera', 'state'))
+    hub.push('state', 1, 'state1')
+    hub.push('camera', 1, 'image1')
+    hub.push('camera', 2, 'image2')
+    hub.push('collision', 2, 'hit')
+    hub.reset()
+    assert hub.drain() == []
+    hub.push('state', 2, 'state2')
+    assert hub.drain() == []
+
+
+def test_event_channel_drains_in_arrival_order():
+    channel = EventChannel()
+    for event in 'abc':
+        channel.put(event)
+    assert channel.drain() == ['a', 'b', 'c']
+    assert channel.drain() == []
+
+
+def test_event_channel_drops_stale_frames():
+    channel = EventChannel()
+    channel.put('old', frame=3)
+    channel.put('at', frame=5)
+    channel.put('unknown')
+    channel.put('new', frame=6)
+    assert channel.drain(after=5) == ['unknown', 'new']
+
+
+def test_event_channel_discards_oldest_beyond_maxlen():
+    channel = EventChannel(maxlen=2)
+    for event in range(4):
+        channel.put(event)
+    assert channel.drain() == [2, 3]
@@ -0,0 +1,188 @@
+import threading
+import time
+import uuid
+
+import numpy as np
+import pytest
+
+from carladep.inference import InferenceClient, InferenceScheduler, InferenceServer, InferenceWorker
+
+
+class ToyAgent(object):
+    """Deterministic stand-in for the agents' inference(state, condition) API."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def inference(self, state, condition):
+        self.calls.append(condition)
+        if self.delay:
+            time.sleep(self.delay)
+        state = np.asarray(state, dtype=np.float64)
+        return float(state.mean() / 255.0), float(condition * 0.1 - state[0, 0, 0] / 255.0)
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('condition not met within %.1fs' % timeout)
+        time.sleep(0.001)
+
+
+def test_worker_keeps_only_the_latest_submission():
+    worker = InferenceWorker(ToyAgent(delay=0.05))
+    released = []
+    try:
+        states = [np.full((2, 2, 3), n, dtype=np.uint8) for n in range(5)]
+        for frame, state in enumerate(states):
+            worker.submit(state, 3, frame, release=lambda frame=frame: released.append(frame))
+        wait_for(lambda: worker.latest() is not None and worker.latest().frame == 4)
+        # frames replaced before the worker picked them up are dropped, never run late
+        assert worker.dropped >= 3 and worker.dropped + worker.completed == 5
+        assert sorted(released) == [0, 1, 2, 3, 4]
+        assert worker.latest().steer == pytest.approx(ToyAgent().inference(states[4], 3)[1])
+    finally:
+        worker.stop()
+
+
+def test_worker_results_follow_submission_order():
+    worker = InferenceWorker(ToyAgent())
+    try:
+        for frame in range(20):
+            worker.submit(np.full((2, 2, 3), frame, dtype=np.uint8), 3, frame)
+            wait_for(lambda: worker.latest() is not None and worker.latest().frame == frame)
+        assert worker.completed == 20 and worker.dropped == 0
+    finally:
+        worker.stop()
+
+
+def test_worker_clear_drops_older_results():
+    worker = InferenceWorker(ToyAgent(delay=0.05))
+    try:
+        worker.submit(np.zeros((2, 2, 3), dtype=np.uint8), 3, 10)
+        time.sleep(0.01)
+        worker.clear(11)
+        time.sleep(0.1)
+        assert worker.latest() is None
+        worker.submit(np.zeros((2, 2, 3), dtype=np.uint8), 3, 11)
+        wait_for(lambda: worker.latest() is not None)
+        assert worker.latest().frame == 11
+    finally:
+        worker.stop()
+
+
+@pytest.fixture
+def server():
+    agent = ToyAgent()
+    server = InferenceServer(agent, name='lfi_test_%s' % uuid.uuid4().hex[:12], slots=4, size=(16, 8),
+                             max_wait=0.001)
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            if not server.step():
+                time.sleep(server.poll)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield server, agent
+    stop.set()
+    thread.join(timeout=2.0)
+    server.buffer.close(unlink=True)
+
+
+def test_server_round_trip_matches_direct_inference(server):
+    server, agent = server
+    client = InferenceClient(server.buffer.shm.name, slot=1, timeout=2.0)
+    rng = np.random.RandomState(0)
+    try:
+        for condition in (1, 2, 3, 4):
+            state = rng.randint(0, 256, (16, 8, 3), dtype=np.uint8)
+            assert client.inference(state, condition) == pytest.approx(ToyAgent().inference(state, condition))
+    finally:
+        client.close()
+
+
+def test_server_answers_concurrent_clients(server):
+    server, agent = server
+    rng = np.random.RandomState(1)
+    states = [rng.randint(0, 256, (16, 8, 3), dtype=np.uint8) for _ in range(4)]
+    results = {}
+
+    def run(slot):
+        client = InferenceClient(server.buffer.shm.name, slot=slot, timeout=2.0)
+        try:
+            results[slot] = [client.inference(states[slot], condition) for condition in (1, 2, 3)]
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=run, args=(slot,)) for slot in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5.0)
+    for slot in range(4):
+        expected = [ToyAgent().inference(states[slot], condition) for condition in (1, 2, 3)]
+        assert results[slot] == pytest.approx(expected)
+    assert server.requests == 12
+
+
+class FailingAgent(ToyAgent):
+    def inference(self, state, condition):
+        if condition == 2:
+            raise ValueError('bad request')
+        return super(FailingAgent, self).inference(state, condition)
+
+
+def test_failed_request_is_answered_with_an_error(server):
+    server, agent = server
+    server.network = FailingAgent()
+    client = InferenceClient(server.buffer.shm.name, timeout=2.0)
+    state = np.zeros((16, 8, 3), dtype=np.uint8)
+    try:
+        with pytest.raises(RuntimeError):
+            client.inference(state, 2)
+        # the server keeps serving the other requests
+        assert client.inference(state, 3) == pytest.approx(ToyAgent().inference(state, 3))
+    finally:
+        client.close()
+
+
+def test_clients_claim_distinct_slots(server):
+    server, agent = server
+    name = server.buffer.shm.name
+    clients = [InferenceClient(name) for _ in range(server.buffer.slots)]
+    try:
+        assert sorted(client.slot for client in clients) == list(range(server.buffer.slots))
+        with pytest.raises(RuntimeError):
+            InferenceClient(name)
+        with pytest.raises(RuntimeError):
+            InferenceClient(name, slot=clients[0].slot)
+        clients.pop().close()
+        replacement = InferenceClient(name)
+        clients.append(replacement)
+        assert replacement.slot == server.buffer.slots - 1
+    finally:
+        for client in clients:
+            client.close()
+
+
+def test_scheduler_reset_forgets_history_and_error():
+    scheduler = InferenceScheduler(every=3, extrapolate=True)
+    assert scheduler.due(0)
+    scheduler.update(0, 0.1)
+    assert not scheduler.due(1)
+    assert scheduler.due(3)
+    scheduler.update(3, 0.4)
+    assert scheduler.predict(4) == pytest.approx(0.5)
+    assert len(scheduler.steer_error) == 1
+    scheduler.reset()
+    assert scheduler.predict(200) is None
+    assert len(scheduler.steer_error) == 0
+    # the first result after a reset runs right away and is not compared with the stale steer
+    assert scheduler.due(200)
+    scheduler.update(200, -0.8)
+    assert len(scheduler.steer_error) == 0
+    assert scheduler.predict(201) == pytest.approx(-0.8)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""Tune the LocalPlanner PID gains offline and write a per-town gain file"""
+
+import argparse
+import logging
+import math
+import pathlib
+import sys
+
+from navigation.tuning import grid_candidates, random_candidates, recorded_routes, save_gain_file, \
+    synthetic_routes, tune
+
+
+def parse_grid(text):
+    """'0.1,0.5,1.0' -> [0.1, 0.5, 1.0]"""
+    return [float(x) for x in text.split(',')]
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        '--town',
+        default='Town07',
+        help='town name, used as gain file name (default: Town07)')
+    argparser.add_argument(
+        '--routes',
+        metavar='CSV',
+        nargs='*',
+        default=[],
+        help='dataset csv files to use as recorded routes (default: synthetic routes only)')
+    argparser.add_argument(
+        '--speed',
+        default=25.0,
+        type=float,
+        help='target speed in Km/h (default: 25)')
+    argparser.add_argument(
+        '--dt',
+        default=0.04,
+        type=float,
+        help='controller time differential in seconds (default: 0.04)')
+    argparser.add_argument(
+        '--sim-dt',
+        default=None,
+        type=float,
+        help='integration step of the kinematic stand-in in seconds (default: the controller --dt)')
+    argparser.add_argument('--lat-kp', type=parse_grid, default=parse_grid('0.15,0.3,0.5,0.6,0.75,1.0'))
+    argparser.add_argument('--lat-kd', type=parse_grid, default=parse_grid('0.0,0.002,0.01,0.02'))
+    argparser.add_argument('--lat-ki', type=parse_grid, default=parse_grid('0.0,5,20,25'))
+    argparser.add_argument('--lon-kp', type=parse_grid, default=parse_grid('6'))
+    argparser.add_argument('--lon-kd', type=parse_grid, default=parse_grid('0.05'))
+    argparser.add_argument('--lon-ki', type=parse_grid, default=parse_grid('2'))
+    argparser.add_argument(
+        '--search',
+        choices=['grid', 'random'],
+        default='grid',
+        help='sweep the whole grid or sample between its bounds (default: grid)')
+    argparser.add_argument(
+        '--samples',
+        default=200,
+        type=int,
+        help='number of candidates for random search (default: 200)')
+    argparser.add_argument(
+        '-j', '--processes',
+        default=None,
+        type=int,
+        help='worker processes (default: cpu count)')
+    argparser.add_argument(
+        '-o', '--output',
+        default='gains',
+        help='folder of the per-town gain files (default: gains)')
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+
+    routes = synthetic_routes()
+    routes.update(recorded_routes(args.routes))
+    lateral_grid = {'K_P': args.lat_kp, 'K_D': args.lat_kd, 'K_I': args.lat_ki}
+    longitudinal_grid = {'K_P': args.lon_kp, 'K_D': args.lon_kd, 'K_I': args.lon_ki}
+    if args.search == 'grid':
+        candidates = grid_candidates(lateral_grid, longitudinal_grid, args.dt)
+    else:
+        candidates = random_candidates(lateral_grid, longitudinal_grid, args.dt, args.samples)
+    logging.info('evaluating %d candidates over %d routes', len(candidates), len(routes))
+
+    scored = tune(routes, candidates, target_speed=args.speed, sim_dt=args.sim_dt, processes=args.processes)
+    for cost, candidate, _ in scored[:5]:
+        logging.info('cost % 8.3f  lateral %s  longitudinal %s', cost,
+                     candidate['lateral_control_dict'], candidate['longitudinal_control_dict'])
+
+    cost, best, results = scored[0]
+    if not math.isfinite(cost):
+        logging.error('no candidate reached a finite cost, not writing a gain file')
+        sys.exit(1)
+    completed = sum(r['completed'] for r in results)
+    if completed < len(results):
+        logging.warning('the best candidate completes only %d of %d routes', completed, len(results))
+    path = save_gain_file(pathlib.Path(args.output) / f'{args.town}.json', args.town, best, args.speed, cost)
+    print(f'wrote {path}')
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass